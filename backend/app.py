@@ -1,38 +1,272 @@
+import os
+import json
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict
 import uvicorn
 import threading
-from typing import Dict
+from typing import Dict, List
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from core.ngrams import NgramModel
+from core.catalog import catalog_for
+from core.interpolation import INTERPOLATION_MODES
+from core.scoring import SCORING_METHODS
+from core.binary import BINARY_EXTENSION, convert_pickle, holds_model
+from core.cache import PredictionCache, DEFAULT_MAX_ENTRIES, DEFAULT_TTL_SECONDS
+from core.registry import ModelRegistry
+from core.mixture import MixtureModel, normalize_weights, DEFAULT_PREFIX_CACHE_ENTRIES
+from core.phrase import (PhraseSearch, PHRASE_METHODS, MAX_PHRASE_WORDS, MAX_BEAM_WIDTH, DEFAULT_MAX_WORDS,
+                         DEFAULT_BEAM_WIDTH, DEFAULT_LENGTH_PENALTY, DEFAULT_EXPANSION_ENTRIES)
+from core.overlay import OverlayStore, validate_key, DEFAULT_MAX_NGRAMS, DEFAULT_OVERLAY_WEIGHT
+from core.quantized import QuantizedModel, QUANTIZED_EXTENSION
+from core.settings import SharedSettings
+from core.metrics import METRICS
+from core.profiler import PROFILER
+from core.session import SessionContext, Resync, MAX_SESSION_CHARS
+from core.serving import (ServingExecutor, Overloaded, Superseded, WorkTimeout, DEFAULT_PREDICT_WORKERS,
+                          DEFAULT_LOAD_WORKERS, DEFAULT_MAX_PENDING, DEFAULT_PREDICT_TIMEOUT, DEFAULT_LOAD_TIMEOUT)
 from typing import Optional
 from datetime import datetime, timezone
 
+# DEBUG shows per-request model internals (tokens, top predictions)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("app")
+
+# per-stage prediction timings for /metrics; costs a few microseconds per prediction
+METRICS.enabled = os.environ.get("METRICS_ENABLED", "1") != "0"
+METRICS.stage_sample_every = max(1, int(os.environ.get("METRICS_STAGE_SAMPLE_EVERY", METRICS.stage_sample_every)))
+# the sampling profiler endpoints under /debug/profiler are only served when opted in
+ENABLE_PROFILER = os.environ.get("ENABLE_PROFILER", "0") == "1"
+
+# "dict" keeps the mutable Counter tables, "compact" the read-only CSR arrays,
+# "mmap" maps the .ngb binary models (see core/binary.py) shared by all workers,
+# "quantized" loads backoff-only .ngq exports (see core/quantized.py)
+MODEL_STORAGE = os.environ.get("MODEL_STORAGE", "dict")
+# set by the launcher when several worker processes serve the app (see __main__)
+SHARED_SETTINGS_FILE = os.environ.get("SHARED_SETTINGS_FILE")
+
+MODEL_FILES = {
+    "all": "all.pkl",
+    "casual": "cas-en.pkl",
+    "formal": "std-en.pkl",
+    "poetic": "poet-en.pkl"
+}
+
+# models answered by combining others at query time instead of loading a file;
+# weights of 1.0 sum the counts, which is what a model trained on every corpus holds
+MODEL_MIXTURES = {
+    "all": {"casual": 1.0, "formal": 1.0, "poetic": 1.0}
+}
+# comma-separated names from MODEL_MIXTURES to serve as mixtures, e.g. "all"
+MIXTURE_MODELS = {name.strip() for name in os.environ.get("MIXTURE_MODELS", "").split(",") if name.strip()}
+# merged prefixes each mixture keeps, per order
+MIXTURE_CACHE_ENTRIES = int(os.environ.get("MIXTURE_CACHE_ENTRIES", DEFAULT_PREFIX_CACHE_ENTRIES))
+# per-request blends (the "mixture" field of /predict) kept built, least recently used dropped
+MIXTURE_BLEND_CACHE = int(os.environ.get("MIXTURE_BLEND_CACHE", 8))
+
+# per-user/per-site overlays ("user:<id>", "site:<host>"), learned through /overlays/{key}/learn
+OVERLAY_DIR = os.environ.get("OVERLAY_DIR", os.path.join("state", "overlays"))
+# learned overlays kept in memory; the least recently used are dropped and reread from OVERLAY_DIR
+OVERLAY_MEMORY_BUDGET_MB = float(os.environ.get("OVERLAY_MEMORY_BUDGET_MB", 64))
+# n-grams one overlay keeps; the rarest are pruned past this
+OVERLAY_MAX_NGRAMS = int(os.environ.get("OVERLAY_MAX_NGRAMS", DEFAULT_MAX_NGRAMS))
+# how many base-model counts one learned count is worth
+OVERLAY_WEIGHT = float(os.environ.get("OVERLAY_WEIGHT", DEFAULT_OVERLAY_WEIGHT))
+
+# memoized next-word expansions /predict/phrase keeps per model, and how many models keep theirs
+PHRASE_EXPANSION_CACHE = int(os.environ.get("PHRASE_EXPANSION_CACHE", DEFAULT_EXPANSION_ENTRIES))
+PHRASE_SEARCH_MODELS = int(os.environ.get("PHRASE_SEARCH_MODELS", 4))
+
+# 0 keeps every model that has been used; otherwise idle models are evicted
+# least recently used first once the resident total passes the budget
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get("MODEL_MEMORY_BUDGET_MB", 0))
+# comma-separated model names to load at startup, e.g. "all" or "all,casual"
+PRELOAD_MODELS = os.environ.get("PRELOAD_MODELS", "")
+
 ngram_model = None
-model_cache: Dict[str, NgramModel] = {}
-cache_lock = threading.Lock()
+ngram_model_name = None
+MAX_BATCH_SIZE = 10000
+PREDICTION_METHODS = ("backoff", "interpolation", "completion", *SCORING_METHODS)
+BATCH_TIMEOUT_SECONDS = float(os.environ.get("BATCH_TIMEOUT_SECONDS", 30.0))
+
+# model work runs in thread pools so the event loop keeps answering other requests
+serving = ServingExecutor(
+    predict_workers=int(os.environ.get("PREDICT_WORKERS", DEFAULT_PREDICT_WORKERS)),
+    load_workers=int(os.environ.get("LOAD_WORKERS", DEFAULT_LOAD_WORKERS)),
+    max_pending=int(os.environ.get("PREDICT_MAX_PENDING", DEFAULT_MAX_PENDING)),
+    predict_timeout=float(os.environ.get("PREDICT_TIMEOUT_SECONDS", DEFAULT_PREDICT_TIMEOUT)),
+    load_timeout=float(os.environ.get("LOAD_TIMEOUT_SECONDS", DEFAULT_LOAD_TIMEOUT))
+)
+
+prediction_cache = PredictionCache(
+    max_entries=int(os.environ.get("PREDICTION_CACHE_SIZE", DEFAULT_MAX_ENTRIES)),
+    ttl_seconds=float(os.environ.get("PREDICTION_CACHE_TTL", DEFAULT_TTL_SECONDS))
+)
+# bumped on every model change so results computed on an old model are never served
+cache_generation = 0
+
+# serialises writers; readers never take it and keep whichever snapshot they grabbed
+update_lock = threading.Lock()
+# held to replace the active model, so an update never swaps in a copy of a model switched away from
+model_swap_lock = threading.Lock()
+
+def invalidate_prediction_cache():
+    global cache_generation
+    cache_generation += 1
+    prediction_cache.clear()
+
+def shared_binary(filename: str) -> Optional[str]:
+    """The .ngb form of a pickled model, when it has one; higher-order models have none"""
+    pkl_path = os.path.join("trained_models", filename)
+    ngb_path = os.path.splitext(pkl_path)[0] + BINARY_EXTENSION
+    if holds_model(pkl_path) and os.path.exists(ngb_path):
+        return os.path.basename(ngb_path)
+    return None
+
+def load_model_file(filename) -> Optional[NgramModel]:
+    if isinstance(filename, dict):
+        # a mixture: its components are loaded, and shared, through the registry
+        return MixtureModel({name: model_registry.get(name) for name in filename}, filename, MIXTURE_CACHE_ENTRIES)
+    if MODEL_STORAGE == "quantized":
+        return QuantizedModel.load(os.path.splitext(filename)[0] + QUANTIZED_EXTENSION)
+    if MODEL_STORAGE == "mmap" and shared_binary(filename):
+        model = NgramModel.load_model(shared_binary(filename))
+    else:
+        # without a binary form (orders above 3) an mmap server loads the pickle
+        model = NgramModel.load_model(filename, compact=MODEL_STORAGE == "compact")
+    if model is not None and model.is_trained:
+        # built here on the load pool rather than on the first completion request
+        model.completion_index()
+    return model
+
+model_sources = {name: MODEL_MIXTURES[name] if name in MIXTURE_MODELS else filename
+                 for name, filename in MODEL_FILES.items()}
+model_registry = ModelRegistry(model_sources, load_model_file,
+                               memory_budget=int(MODEL_MEMORY_BUDGET_MB * 1024 * 1024))
+overlay_store = OverlayStore(OVERLAY_DIR, int(OVERLAY_MEMORY_BUDGET_MB * 1024 * 1024), OVERLAY_MAX_NGRAMS)
+
+def get_active_model() -> Optional[NgramModel]:
+    # the active model is loaded on first use rather than at startup, and
+    # reloaded when another worker switched the shared active model
+    global ngram_model, ngram_model_name
+    name = user_settings["active_model"]
+    if ngram_model is None or ngram_model_name != name:
+        model = model_registry.get(name, pin=True)
+        with model_swap_lock:
+            if ngram_model_name is not None:
+                invalidate_prediction_cache()
+            ngram_model, ngram_model_name = model, name
+    return ngram_model
+
+async def active_model() -> Optional[NgramModel]:
+    if ngram_model is None or ngram_model_name != user_settings["active_model"]:
+        return await serving.load(get_active_model)
+    return ngram_model
+
+mixture_blends: "OrderedDict[tuple, MixtureModel]" = OrderedDict()
+# guards mixture_blends and phrase_searches, which registry evictions prune from other threads
+model_users_lock = threading.Lock()
+
+async def blended_model(weights: Dict[str, float]) -> MixtureModel:
+    """A mixture of file-backed models with per-request weights, reused while its components stay loaded"""
+    weights = normalize_weights(weights)
+    unknown = [name for name in weights if name not in MODEL_FILES or name in MIXTURE_MODELS]
+    if unknown:
+        raise ValueError(f"Unknown mixture components: {', '.join(unknown)}")
+
+    components = {}
+    for name in weights:
+        if model_registry.is_resident(name):
+            components[name] = model_registry.get(name)
+        else:
+            components[name] = await serving.load(model_registry.get, name)
+
+    key = tuple(weights.items())
+    with model_users_lock:
+        mixture = mixture_blends.get(key)
+    if mixture is None or any(mixture.components[name] is not model for name, model in components.items()):
+        mixture = await serving.load(MixtureModel, components, weights, MIXTURE_CACHE_ENTRIES)
+    with model_users_lock:
+        mixture_blends[key] = mixture
+        mixture_blends.move_to_end(key)
+        while len(mixture_blends) > MIXTURE_BLEND_CACHE:
+            mixture_blends.popitem(last=False)
+    # a component evicted before the blend was cached would be kept alive by it;
+    # checked after caching, outside model_users_lock, as evictions take the locks the other way round
+    if not all(model_registry.is_resident(name) for name in weights):
+        with model_users_lock:
+            if mixture_blends.get(key) is mixture:
+                del mixture_blends[key]
+    return mixture
+
+phrase_searches: "OrderedDict[str, PhraseSearch]" = OrderedDict()
+
+def phrase_search(model, model_name: str) -> PhraseSearch:
+    """The beam search of ``model``, keeping its memoized expansions while the model stays the same"""
+    with model_users_lock:
+        search = phrase_searches.get(model_name)
+        if search is None or search.model is not model:
+            search = PhraseSearch(model, PHRASE_EXPANSION_CACHE)
+        phrase_searches[model_name] = search
+        phrase_searches.move_to_end(model_name)
+        while len(phrase_searches) > PHRASE_SEARCH_MODELS:
+            phrase_searches.popitem(last=False)
+    return search
+
+def release_model(model):
+    """Drop the blends, phrase searches and overlay models built on an evicted model, so its memory is freed"""
+    with model_users_lock:
+        released = [model]
+        for key, blend in list(mixture_blends.items()):
+            if any(component is model for component in blend.components.values()):
+                released.append(mixture_blends.pop(key))
+        for name, search in list(phrase_searches.items()):
+            if any(search.model is gone or getattr(search.model, 'base', None) is gone for gone in released):
+                del phrase_searches[name]
+    for gone in released:
+        overlay_store.release(gone)
+
+model_registry.on_evict = release_model
+
+def build_scorer(model, method: str):
+    model.scorer(method)
+    # the tables it built now count against MODEL_MEMORY_BUDGET_MB
+    model_registry.resize(model)
+
+async def overlay_model(base, key: str):
+    """``base`` seen through overlay ``key``, or None while nothing was learned for it"""
+    known, model = overlay_store.peek(validate_key(key), base, OVERLAY_WEIGHT)
+    if known:
+        return model
+    # reading the overlay file and building its model stay off the event loop
+    return await serving.load(overlay_store.model, key, base, OVERLAY_WEIGHT)
+
+def serving_error(e: Exception) -> HTTPException:
+    if isinstance(e, Overloaded):
+        return HTTPException(status_code=503, detail=f"Server busy: {e}")
+    if isinstance(e, Superseded):
+        return HTTPException(status_code=409, detail=str(e))
+    return HTTPException(status_code=504, detail=str(e))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global ngram_model
-    print("Loading N-gram model...")
-    try:
-        ngram_model = NgramModel.load_model("all.pkl")
-        if not ngram_model:
-            print("ERROR: Failed to load model. Please ensure all.pkl exists in trained_models/")
-            raise RuntimeError("Model loading failed")
-        print("✓ Model loaded successfully")
-        
-        await preload_models()
-        
-    except Exception as e:
-        print(f"ERROR loading model: {e}")
-        raise RuntimeError(f"Failed to load model: {e}")
+    preload = [name.strip() for name in PRELOAD_MODELS.split(",") if name.strip()]
+    if preload:
+        await preload_models(preload)
+    else:
+        logger.info("Models will be loaded on first use")
     
     yield
     
-    print("Shutting down...")
+    logger.info("Shutting down...")
+    PROFILER.stop()
+    serving.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -47,21 +281,51 @@ app.add_middleware(
 class PredictRequest(BaseModel):
     text: str
     top_k: int = 5
+    method: str = "backoff"  # or "interpolation", "completion", "stupid_backoff", "kneser_ney"
+    interpolation_mode: str = "fast"  # or "exact"
+    client_id: Optional[str] = None  # a newer request with the same id cancels this one
+    mixture: Optional[Dict[str, float]] = None  # e.g. {"casual": 2, "poetic": 1}: blend these models instead of the active one
+    overlay: Optional[str] = None  # e.g. "user:alice" or "site:example.com": add what was learned for it
+
+class BatchPredictRequest(BaseModel):
+    texts: List[str]
+    top_k: int = 5
+    method: str = "backoff"  # or "interpolation", "stupid_backoff", "kneser_ney"
+    interpolation_mode: str = "fast"  # or "exact"
+    mixture: Optional[Dict[str, float]] = None  # as in PredictRequest
+    overlay: Optional[str] = None  # as in PredictRequest
+
+class PhraseRequest(BaseModel):
+    text: str
+    top_k: int = 3
+    max_words: int = DEFAULT_MAX_WORDS  # longest phrase, in words
+    min_words: int = 1
+    beam_width: int = DEFAULT_BEAM_WIDTH
+    length_penalty: float = DEFAULT_LENGTH_PENALTY  # 0 favours short phrases, 1 ranks by per-word probability
     method: str = "backoff"  # or "interpolation"
+    interpolation_mode: str = "fast"  # or "exact"
+    client_id: Optional[str] = None
+    mixture: Optional[Dict[str, float]] = None  # as in PredictRequest
+    overlay: Optional[str] = None  # as in PredictRequest
 
 class ModelSwitchRequest(BaseModel):
     model_name: str  # "all", "casual", "formal", "poetic"
 
+class ModelUpdateRequest(BaseModel):
+    texts: List[str]
+
+class OverlayLearnRequest(BaseModel):
+    texts: List[str]
+
 class SettingsUpdateRequest(BaseModel):
     post_box: Optional[bool] = None
     search_bar: Optional[bool] = None
     comment_box: Optional[bool] = None
     chat_box: Optional[bool] = None
-    prediction_method: Optional[str] = None  # "backoff" or "interpolation"
+    prediction_method: Optional[str] = None  # "backoff", "interpolation", "completion", "stupid_backoff" or "kneser_ney"
     suggestions_count: Optional[int] = None
 
-# in memory settings for now
-user_settings = {
+DEFAULT_SETTINGS = {
     "post_box": True,
     "search_bar": True,
     "comment_box": True,
@@ -72,6 +336,9 @@ user_settings = {
     "extension_enabled": True
 }
 
+# in memory for a single worker, a shared file when there are several
+user_settings = SharedSettings(DEFAULT_SETTINGS, SHARED_SETTINGS_FILE)
+
 @app.get("/")
 async def root():
     return {
@@ -83,7 +350,8 @@ async def root():
 @app.get("/models")
 async def get_available_models():
     try:
-        models_info = NgramModel.get_available_models()
+        # a model without a usable sidecar is hashed or unpickled to describe it
+        models_info = await serving.load(NgramModel.get_available_models)
         if ngram_model and ngram_model.is_trained:
             models_info["loaded_model_info"] = {
                 "vocab_size": ngram_model.vocab_size,
@@ -93,145 +361,226 @@ async def get_available_models():
         
         return models_info
         
+    except WorkTimeout as e:
+        raise serving_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
-async def preload_models():
-    global model_cache
-    
-    model_mapping = {
-        "all": "all.pkl",
-        "casual": "cas-en.pkl", 
-        "formal": "std-en.pkl",
-        "poetic": "poet-en.pkl"
-    }
-    
-    print("Preloading models...")
-    for model_name, filename in model_mapping.items():
+async def preload_models(model_names: List[str]):
+    logger.info("Preloading models...")
+    loaded = 0
+    for model_name in model_names:
         try:
-            with cache_lock:
-                if model_name not in model_cache:
-                    model = NgramModel.load_model(filename)
-                    if model:
-                        model_cache[model_name] = model
-                        print(f"✓ Preloaded {model_name} model")
-                    else:
-                        print(f"✗ Failed to preload {model_name} model")
+            if model_name == user_settings["active_model"]:
+                model = await active_model()
+            else:
+                model = await serving.load(model_registry.get, model_name)
+            if model:
+                loaded += 1
+            else:
+                logger.error("Failed to preload %s model", model_name)
+        except KeyError:
+            logger.error("Unknown model %s", model_name)
         except Exception as e:
-            print(f"✗ Error preloading {model_name}: {e}")
+            logger.error("Error preloading %s: %s", model_name, e)
     
-    print(f"Preloaded {len(model_cache)} models")
+    logger.info("Preloaded %d models", loaded)
 
 @app.post("/models/switch")
 async def switch_model(request: ModelSwitchRequest):
-    global ngram_model
+    global ngram_model, ngram_model_name
     
     try:
-        model_mapping = {
-            "all": "all.pkl",
-            "casual": "cas-en.pkl", 
-            "formal": "std-en.pkl",
-            "poetic": "poet-en.pkl"
-        }
-        
-        if request.model_name not in model_mapping:
+        if request.model_name not in MODEL_FILES:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Invalid model name. Available models: {list(model_mapping.keys())}"
+                detail=f"Invalid model name. Available models: {list(MODEL_FILES.keys())}"
             )
         
-        with cache_lock:
-            if request.model_name in model_cache:
-                ngram_model = model_cache[request.model_name]
-                user_settings["active_model"] = request.model_name
-                
-                return {
-                    "message": f"Successfully switched to {request.model_name} model (from cache)",
-                    "model_info": {
-                        "vocab_size": ngram_model.vocab_size,
-                        "total_tokens": ngram_model.total_tokens,
-                        "model_name": request.model_name,
-                        "cached": True
-                    }
-                }
-        
-        filename = model_mapping[request.model_name]
-        new_model = NgramModel.load_model(filename)
+        cached = model_registry.is_resident(request.model_name)
+        new_model = await serving.load(model_registry.get, request.model_name, True)
         
         if not new_model:
             raise HTTPException(
                 status_code=404,
-                detail=f"Model file {filename} not found"
+                detail=f"Model file {MODEL_FILES[request.model_name]} not found"
             )
         
-        with cache_lock:
-            model_cache[request.model_name] = new_model
-        
-        ngram_model = new_model
+        with model_swap_lock:
+            ngram_model, ngram_model_name = new_model, request.model_name
+            invalidate_prediction_cache()
         user_settings["active_model"] = request.model_name
         
         return {
-            "message": f"Successfully switched to {request.model_name} model",
+            "message": f"Successfully switched to {request.model_name} model" + (" (from cache)" if cached else ""),
             "model_info": {
                 "vocab_size": ngram_model.vocab_size,
                 "total_tokens": ngram_model.total_tokens,
                 "model_name": request.model_name,
-                "cached": False
+                "cached": cached
             }
         }
         
     except HTTPException:
         raise
+    except WorkTimeout as e:
+        raise serving_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Model switch failed: {str(e)}")
     
+@app.post("/models/update")
+async def update_model(request: ModelUpdateRequest):
+    def apply_update() -> NgramModel:
+        global ngram_model
+        with update_lock:
+            # copy-on-write: build the new snapshot aside, then swap it in atomically
+            current = ngram_model
+            new_model = current.updated(request.texts)
+            if new_model.is_trained:
+                new_model.completion_index()
+            
+            with model_swap_lock:
+                if ngram_model is not current:
+                    raise ValueError("The active model was switched during the update; nothing was changed")
+                model_registry.replace(current, new_model)
+                ngram_model = new_model
+                invalidate_prediction_cache()
+        return new_model
+    
+    try:
+        if not await active_model():
+            raise HTTPException(status_code=500, detail="Model not loaded or not trained")
+        # updates are rare and long, so they share the load pool rather than prediction slots
+        new_model = await serving.load(apply_update)
+        
+        return {
+            "message": f"Model updated with {len(request.texts)} texts",
+            "model_info": {
+                "vocab_size": new_model.vocab_size,
+                "total_tokens": new_model.total_tokens,
+                "model_name": user_settings["active_model"]
+            }
+        }
+    
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except WorkTimeout as e:
+        raise serving_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Model update failed: {str(e)}")
+    
 @app.get("/models/cache")
 async def get_cache_status():
     try:
-        cache_info = {}
-        with cache_lock:
-            for model_name, model in model_cache.items():
-                cache_info[model_name] = {
-                    "vocab_size": model.vocab_size,
-                    "total_tokens": model.total_tokens,
-                    "is_trained": model.is_trained
-                }
+        registry_stats = model_registry.stats()
+        cache_info = registry_stats.pop("models")
         
-        return {
+        status = {
             "cached_models": cache_info,
             "total_cached": len(cache_info),
-            "current_model": user_settings.get("active_model", "unknown")
+            "current_model": user_settings.get("active_model", "unknown"),
+            **registry_stats
         }
+        if isinstance(ngram_model, MixtureModel):
+            status["mixture"] = {"weights": ngram_model.weights, "prefix_cache": ngram_model.cache_stats()}
+        with model_users_lock:
+            if mixture_blends:
+                status["mixture_blends"] = [blend.name for blend in mixture_blends.values()]
+            if phrase_searches:
+                status["phrase_expansions"] = {name: search.stats() for name, search in phrase_searches.items()}
+        return status
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/models/cache/predictions")
+async def get_prediction_cache_status():
+    return prediction_cache.stats()
+
+@app.delete("/models/cache/predictions")
+async def clear_prediction_cache():
+    invalidate_prediction_cache()
+    return {"message": "Prediction cache cleared", "stats": prediction_cache.stats()}
+
+@app.get("/serving")
+async def get_serving_status():
+    return serving.stats()
+
+def collect_gauges():
+    # values kept by the caches and pools themselves, read at scrape time
+    cache_stats = prediction_cache.stats()
+    for key in ("entries", "hits", "misses", "evictions", "expirations", "invalidations"):
+        yield (f"ngram_prediction_cache_{key}", f"Prediction cache {key}", {}, cache_stats[key])
+    registry_stats = model_registry.stats()
+    for name, info in registry_stats["models"].items():
+        yield ("ngram_model_resident_bytes", "Estimated memory of each resident model",
+               {"model": name}, info["size_mb"] * 1024 * 1024)
+        yield ("ngram_model_load_seconds", "Time the resident model took to load",
+               {"model": name}, info["load_seconds"])
+    for key in ("loads", "shared_loads", "evictions"):
+        yield (f"ngram_model_registry_{key}", f"Model registry {key}", {}, registry_stats[key])
+    for key, value in serving.stats().items():
+        yield (f"ngram_serving_{key}", f"Serving executor {key.replace('_', ' ')}", {}, value)
+    yield ("ngram_suggestion_sessions", "Open /ws/suggest sessions", {}, len(suggestion_sessions))
+
+METRICS.collectors.append(collect_gauges)
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+def require_profiler():
+    if not ENABLE_PROFILER:
+        raise HTTPException(status_code=404, detail="Profiler is disabled; set ENABLE_PROFILER=1")
+
+@app.post("/debug/profiler/start")
+async def start_profiler(interval_ms: float = 5.0):
+    require_profiler()
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    PROFILER.start(interval_ms / 1000)
+    return {"message": "Profiler started", "interval_ms": interval_ms}
+
+@app.post("/debug/profiler/stop")
+async def stop_profiler(limit: int = 30):
+    require_profiler()
+    PROFILER.stop()
+    return PROFILER.report(limit)
+
+@app.get("/debug/profiler")
+async def get_profiler_report(limit: int = 30):
+    require_profiler()
+    return PROFILER.report(limit)
+
 @app.get("/settings")
 async def get_settings():
-    return user_settings
+    return user_settings.snapshot()
 
 @app.post("/settings")
 async def update_settings(request: SettingsUpdateRequest):
     try:
+        changes = {}
         if request.post_box is not None:
-            user_settings["post_box"] = request.post_box
+            changes["post_box"] = request.post_box
         if request.search_bar is not None:
-            user_settings["search_bar"] = request.search_bar
+            changes["search_bar"] = request.search_bar
         if request.comment_box is not None:
-            user_settings["comment_box"] = request.comment_box
+            changes["comment_box"] = request.comment_box
         if request.chat_box is not None:
-            user_settings["chat_box"] = request.chat_box
+            changes["chat_box"] = request.chat_box
         if request.prediction_method is not None:
-            if request.prediction_method not in ["backoff", "interpolation"]:
+            if request.prediction_method not in PREDICTION_METHODS:
                 raise HTTPException(status_code=400, detail="Invalid prediction method")
-            user_settings["prediction_method"] = request.prediction_method
+            changes["prediction_method"] = request.prediction_method
         if request.suggestions_count is not None:
             if not (3 <= request.suggestions_count <= 5):
                 raise HTTPException(status_code=400, detail="Suggestions count must be between 3 and 5")
-            user_settings["suggestions_count"] = request.suggestions_count
+            changes["suggestions_count"] = request.suggestions_count
         
         return {
             "message": "Settings updated successfully",
-            "settings": user_settings
+            "settings": user_settings.update(changes)
         }
         
     except HTTPException:
@@ -241,44 +590,424 @@ async def update_settings(request: SettingsUpdateRequest):
 
 @app.post("/toggle")
 async def toggle_extension():
-    user_settings["extension_enabled"] = not user_settings["extension_enabled"]
-    status = "enabled" if user_settings["extension_enabled"] else "disabled"
+    with user_settings.transaction() as settings:
+        settings["extension_enabled"] = not settings["extension_enabled"]
+    status = "enabled" if settings["extension_enabled"] else "disabled"
     
     return {
         "message": f"Extension {status}",
-        "enabled": user_settings["extension_enabled"]
+        "enabled": settings["extension_enabled"]
     }
 
+async def request_model(mixture: Optional[Dict[str, float]], overlay: Optional[str] = None):
+    """(model, name, metrics label) a prediction request runs on: the active model or the blend
+    it asked for, seen through its overlay"""
+    try:
+        if mixture is not None:
+            model = await blended_model(mixture)
+            model_name, label = f"mixture:{model.name}", "mixture"
+        else:
+            model = await active_model()
+            model_name = label = ngram_model_name
+        if overlay is not None and model is not None:
+            overlaid = await overlay_model(model, overlay)
+            if overlaid is not None:
+                # the revision keeps cached predictions from outliving a learn
+                model, model_name, label = overlaid, f"{model_name}@{overlay}#{overlaid.counts.revision}", "overlay"
+        return model, model_name, label
+    except WorkTimeout as e:
+        raise serving_error(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def cached_prediction(model, model_name: str, generation: int, raw_text: str, method: str, top_k: int,
+                            interpolation_mode: str = "fast", client_id: Optional[str] = None,
+                            metrics_name: Optional[str] = None):
+    """Predictions for ``raw_text`` through the prediction cache, as (predictions, cached)"""
+    metrics_name = metrics_name or model_name
+    text = raw_text.strip()
+    method_key = method.lower()
+    mode_key = interpolation_mode if method_key == "interpolation" else None
+    cache_key = (generation, model_name, method_key, mode_key,
+                 model.context_key(raw_text, method_key), top_k)
+    predictions = prediction_cache.get(cache_key)
+    cached = predictions is not None
+
+    if not cached:
+        if method_key == "interpolation":
+            work = (model.predict_with_interpolation, text, top_k, interpolation_mode)
+        elif method_key == "completion":
+            # completion needs to see whether the text ends mid-word
+            work = (model.complete, raw_text, top_k)
+        elif method_key in SCORING_METHODS:
+            if not model.has_scorer(method_key):
+                # Kneser-Ney tables not saved with the model are built once, off the prediction pool
+                await serving.load(build_scorer, model, method_key)
+            work = (model.predict_scored, text, top_k, method_key)
+        else:
+            method_key = "backoff"
+            work = (model.predict_next, text, top_k)
+        timed = METRICS.timed(work[0], metrics_name, method_key)
+        predictions = await serving.predict(timed, *work[1:], client_id=client_id)
+        prediction_cache.put(cache_key, predictions)
+    METRICS.inc("ngram_requests_total", model=metrics_name, method=method_key, cached=str(cached).lower())
+    return predictions, cached
+
 @app.post("/predict")
 async def predict(request: PredictRequest):
-    if not ngram_model or not ngram_model.is_trained:
+    # one snapshot per request; /models/update may swap the global meanwhile.
+    # read the generation first so a result is never filed under a newer one
+    generation = cache_generation
+    model, model_name, label = await request_model(request.mixture, request.overlay)
+    if not model or not model.is_trained:
         raise HTTPException(status_code=500, detail="Model not loaded or not trained")
 
-    if not user_settings["extension_enabled"]:
+    # one settings read per request
+    settings = user_settings.snapshot()
+    if not settings["extension_enabled"]:
         raise HTTPException(status_code=503, detail="Extension is disabled")
 
     text = request.text.strip()
     if not text:
         raise HTTPException(status_code=400, detail="Text input cannot be empty")
     
-    top_k = max(1, min(request.top_k or user_settings["suggestions_count"], 50))
-    method = request.method or user_settings["prediction_method"]
+    top_k = max(1, min(request.top_k or settings["suggestions_count"], 50))
+    method = request.method or settings["prediction_method"]
+
+    if request.interpolation_mode not in INTERPOLATION_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid interpolation mode. Available modes: {list(INTERPOLATION_MODES)}")
 
     try:
-        if method.lower() == "interpolation":
-            predictions = ngram_model.predict_with_interpolation(text, top_k)
-        else:
-            predictions = ngram_model.predict_next(text, top_k)
+        predictions, cached = await cached_prediction(model, model_name, generation, request.text, method, top_k,
+                                                      request.interpolation_mode, request.client_id,
+                                                      metrics_name=label)
 
         return {
             "input": text,
             "top_k": top_k,
             "method": method,
             "predictions": predictions,
-            "model": user_settings["active_model"]
+            "model": model_name,
+            "cached": cached
         }
+    except (Overloaded, Superseded, WorkTimeout) as e:
+        raise serving_error(e)
+    except ValueError as e:
+        # e.g. a method the loaded model does not support
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
+@app.post("/predict/batch")
+async def predict_batch(request: BatchPredictRequest):
+    model, model_name, label = await request_model(request.mixture, request.overlay)
+    if not model or not model.is_trained:
+        raise HTTPException(status_code=500, detail="Model not loaded or not trained")
+
+    # one settings read per request
+    settings = user_settings.snapshot()
+    if not settings["extension_enabled"]:
+        raise HTTPException(status_code=503, detail="Extension is disabled")
+
+    if len(request.texts) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch size cannot exceed {MAX_BATCH_SIZE}")
+
+    if request.interpolation_mode not in INTERPOLATION_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid interpolation mode. Available modes: {list(INTERPOLATION_MODES)}")
+
+    top_k = max(1, min(request.top_k or settings["suggestions_count"], 50))
+    method = (request.method or settings["prediction_method"]).lower()
+    if method not in ("backoff", "interpolation", *SCORING_METHODS):
+        raise HTTPException(status_code=400, detail=f"Batch prediction does not support method '{method}'")
+
+    try:
+        if method in SCORING_METHODS and not model.has_scorer(method):
+            await serving.load(build_scorer, model, method)
+        timed = METRICS.timed(model.predict_batch, label, f"batch_{method}")
+        predictions = await serving.predict(timed, request.texts, top_k, method,
+                                            request.interpolation_mode, timeout=BATCH_TIMEOUT_SECONDS)
+    except (Overloaded, WorkTimeout) as e:
+        raise serving_error(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch prediction failed: {str(e)}")
+
+    return {
+        "count": len(predictions),
+        "top_k": top_k,
+        "method": method,
+        "predictions": predictions,
+        "model": model_name
+    }
+
+@app.post("/predict/phrase")
+async def predict_phrase(request: PhraseRequest):
+    """Multi-word continuations of the text by beam search over the next-word rankings"""
+    generation = cache_generation
+    model, model_name, label = await request_model(request.mixture, request.overlay)
+    if not model or not model.is_trained:
+        raise HTTPException(status_code=500, detail="Model not loaded or not trained")
+
+    settings = user_settings.snapshot()
+    if not settings["extension_enabled"]:
+        raise HTTPException(status_code=503, detail="Extension is disabled")
+
+    text = request.text.strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="Text input cannot be empty")
+
+    method = request.method.lower()
+    if method not in PHRASE_METHODS:
+        raise HTTPException(status_code=400, detail=f"Phrase prediction supports {list(PHRASE_METHODS)}, not '{method}'")
+    if request.interpolation_mode not in INTERPOLATION_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid interpolation mode. Available modes: {list(INTERPOLATION_MODES)}")
+    if not 0 <= request.length_penalty <= 2:
+        raise HTTPException(status_code=400, detail="length_penalty must be between 0 and 2")
+
+    max_words = max(1, min(request.max_words, MAX_PHRASE_WORDS))
+    min_words = max(1, min(request.min_words, max_words))
+    beam_width = max(1, min(request.beam_width, MAX_BEAM_WIDTH))
+    top_k = max(1, min(request.top_k, beam_width * max_words))
+    mode = request.interpolation_mode if method == "interpolation" else None
+
+    # the search only looks at the last two words, like interpolation
+    cache_key = (generation, model_name, "phrase", method, mode, model.context_key(request.text, "interpolation"),
+                 max_words, min_words, beam_width, request.length_penalty, top_k)
+    phrases = prediction_cache.get(cache_key)
+    cached = phrases is not None
+    try:
+        if not cached:
+            search = phrase_search(model, model_name)
+            timed = METRICS.timed(search.search, label, f"phrase_{method}")
+            phrases = await serving.predict(timed, text, max_words, beam_width, top_k, method,
+                                            request.interpolation_mode, request.length_penalty, min_words,
+                                            client_id=request.client_id)
+            prediction_cache.put(cache_key, phrases)
+    except (Overloaded, Superseded, WorkTimeout) as e:
+        raise serving_error(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Phrase prediction failed: {str(e)}")
+    METRICS.inc("ngram_requests_total", model=label, method=f"phrase_{method}", cached=str(cached).lower())
+
+    return {
+        "input": text,
+        "top_k": top_k,
+        "method": method,
+        "phrases": phrases,
+        "model": model_name,
+        "cached": cached
+    }
+
+@app.post("/overlays/{key}/learn")
+async def learn_overlay(key: str, request: OverlayLearnRequest):
+    """Count texts into the overlay ``key``; predictions naming it see them right away"""
+    try:
+        validate_key(key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(request.texts) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Cannot learn more than {MAX_BATCH_SIZE} texts at once")
+    try:
+        counts = await serving.load(overlay_store.learn, key, request.texts)
+    except WorkTimeout as e:
+        raise serving_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Overlay update failed: {str(e)}")
+    return {
+        "message": f"Overlay {key} learned {len(request.texts)} texts",
+        "overlay": key,
+        "revision": counts.revision,
+        "ngrams": counts.ngrams,
+        "total_tokens": counts.total_tokens
+    }
+
+@app.get("/overlays")
+async def get_overlays():
+    return {"weight": OVERLAY_WEIGHT, "max_ngrams": OVERLAY_MAX_NGRAMS, **overlay_store.stats()}
+
+@app.delete("/overlays/{key}")
+async def delete_overlay(key: str):
+    try:
+        validate_key(key)
+        deleted = await serving.load(overlay_store.delete, key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except WorkTimeout as e:
+        raise serving_error(e)
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"No overlay {key}")
+    return {"message": f"Overlay {key} deleted"}
+
+class SuggestionSession:
+    """State of one /ws/suggest connection: one input field's text and the client's overrides"""
+
+    def __init__(self, websocket: WebSocket):
+        self.id = f"ws-{next(session_ids)}"
+        self.websocket = websocket
+        self.context = SessionContext()
+        self.seq = 0
+        self.method: Optional[str] = None  # None follows the shared settings
+        self.top_k: Optional[int] = None
+        self.overlay: Optional[str] = None
+        self.changed = asyncio.Event()
+        self.send_lock = asyncio.Lock()
+
+    async def send(self, message: dict):
+        async with self.send_lock:
+            await self.websocket.send_json(message)
+
+    def apply(self, message: dict) -> Optional[dict]:
+        """Apply one client message; returns a reply to send right away, if any"""
+        kind = message.get("type")
+        self.seq = message.get("seq", self.seq + 1)
+        if kind == "reset":
+            self.context.reset(str(message.get("text", ""))[-MAX_SESSION_CHARS:])
+        elif kind == "edit":
+            delete, insert = message.get("delete", 0), message.get("insert", "")
+            if not isinstance(delete, int) or delete < 0 or not isinstance(insert, str):
+                # the client already counts this edit as sent, so its text and ours now differ
+                return {"type": "resync", "seq": self.seq, "detail": "Invalid edit"}
+            try:
+                self.context.edit(delete, insert)
+            except Resync as e:
+                return {"type": "resync", "seq": self.seq, "detail": str(e)}
+        elif kind == "configure":
+            method, top_k, overlay = message.get("method"), message.get("top_k"), message.get("overlay")
+            if method is not None and method not in PREDICTION_METHODS:
+                return {"type": "error", "seq": self.seq, "status": 400, "detail": "Invalid prediction method"}
+            if top_k is not None and not (isinstance(top_k, int) and 1 <= top_k <= 50):
+                return {"type": "error", "seq": self.seq, "status": 400, "detail": "top_k must be between 1 and 50"}
+            if overlay is not None:
+                try:
+                    validate_key(overlay)
+                except ValueError as e:
+                    return {"type": "error", "seq": self.seq, "status": 400, "detail": str(e)}
+            self.method, self.top_k, self.overlay = method, top_k, overlay
+        else:
+            return {"type": "error", "seq": self.seq, "status": 400, "detail": f"Unknown message type: {kind}"}
+        self.changed.set()
+        return None
+
+    async def suggestions(self) -> dict:
+        generation = cache_generation
+        context = self.context.context()
+        try:
+            model, model_name, label = await request_model(None, self.overlay)
+            if not model or not model.is_trained:
+                return {"type": "error", "status": 500, "detail": "Model not loaded or not trained"}
+            settings = user_settings.snapshot()
+            if not settings["extension_enabled"]:
+                return {"type": "error", "status": 503, "detail": "Extension is disabled"}
+
+            method = self.method or settings["prediction_method"]
+            top_k = self.top_k or settings["suggestions_count"]
+            predictions, cached = [], False
+            if context is not None:
+                predictions, cached = await cached_prediction(model, model_name, generation, context, method, top_k,
+                                                              metrics_name=label)
+        except HTTPException as e:
+            return {"type": "error", "status": e.status_code, "detail": e.detail}
+        except (Overloaded, Superseded, WorkTimeout) as e:
+            error = serving_error(e)
+            return {"type": "error", "status": error.status_code, "detail": error.detail}
+        except ValueError as e:
+            return {"type": "error", "status": 400, "detail": str(e)}
+        except Exception as e:
+            return {"type": "error", "status": 500, "detail": f"Prediction failed: {str(e)}"}
+        return {
+            "type": "suggestions",
+            "top_k": top_k,
+            "method": method,
+            "predictions": predictions,
+            "model": model_name,
+            "cached": cached
+        }
+
+    async def push_suggestions(self):
+        # predicts for the latest state only: edits that arrive meanwhile are
+        # folded into the next round instead of queueing a prediction each
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+            seq = self.seq
+            reply = await self.suggestions()
+            if self.changed.is_set():
+                continue
+            reply["seq"] = seq
+            await self.send(reply)
+
+session_ids = itertools.count(1)
+suggestion_sessions = set()
+
+@app.websocket("/ws/suggest")
+async def suggest_session(websocket: WebSocket):
+    """Keystroke channel: the client streams edits, the server pushes suggestions.
+
+    Client messages are JSON objects with an optional ``seq`` echoed in the replies:
+    ``{"type": "reset", "text": ...}`` replaces the session text,
+    ``{"type": "edit", "delete": n, "insert": ...}`` drops n characters from its end and appends,
+    ``{"type": "configure", "method": ..., "top_k": ..., "overlay": ...}`` overrides the shared settings
+    (null follows them) and picks the overlay to predict through.
+    The server answers with ``suggestions``, ``error`` or ``resync`` (send a reset) messages.
+    """
+    await websocket.accept()
+    session = SuggestionSession(websocket)
+    suggestion_sessions.add(session)
+    pusher = asyncio.create_task(session.push_suggestions())
+    try:
+        await session.send({"type": "ready", "session_id": session.id})
+        while True:
+            raw = await websocket.receive_text()
+            if len(raw) > 4 * MAX_SESSION_CHARS:
+                # likely a pasted edit that was dropped: the client resends a reset, which fits
+                await session.send({"type": "resync", "detail": "Message too large"})
+                continue
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                await session.send({"type": "error", "status": 400, "detail": "Messages must be JSON objects"})
+                continue
+            reply = session.apply(message)
+            if reply is not None:
+                await session.send(reply)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        pusher.cancel()
+        suggestion_sessions.discard(session)
+
+def prepare_shared_models():
+    # every worker maps the same .ngb files, so the OS keeps one copy of each model
+    for filename in model_sources.values():
+        if isinstance(filename, dict):
+            continue  # a mixture of the other models
+        pkl_path = os.path.join("trained_models", filename)
+        ngb_path = os.path.splitext(pkl_path)[0] + BINARY_EXTENSION
+        if not os.path.exists(pkl_path):
+            continue
+        # backfills a missing sidecar, so workers can tell the model's order without unpickling it
+        catalog_for("trained_models").describe(filename)
+        if holds_model(pkl_path) and (not os.path.exists(ngb_path) or
+                                      os.path.getmtime(ngb_path) < os.path.getmtime(pkl_path)):
+            convert_pickle(pkl_path, ngb_path)
+        if not shared_binary(filename):
+            logger.warning("%s has orders above 3, which the binary format cannot hold; "
+                           "every worker loads its own copy of the pickle", pkl_path)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    workers = int(os.environ.get("WEB_WORKERS", 1))
+    if workers > 1:
+        # models must be read-only and shared, and settings must live outside
+        # any one process; the worker processes inherit this environment
+        prepare_shared_models()
+        os.environ["MODEL_STORAGE"] = "mmap"
+        os.environ.setdefault("SHARED_SETTINGS_FILE", os.path.join("state", "settings.json"))
+        SharedSettings(DEFAULT_SETTINGS, os.environ["SHARED_SETTINGS_FILE"], reset=True)
+        uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
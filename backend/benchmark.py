@@ -0,0 +1,343 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+from core.ngrams import NgramModel
+
+SCHEMA_VERSION = 1
+STORAGE_MODES = ("dict", "compact", "mmap", "quantized")
+
+
+def generate_corpus(path: str, vocab_size: int = 5000, sentences: int = 50000,
+                    mean_length: int = 12, seed: int = 13) -> int:
+    """Write a synthetic corpus with Zipfian words and repeatable phrases.
+
+    Each word has a few preferred successors, so trigrams recur the way they
+    do in real text instead of every n-gram being a singleton. Returns the
+    number of words written; the same arguments always give the same file.
+    """
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocab_size)]
+    weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    successors = {i: rng.choices(range(vocab_size), cum_weights=cumulative, k=4) for i in range(vocab_size)}
+
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for _ in range(sentences):
+            length = max(2, int(rng.expovariate(1.0 / mean_length)))
+            current = rng.choices(range(vocab_size), cum_weights=cumulative)[0]
+            sentence = [words[current]]
+            for _ in range(length - 1):
+                if rng.random() < 0.6:
+                    current = rng.choice(successors[current])
+                else:
+                    current = rng.choices(range(vocab_size), cum_weights=cumulative)[0]
+                sentence.append(words[current])
+            f.write(" ".join(sentence) + "\n")
+            written += length
+    return written
+
+
+def percentiles(samples: List[float]) -> Dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e6, 1)
+
+    return {
+        "calls": len(ordered),
+        "mean_us": round(statistics.fmean(ordered) * 1e6, 1),
+        "p50_us": at(0.50),
+        "p90_us": at(0.90),
+        "p99_us": at(0.99),
+        "max_us": round(ordered[-1] * 1e6, 1),
+    }
+
+
+def time_calls(fn, inputs: List, warmup: int = 100) -> Dict:
+    for item in inputs[:warmup]:
+        fn(item)
+    samples = []
+    clock = time.perf_counter
+    for item in inputs:
+        start = clock()
+        fn(item)
+        samples.append(clock() - start)
+    return percentiles(samples)
+
+
+def peak_rss_mb() -> Optional[float]:
+    # linux: VmHWM is per address space, while ru_maxrss survives fork+exec
+    # and would report the parent's peak in a freshly spawned child
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def load_model(storage: str, name: str):
+    if storage == "mmap":
+        return NgramModel.load_model(name + ".ngb")
+    if storage == "quantized":
+        from core.quantized import QuantizedModel
+        return QuantizedModel.load(name + ".ngq")
+    return NgramModel.load_model(name + ".pkl", compact=storage == "compact")
+
+
+def measure_load(storage: str, name: str, queue):
+    # runs in a fresh process so peak RSS belongs to this model alone
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    model = load_model(storage, name)
+    elapsed = time.perf_counter() - start
+    peak = peak_rss_mb()
+    queue.put({
+        "load_seconds": round(elapsed, 3),
+        "peak_rss_mb": peak,
+        "model_rss_mb": round(peak - baseline, 1) if peak is not None else None,
+        "estimated_mb": round(model.memory_bytes() / (1024 * 1024), 2),
+    })
+
+
+def bench_load(storage: str, name: str) -> Dict:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=measure_load, args=(storage, name, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def bench_predictions(model, contexts: List[str], partials: List[str]) -> Dict:
+    results = {"backoff": time_calls(lambda text: model.predict_next(text, 5), contexts)}
+    if getattr(model, "methods", ("backoff", "interpolation", "completion")) != ("backoff",):
+        results["interpolation_fast"] = time_calls(
+            lambda text: model.predict_with_interpolation(text, 5, "fast"), contexts)
+        results["interpolation_exact"] = time_calls(
+            lambda text: model.predict_with_interpolation(text, 5, "exact"), contexts[:len(contexts) // 10])
+        results["completion"] = time_calls(lambda text: model.complete(text, 5), partials)
+    return results
+
+
+def sample_contexts(corpus: str, count: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    with open(corpus, 'r', encoding='utf-8') as f:
+        lines = [line.split() for line in f if len(line.split()) >= 3]
+    contexts = []
+    for _ in range(count):
+        words = rng.choice(lines)
+        end = rng.randint(2, len(words))
+        contexts.append(" ".join(words[max(0, end - 6):end]))
+    return contexts
+
+
+def http_load(url: str, contexts: List[str], concurrency: int, duration: float) -> Dict:
+    """Closed-loop load test against a running server's /predict."""
+    samples: List[float] = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_id: int):
+        rng = random.Random(worker_id)
+        local, failed = [], 0
+        while time.perf_counter() < deadline:
+            body = json.dumps({"text": rng.choice(contexts), "top_k": 5}).encode()
+            request = urllib.request.Request(url.rstrip('/') + "/predict", data=body,
+                                             headers={"Content-Type": "application/json"})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    response.read()
+                local.append(time.perf_counter() - start)
+            except Exception:
+                failed += 1
+        with lock:
+            samples.extend(local)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(len(samples) / elapsed, 1),
+        "errors": sum(errors),
+        **percentiles(samples),
+    }
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "git_commit": commit or None,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def run(args: argparse.Namespace) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="ngram-bench-")
+    here = os.getcwd()
+    # save_model/load_model work relative to ./trained_models
+    os.chdir(workdir)
+    try:
+        corpus = os.path.join(workdir, "corpus.txt")
+        start = time.perf_counter()
+        words = generate_corpus(corpus, args.vocab, args.sentences, args.mean_length, args.seed)
+        print(f"Generated {words:,} words in {time.perf_counter() - start:.2f}s")
+
+        report = {"schema": SCHEMA_VERSION, "environment": environment(), "config": vars(args).copy(),
+                  "training": {}, "models": {}}
+        report["config"].pop("func", None)
+
+        model = None
+        for workers in sorted(set([1] + args.workers)):
+            model = NgramModel()
+            start = time.perf_counter()
+            model.train_from_files([corpus], workers=workers)
+            elapsed = time.perf_counter() - start
+            report["training"][f"workers_{workers}"] = {
+                "seconds": round(elapsed, 3),
+                "tokens_per_second": round(model.total_tokens / elapsed),
+            }
+
+        model.save_model("bench.pkl")
+        model.save_model("bench.ngb", binary=True)
+        from core.quantized import QuantizedModel
+        QuantizedModel.from_model(model, 8).save("bench.ngq")
+        del model
+
+        contexts = sample_contexts(corpus, args.calls, args.seed)
+        partials = [text[:-1] if len(text.split()[-1]) > 1 else text for text in contexts]
+        for storage in args.storage:
+            entry = bench_load(storage, "bench")
+            served = load_model(storage, "bench")
+            # keep the per-call debug prints out of the timings
+            stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+            try:
+                entry["latency"] = bench_predictions(served, contexts, partials)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            report["models"][storage] = entry
+            print(f"{storage:>10}: load {entry['load_seconds']}s, rss {entry['model_rss_mb']} MB, "
+                  f"backoff p50 {entry['latency']['backoff']['p50_us']}us "
+                  f"p99 {entry['latency']['backoff']['p99_us']}us")
+            del served
+
+        if args.http:
+            report["http"] = http_load(args.http, contexts, args.concurrency, args.duration)
+            print(f"HTTP: {report['http']['requests_per_second']} req/s, p99 {report['http'].get('p99_us')}us")
+    finally:
+        os.chdir(here)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def flatten(report: Dict, prefix: str = "") -> Dict[str, float]:
+    values = {}
+    for key, value in report.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            values.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def compare(baseline_path: str, candidate_path: str):
+    with open(baseline_path) as f:
+        baseline = flatten(json.load(f))
+    with open(candidate_path) as f:
+        candidate = flatten(json.load(f))
+    for path in sorted(baseline.keys() & candidate.keys()):
+        if path.startswith(("config.", "environment.", "schema")):
+            continue
+        old, new = baseline[path], candidate[path]
+        change = f"{(new - old) / old:+.1%}" if old else "n/a"
+        print(f"{path:<60} {old:>12} -> {new:<12} {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark training, loading, prediction latency and serving")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="generate a corpus and benchmark it")
+    run_parser.add_argument("--vocab", type=int, default=5000, help="synthetic vocabulary size")
+    run_parser.add_argument("--sentences", type=int, default=50000, help="synthetic corpus sentences")
+    run_parser.add_argument("--mean-length", type=int, default=12, help="mean sentence length in words")
+    run_parser.add_argument("--seed", type=int, default=13)
+    run_parser.add_argument("--calls", type=int, default=5000, help="timed calls per prediction method")
+    run_parser.add_argument("--workers", type=int, nargs="*", default=[], help="extra training worker counts")
+    run_parser.add_argument("--storage", nargs="*", default=list(STORAGE_MODES), choices=STORAGE_MODES)
+    run_parser.add_argument("--http", help="base URL of a running server to load test, e.g. http://localhost:8000")
+    run_parser.add_argument("--concurrency", type=int, default=8, help="HTTP load test clients")
+    run_parser.add_argument("--duration", type=float, default=10.0, help="HTTP load test seconds")
+    run_parser.add_argument("--output", default="benchmark.json", help="where to write the JSON results")
+
+    compare_parser = subparsers.add_parser("compare", help="show the change between two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        compare(args.baseline, args.candidate)
+        return
+
+    output = os.path.abspath(args.output)
+    report = run(args)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    # python benchmark.py run --output before.json; ...; python benchmark.py compare before.json after.json
+    main()
@@ -0,0 +1,223 @@
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import Dict, List, Optional, Tuple
+
+from core.catalog import read_metadata, write_metadata
+from core.storage import CompactNgramStore, CsrTable
+
+logger = logging.getLogger(__name__)
+
+BINARY_EXTENSION = '.ngb'
+MAGIC = b'NGRMBIN\x00'
+FORMAT_VERSION = 1
+LITTLE_ENDIAN = 1
+BIG_ENDIAN = 2
+
+# magic, version, byte order, section count, reserved,
+# vocab_size, total_tokens, unigram_total, unigram_types
+HEADER = struct.Struct('<8sIIII4Q')
+# name, typecode, offset, item count
+SECTION = struct.Struct('<16s4sQQ')
+ALIGNMENT = 8
+
+TABLE_FIELDS = ('keys', 'offsets', 'successors', 'counts', 'totals', 'ranks', 'sizes')
+
+
+def _byte_order() -> int:
+    return LITTLE_ENDIAN if sys.byteorder == 'little' else BIG_ENDIAN
+
+
+class MappedWords(Sequence):
+    """Decodes vocabulary words straight out of the mapped string blob."""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def raw(self, word_id: int) -> bytes:
+        return bytes(self.blob[self.offsets[word_id]:self.offsets[word_id + 1]])
+
+    def __getitem__(self, word_id: int) -> str:
+        if word_id < 0:
+            word_id += len(self)
+        return self.raw(word_id).decode('utf-8')
+
+
+class MappedVocabulary:
+    """Vocabulary lookups by binary search over ids sorted by UTF-8 bytes."""
+
+    def __init__(self, words: MappedWords, sorted_ids):
+        self.words = words
+        self.sorted_ids = sorted_ids
+
+    def lookup(self, word: str) -> int:
+        target = word.encode('utf-8')
+        lo, hi = 0, len(self.sorted_ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.words.raw(self.sorted_ids[mid]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.sorted_ids):
+            word_id = self.sorted_ids[lo]
+            if self.words.raw(word_id) == target:
+                return word_id
+        return -1
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __getitem__(self, word_id: int) -> str:
+        return self.words[word_id]
+
+
+class MappedNgramStore(CompactNgramStore):
+    """CompactNgramStore whose arrays are memoryviews into an mmap'd file.
+
+    Nothing is deserialised on open; pages are faulted in on first access and
+    shared through the OS page cache by every process mapping the same file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # the map keeps its own handle, so the file can be closed right away;
+        # it is unmapped when the last view into it is garbage collected
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mmap)
+
+        header = read_header(self.buffer)
+        self.vocab_size = header['vocab_size']
+        self.total_tokens = header['total_tokens']
+        sections = self.read_sections(header['section_count'])
+
+        vocab = MappedVocabulary(MappedWords(sections['vocab_offsets'], sections['vocab_blob']),
+                                 sections['vocab_sorted'])
+        trigram_table = CsrTable(*(sections[f'tri_{field}'] for field in TABLE_FIELDS))
+        bigram_table = CsrTable(*(sections[f'bi_{field}'] for field in TABLE_FIELDS))
+
+        super().__init__(vocab, sections['unigram_counts'], sections['unigram_ranks'],
+                         header['unigram_total'], header['unigram_types'],
+                         trigram_table, bigram_table)
+
+    def read_sections(self, count: int) -> Dict[str, memoryview]:
+        sections = {}
+        for i in range(count):
+            name, typecode, offset, length = SECTION.unpack_from(self.buffer, HEADER.size + i * SECTION.size)
+            typecode = typecode.rstrip(b'\x00').decode('ascii')
+            itemsize = struct.calcsize(typecode)
+            if offset + length * itemsize > len(self.buffer):
+                raise ValueError(f"Truncated model file {self.path}")
+            section = self.buffer[offset:offset + length * itemsize]
+            sections[name.rstrip(b'\x00').decode('ascii')] = section.cast(typecode) if typecode != 'B' else section
+        return sections
+
+
+def read_header(buffer) -> Dict:
+    if len(buffer) < HEADER.size:
+        raise ValueError("Not an n-gram binary model: file too small")
+    (magic, version, byte_order, section_count, _,
+     vocab_size, total_tokens, unigram_total, unigram_types) = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not an n-gram binary model: bad magic")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported binary model version {version} (expected {FORMAT_VERSION})")
+    if byte_order != _byte_order():
+        raise ValueError("Binary model was written on a machine with a different byte order")
+    return {
+        'version': version,
+        'section_count': section_count,
+        'vocab_size': vocab_size,
+        'total_tokens': total_tokens,
+        'unigram_total': unigram_total,
+        'unigram_types': unigram_types,
+    }
+
+
+def write_binary(store: CompactNgramStore, path: str, vocab_size: int, total_tokens: int):
+    words = [store.vocab[i] for i in range(len(store.vocab))]
+    encoded = [word.encode('utf-8') for word in words]
+
+    vocab_offsets = array('Q', [0])
+    for raw in encoded:
+        vocab_offsets.append(vocab_offsets[-1] + len(raw))
+    vocab_sorted = array('I', sorted(range(len(encoded)), key=encoded.__getitem__))
+
+    sections: List[Tuple[str, str, bytes, int]] = [
+        ('vocab_offsets', 'Q', vocab_offsets.tobytes(), len(vocab_offsets)),
+        ('vocab_blob', 'B', b''.join(encoded), int(vocab_offsets[-1])),
+        ('vocab_sorted', 'I', vocab_sorted.tobytes(), len(vocab_sorted)),
+        ('unigram_counts', 'Q', bytes(store.unigram_counts), len(store.unigram_counts)),
+        ('unigram_ranks', 'I', bytes(store.unigram_ranks), len(store.unigram_ranks)),
+    ]
+    for prefix, table in (('tri', store.trigram_table), ('bi', store.bigram_table)):
+        for field in TABLE_FIELDS:
+            values = getattr(table, field)
+            sections.append((f'{prefix}_{field}', values.typecode if isinstance(values, array)
+                             else values.format, bytes(values), len(values)))
+
+    offset = HEADER.size + SECTION.size * len(sections)
+    table_entries, payload = [], []
+    for name, typecode, data, length in sections:
+        padding = -offset % ALIGNMENT
+        payload.append(b'\x00' * padding)
+        offset += padding
+        table_entries.append(SECTION.pack(name.encode('ascii'), typecode.encode('ascii'), offset, length))
+        payload.append(data)
+        offset += len(data)
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, _byte_order(), len(sections), 0,
+                         vocab_size, total_tokens, store.unigram_total, store.unigram_types)
+
+    # write to a temp file and rename so readers never map a half-written model
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.writelines(table_entries)
+        f.writelines(payload)
+    os.replace(tmp_path, path)
+
+
+def holds_model(pkl_path: str) -> bool:
+    """Whether the binary format can hold the pickled model, going by its sidecar when it has one."""
+    metadata = read_metadata(pkl_path)
+    return metadata is None or metadata['order'] <= 3
+
+
+def convert_pickle(pkl_path: str, out_path: str = None) -> Optional[str]:
+    """Convert a legacy .pkl model into the memory-mapped binary format.
+
+    The format holds orders up to 3, so a model of a higher order is left
+    as a pickle and None is returned.
+    """
+    import pickle
+    from core.ngrams import NgramModel
+
+    out_path = out_path or os.path.splitext(pkl_path)[0] + BINARY_EXTENSION
+    with open(pkl_path, 'rb') as f:
+        model = NgramModel(pickle.load(f))
+    if model.higher is not None:
+        logger.warning("Not converting %s: it is an order-%d model and the binary format holds orders up to 3",
+                       pkl_path, model.order)
+        return None
+    write_binary(model.compact().storage, out_path, model.vocab_size, model.total_tokens)
+    write_metadata(out_path, model.vocab_size, model.total_tokens, 3, model.ngram_counts(), source='convert_pickle')
+
+    file_size = os.path.getsize(out_path) / (1024 * 1024)
+    print(f"Converted {pkl_path} -> {out_path} ({file_size:.2f} MB)")
+    return out_path
+
+
+if __name__ == "__main__":
+    # python -m core.binary trained_models/all.pkl trained_models/cas-en.pkl ...
+    for pkl_path in sys.argv[1:]:
+        convert_pickle(pkl_path)
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import platform
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION = 1
+SIDECAR_SUFFIX = '.meta.json'
+CHECKSUM_CHUNK = 1024 * 1024
+
+
+def sidecar_path(model_path: str) -> str:
+    return model_path + SIDECAR_SUFFIX
+
+
+def file_checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK), b''):
+            digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+
+def data_counts(model_data: Dict) -> Dict[int, int]:
+    """N-gram counts per order of a pickled model dict, as written by save_model."""
+    counts = {1: len(model_data.get('unigrams', ()))}
+    for n, name in ((2, 'bigrams'), (3, 'trigrams')):
+        counts[n] = sum(len(successors) for successors in model_data.get(name, {}).values())
+    higher = model_data.get('higher_orders')
+    if higher:
+        for n, fields in higher['tables'].items():
+            counts[n] = len(fields[2])  # successors array
+    return counts
+
+
+def build_metadata(model_path: str, vocab_size: int, total_tokens: int, order: int,
+                   ngram_counts: Dict[int, int], source: str = 'save_model', build: Optional[Dict] = None) -> Dict:
+    """Sidecar metadata describing the model file at ``model_path``, stamped with its current size and mtime."""
+    st = os.stat(model_path)
+    metadata = {
+        'version': CATALOG_VERSION,
+        'filename': os.path.basename(model_path),
+        'file_size': st.st_size,
+        'file_mtime_ns': st.st_mtime_ns,
+        'checksum': file_checksum(model_path),
+        'vocab_size': vocab_size,
+        'total_tokens': total_tokens,
+        'order': order,
+        'ngram_counts': {str(n): count for n, count in sorted(ngram_counts.items())},
+        'build': build or {
+            'source': source,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'host': platform.node(),
+        },
+    }
+    return metadata
+
+
+def store_metadata(model_path: str, metadata: Dict):
+    path = sidecar_path(model_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def write_metadata(model_path: str, vocab_size: int, total_tokens: int, order: int,
+                   ngram_counts: Dict[int, int], source: str = 'save_model', build: Optional[Dict] = None) -> Dict:
+    """Describe the model file at ``model_path`` in its sidecar and return the metadata."""
+    metadata = build_metadata(model_path, vocab_size, total_tokens, order, ngram_counts, source, build)
+    store_metadata(model_path, metadata)
+    return metadata
+
+
+def read_metadata(model_path: str) -> Optional[Dict]:
+    try:
+        with open(sidecar_path(model_path), 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if metadata.get('version') != CATALOG_VERSION:
+        return None
+    return metadata
+
+
+class ModelCatalog:
+    """Lists the models in a directory without deserializing them.
+
+    Each model file has a JSON sidecar (``<file>.meta.json``) written by
+    save_model. Listing is one ``os.stat`` per file: an entry is reused
+    while the file's mtime and size match what was last seen, and a
+    sidecar is trusted while they match what it recorded. Models without a
+    usable sidecar (saved before the catalog existed, or copied so their
+    mtime changed) are backfilled once: a copy with the same checksum only
+    has its sidecar refreshed, anything else is unpickled a single time.
+    When the sidecar cannot be written (a read-only directory) the
+    backfilled metadata is still listed, and kept in memory.
+
+    Listing can stat, hash and unpickle files, so callers on an event loop
+    run it in a worker thread.
+    """
+
+    def __init__(self, models_dir: str = 'trained_models', extension: str = '.pkl'):
+        self.models_dir = models_dir
+        self.extension = extension
+        self.entries: Dict[str, Tuple[Tuple[int, int], Dict]] = {}
+        self.lock = threading.Lock()
+        self.backfills = 0
+
+    def describe(self, filename: str) -> Dict:
+        path = os.path.join(self.models_dir, filename)
+        st = os.stat(path)
+        version = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            cached = self.entries.get(filename)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            info = self.load_entry(path, st)
+            self.entries[filename] = (version, info)
+            return info
+
+    def load_entry(self, path: str, st: os.stat_result) -> Dict:
+        metadata = read_metadata(path)
+        if metadata is not None and (metadata['file_mtime_ns'], metadata['file_size']) == (st.st_mtime_ns, st.st_size):
+            return self.entry(path, st, metadata)
+
+        self.backfills += 1
+        try:
+            if metadata is not None and metadata['file_size'] == st.st_size \
+                    and metadata['checksum'] == file_checksum(path):
+                # same bytes under a new mtime (copied or touched): only the stamp is stale
+                metadata = build_metadata(path, metadata['vocab_size'], metadata['total_tokens'],
+                                          metadata['order'], {int(n): c for n, c in metadata['ngram_counts'].items()},
+                                          build=metadata['build'])
+            else:
+                metadata = self.backfill(path)
+        except Exception as e:
+            logger.warning("Could not read model %s: %s", path, e)
+            return self.entry(path, st, None, error=str(e))
+
+        try:
+            store_metadata(path, metadata)
+        except OSError as e:
+            # the model itself read fine; it is only backfilled again after a restart
+            logger.warning("Could not write catalog sidecar for %s: %s", path, e)
+        return self.entry(path, st, metadata)
+
+    def backfill(self, path: str) -> Dict:
+        logger.info("Backfilling catalog metadata for %s", path)
+        with open(path, 'rb') as f:
+            model_data = pickle.load(f)
+        unigrams = model_data.get('unigrams', {})
+        return build_metadata(path, model_data.get('vocab_size', len(unigrams)),
+                              model_data.get('total_tokens', sum(unigrams.values())),
+                              model_data.get('order', 3), data_counts(model_data), source='backfill')
+
+    def entry(self, path: str, st: os.stat_result, metadata: Optional[Dict], error: Optional[str] = None) -> Dict:
+        info = {
+            "filename": os.path.basename(path),
+            "path": path,
+            "size_mb": round(st.st_size / (1024 * 1024), 2),
+            "last_modified": st.st_mtime,
+        }
+        if metadata is None:
+            info.update({
+                "vocab_size": "Error loading",
+                "total_tokens": "Error loading",
+                "status": "corrupted",
+                "error": error,
+            })
+        else:
+            info.update({
+                "vocab_size": metadata['vocab_size'],
+                "total_tokens": metadata['total_tokens'],
+                "order": metadata['order'],
+                "ngram_counts": metadata['ngram_counts'],
+                "checksum": metadata['checksum'],
+                "build": metadata['build'],
+                "status": "valid",
+            })
+        return info
+
+    def available_models(self) -> Dict:
+        if not os.path.exists(self.models_dir):
+            os.makedirs(self.models_dir, exist_ok=True)
+            return {
+                "models": {},
+                "total_models": 0,
+                "message": "No models directory found"
+            }
+
+        try:
+            model_files = sorted(f for f in os.listdir(self.models_dir) if f.endswith(self.extension))
+            available_models = {}
+            for model_file in model_files:
+                try:
+                    available_models[model_file[:-len(self.extension)]] = self.describe(model_file)
+                except FileNotFoundError:
+                    continue  # deleted while listing
+            with self.lock:
+                for filename in set(self.entries) - set(model_files):
+                    del self.entries[filename]
+            return {
+                "models": available_models,
+                "total_models": len(available_models)
+            }
+        except Exception as e:
+            raise Exception(f"Failed to scan models directory: {str(e)}")
+
+
+_catalogs: Dict[str, ModelCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def catalog_for(models_dir: str = 'trained_models') -> ModelCatalog:
+    """The shared catalog of ``models_dir``, so its index lives as long as the process."""
+    with _catalogs_lock:
+        catalog = _catalogs.get(models_dir)
+        if catalog is None:
+            catalog = _catalogs[models_dir] = ModelCatalog(models_dir)
+        return catalog
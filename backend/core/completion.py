@@ -0,0 +1,88 @@
+import heapq
+import sys
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+from core.index import SuccessorIndex, sampled_bytes
+
+# prefixes up to this many characters get a precomputed top list; longer
+# prefixes fall back to a scan of their (short) range in the sorted vocabulary
+DEFAULT_MAX_DEPTH = 4
+DEFAULT_NODE_TOP = 16
+# how many of a context's ranked successors are checked against the prefix
+CONTEXT_SCAN_LIMIT = 100
+
+
+class CompletionIndex:
+    """Frequency-annotated prefix index over the vocabulary.
+
+    Words are kept in a sorted array (for range lookups on long prefixes)
+    and every prefix of up to ``max_depth`` characters maps to its
+    ``node_top`` most frequent completions, precomputed in one pass over the
+    count-ranked unigram list.
+    """
+
+    def __init__(self, index: SuccessorIndex, max_depth: int = DEFAULT_MAX_DEPTH,
+                 node_top: int = DEFAULT_NODE_TOP):
+        self.index = index
+        self.max_depth = max_depth
+        self.node_top = node_top
+        self.nodes: Dict[str, List[str]] = {}
+
+        ranked = list(index.unigram_ranked)
+        for word, _ in ranked:
+            for depth in range(1, min(max_depth, len(word)) + 1):
+                node = self.nodes.setdefault(word[:depth], [])
+                if len(node) < node_top:
+                    node.append(word)
+
+        ranked.sort()
+        self.sorted_words = [word for word, _ in ranked]
+        self.sorted_counts = [count for _, count in ranked]
+
+    def nbytes(self, sample_size: int = 1000) -> int:
+        # prefix keys and node lists; the words themselves are the vocabulary's
+        def node_bytes(row) -> int:
+            return sys.getsizeof(row[0]) + sys.getsizeof(row[1])
+
+        return sampled_bytes(self.nodes, node_bytes, sample_size) + \
+            sys.getsizeof(self.sorted_words) + sys.getsizeof(self.sorted_counts)
+
+    def words_with_prefix(self, prefix: str, top_k: int) -> List[str]:
+        if len(prefix) <= self.max_depth:
+            node = self.nodes.get(prefix, [])
+            # a node that is not full already holds every completion
+            if top_k <= len(node) or len(node) < self.node_top:
+                return node[:top_k]
+
+        lo = bisect_left(self.sorted_words, prefix)
+        hi = bisect_left(self.sorted_words, prefix + '\U0010ffff', lo)
+        best = heapq.nlargest(top_k, range(lo, hi), key=lambda i: self.sorted_counts[i])
+        return [self.sorted_words[i] for i in best]
+
+    def complete(self, w1: str, w2: str, prefix: str, top_k: int = 5) -> List[Tuple[str, str]]:
+        """Completions of ``prefix``: trigram matches, then bigram, then unigram."""
+        completions = []
+        seen = set()
+
+        def add(word: str, source: str) -> bool:
+            if word not in seen:
+                seen.add(word)
+                completions.append((word, source))
+            return len(completions) >= top_k
+
+        for source, entry in (('trigram', self.index.trigrams.get((w1, w2))),
+                              ('bigram', self.index.bigrams.get((w2,)))):
+            if entry is None:
+                continue
+            for i, (word, _) in enumerate(entry.top):
+                if i >= CONTEXT_SCAN_LIMIT:
+                    break
+                if word.startswith(prefix) and add(word, source):
+                    return completions
+
+        # seen words may hide some of these, so ask for enough to still fill top_k
+        for word in self.words_with_prefix(prefix, top_k + len(seen)):
+            if add(word, 'unigram'):
+                break
+        return completions
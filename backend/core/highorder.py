@@ -0,0 +1,192 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from core.index import PrefixEntry
+from core.storage import CsrTable, RankedRow, SuccessorView, Vocabulary, END_TOKEN
+
+MAX_ORDER = 6
+HIGHER_ORDERS_VERSION = 1
+
+CSR_FIELDS = ('keys', 'offsets', 'successors', 'counts', 'totals', 'ranks', 'sizes')
+
+
+def count_higher(tokens: List[str], order: int, counts: Dict[int, Counter]):
+    # flat n-gram tuples rather than nested prefix dicts; build() packs them into arrays
+    n_tokens = len(tokens)
+    for n in range(4, order + 1):
+        table = counts[n]
+        for i in range(n_tokens - n + 1):
+            table[tuple(tokens[i:i + n])] += 1
+
+
+def find(keys: array, key: int) -> int:
+    row = bisect_left(keys, key)
+    if row < len(keys) and keys[row] == key:
+        return row
+    return -1
+
+
+def csr_from_sorted(entries, end_id: int) -> CsrTable:
+    """CsrTable.build for (row key, successor id, count) triples already in key order."""
+    keys, offsets = array('Q'), array('Q', [0])
+    successors, counts = array('I'), array('I')
+    totals, ranks, sizes = array('Q'), array('I'), array('I')
+
+    def close_row(row: List[Tuple[int, int]]):
+        offsets.append(len(successors))
+        totals.append(sum(count for _, count in row))
+        if len(row) == 1:
+            ranks.append(0)
+        else:
+            ranks.extend(sorted(range(len(row)), key=lambda i: (row[i][0] == end_id, -row[i][1])))
+        sizes.append(sum(1 for successor, _ in row if successor != end_id))
+
+    row: List[Tuple[int, int]] = []
+    for key, successor, count in entries:
+        if not keys or key != keys[-1]:
+            if row:
+                close_row(row)
+            keys.append(key)
+            row = []
+        successors.append(successor)
+        counts.append(count)
+        row.append((successor, count))
+    if row:
+        close_row(row)
+    return CsrTable(keys, offsets, successors, counts, totals, ranks, sizes)
+
+
+class HighOrderStore:
+    """Orders 4..N in a reversed-context trie over integer word ids.
+
+    ``levels[k]`` holds every context of k words, most recent word first: a
+    node's key is ``parent * radix + word_id`` where parent is the node of
+    the k - 1 most recent words, and keys are sorted so each step is a
+    binary search. One walk back through the history finds the context node
+    of every order at once. ``tables[n]`` holds the order-n successors as
+    CSR rows keyed by the context's node at level n - 1. The store is
+    read-only; the trigram and lower orders stay in NgramModel's tables.
+    """
+
+    def __init__(self, order: int, vocab: Vocabulary, levels: List[array], tables: Dict[int, CsrTable]):
+        self.order = order
+        self.vocab = vocab
+        self.radix = max(len(vocab), 1)
+        self.levels = levels
+        self.tables = tables
+
+    @classmethod
+    def build(cls, counts: Dict[int, Counter], min_counts: Optional[Dict[int, int]] = None) -> 'HighOrderStore':
+        min_counts = min_counts or {}
+        order = max(counts)
+        words = set()
+        for table in counts.values():
+            for gram in table:
+                words.update(gram)
+        vocab = Vocabulary(sorted(words))
+        radix = max(len(vocab), 1)
+        end_id = vocab.lookup(END_TOKEN)
+        word_id = vocab.ids.__getitem__
+
+        # every kept n-gram as (reversed context ids, successor id, count)
+        grams: Dict[int, List[Tuple[Tuple[int, ...], int, int]]] = {}
+        for n, table in counts.items():
+            min_count = min_counts.get(n, 1)
+            grams[n] = sorted((tuple(map(word_id, gram[-2::-1])), word_id(gram[-1]), count)
+                              for gram, count in table.items() if count >= min_count)
+
+        # sorted contexts list every trie level in key order: a new node starts
+        # wherever a context stops sharing its prefix with the one before it
+        levels: List[array] = [array('Q') for _ in range(order)]
+        nodes: Dict[Tuple[int, ...], int] = {}
+        path = [0] * order  # node of the previous context at each level
+        previous: Tuple[int, ...] = ()
+        for context in sorted({context for entries in grams.values() for context, _, _ in entries}):
+            common = 0
+            while common < len(previous) and common < len(context) and previous[common] == context[common]:
+                common += 1
+            for k in range(common + 1, len(context) + 1):
+                parent = path[k - 1] if k > 1 else 0
+                levels[k].append(parent * radix + context[k - 1])
+                path[k] = len(levels[k]) - 1
+            nodes[context] = path[len(context)]
+            previous = context
+
+        tables = {n: csr_from_sorted(((nodes[context], successor, count) for context, successor, count in entries),
+                                     end_id)
+                  for n, entries in grams.items()}
+        return cls(order, vocab, levels, tables)
+
+    def contexts(self, history: List[str]) -> List[Tuple[int, PrefixEntry]]:
+        """(order, entry) for every order whose context ends the history, highest first."""
+        found = []
+        node = 0
+        for k in range(1, min(self.order, len(history) + 1)):
+            word_id = self.vocab.lookup(history[-k])
+            if word_id < 0:
+                break
+            node = find(self.levels[k], node * self.radix + word_id)
+            if node < 0:
+                break
+            table = self.tables.get(k + 1)
+            if table is not None:
+                row = table.find_row(node)
+                if row >= 0:
+                    found.append((k + 1, self.entry(table, row)))
+        found.reverse()
+        return found
+
+    def entry(self, table: CsrTable, row: int) -> PrefixEntry:
+        start, end = table.span(row)
+        top = RankedRow(table, self.vocab, start, table.sizes[row])
+        return PrefixEntry(table.totals[row], table.sizes[row], top, SuccessorView(table, self.vocab, start, end))
+
+    def pruned(self, min_counts: Optional[Dict[int, int]] = None, top_n: Optional[int] = None) -> 'HighOrderStore':
+        """Copy without successors below ``min_counts[n]`` or past the ``top_n`` most frequent."""
+        min_counts = min_counts or {}
+        end_id = self.vocab.lookup(END_TOKEN)
+        tables = {}
+        for n, table in self.tables.items():
+            min_count = min_counts.get(n, 1)
+            rows = {}
+            for row, key in enumerate(table.keys):
+                start, end = table.span(row)
+                kept = [(table.successors[i], table.counts[i]) for i in range(start, end)
+                        if table.counts[i] >= min_count]
+                if top_n is not None and len(kept) > top_n:
+                    kept = sorted(kept, key=lambda item: item[1], reverse=True)[:top_n]
+                if kept:
+                    rows[key] = kept
+            tables[n] = CsrTable.build(rows, end_id)
+        # contexts left without successors stay in the trie; they only cost their key
+        return HighOrderStore(self.order, self.vocab, self.levels, tables)
+
+    def stats(self) -> Dict:
+        return {
+            f"order{n}_{kind}": size
+            for n, table in sorted(self.tables.items())
+            for kind, size in (("contexts", len(table.keys)), ("entries", len(table.successors)))
+        }
+
+    def nbytes(self) -> int:
+        levels = sum(level.itemsize * len(level) for level in self.levels)
+        return levels + sum(table.nbytes() for table in self.tables.values())
+
+    def to_dict(self) -> Dict:
+        # arrays pickle as raw bytes, so this is about as large as the store in memory
+        return {
+            'version': HIGHER_ORDERS_VERSION,
+            'order': self.order,
+            'words': self.vocab.words,
+            'levels': self.levels,
+            'tables': {n: tuple(getattr(table, field) for field in CSR_FIELDS) for n, table in self.tables.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'HighOrderStore':
+        if data.get('version') != HIGHER_ORDERS_VERSION:
+            raise ValueError(f"Unsupported higher-order table version: {data.get('version')}")
+        tables = {n: CsrTable(*fields) for n, fields in data['tables'].items()}
+        return cls(data['order'], Vocabulary(data['words']), data['levels'], tables)
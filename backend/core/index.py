@@ -0,0 +1,248 @@
+import heapq
+import math
+import sys
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from itertools import chain, islice
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from core.layered import LayeredTable
+from core.metrics import recorder
+
+# top_n must stay >= 2 * top_k so a backoff stage can skip every duplicate
+# from the previous stage and still fill top_k (app.py caps top_k at 50)
+DEFAULT_TOP_N = 100
+
+SPECIAL_TOKENS = ('<s>', '</s>')
+
+# total: sum of all successor counts (including '</s>')
+# size: number of successors that can be predicted (excluding '</s>')
+# top: [(word, count)] sorted by count desc, ties kept in table order
+# successors: the live Counter, used for membership checks only
+PrefixEntry = namedtuple('PrefixEntry', ['total', 'size', 'top', 'successors'])
+
+
+def sampled_bytes(table, row_bytes: Callable, sample_size: int = 1000) -> int:
+    """Size of a mapping plus ``row_bytes`` of its items, extrapolated from ``sample_size`` of them"""
+    # a LayeredTable's slots live in its levels
+    size = sum(map(sys.getsizeof, getattr(table, 'levels', [table])))
+    # spread over the whole table: the first rows are the frequent, large ones
+    step = max(1, len(table) // sample_size)
+    rows = list(islice(table.items(), 0, None, step))
+    if not rows:
+        return size
+    return size + sum(map(row_bytes, rows)) * len(table) // len(rows)
+
+
+def list_bytes(items: List) -> int:
+    # a list and the tuples in it; what the tuples point to is counted elsewhere
+    return sys.getsizeof(items) + sum(map(sys.getsizeof, items))
+
+
+class SuccessorIndex:
+    """Build-time top-N successor lists for backoff prediction.
+
+    Scores are computed at query time with the same add-one formula as
+    ``NgramModel.predict_next`` so the ranking is identical, but only the
+    first few entries of each pre-sorted list are ever touched.
+    """
+
+    def __init__(self, top_n: int = DEFAULT_TOP_N):
+        self.top_n = top_n
+        self.trigrams: Dict[Tuple[str, ...], PrefixEntry] = {}
+        self.bigrams: Dict[Tuple[str, ...], PrefixEntry] = {}
+        self.unigram_total = 0
+        self.unigram_ranked: List[Tuple[str, int]] = []
+        # word -> first-seen position in the unigram table, the ranking's tie-break
+        self.unigram_positions: Dict[str, int] = {}
+
+    def build(self, trigrams, bigrams, unigrams) -> 'SuccessorIndex':
+        self.trigrams = {prefix: self.make_entry(successors)
+                         for prefix, successors in trigrams.items()}
+        self.bigrams = {prefix: self.make_entry(successors)
+                        for prefix, successors in bigrams.items()}
+        self.rank_unigrams(unigrams)
+        return self
+
+    def copy(self) -> 'SuccessorIndex':
+        # nothing is modified in place (refresh stacks new entries on the
+        # tables and replaces the ranking), so the clone shares all of it
+        clone = SuccessorIndex(self.top_n)
+        clone.trigrams = self.trigrams
+        clone.bigrams = self.bigrams
+        clone.unigram_total = self.unigram_total
+        clone.unigram_ranked = self.unigram_ranked
+        clone.unigram_positions = self.unigram_positions
+        return clone
+
+    def refresh(self, trigrams, trigram_prefixes, bigrams, bigram_prefixes, unigrams, unigram_changes):
+        # rebuild only the entries whose successor tables changed;
+        # unigram_changes maps each changed (word,) to the count it gained
+        self.trigrams = LayeredTable.wrap(self.trigrams).updated(
+            {prefix: self.make_entry(trigrams[prefix]) for prefix in trigram_prefixes})
+        self.bigrams = LayeredTable.wrap(self.bigrams).updated(
+            {prefix: self.make_entry(bigrams[prefix]) for prefix in bigram_prefixes})
+        self.rerank_unigrams(unigrams, unigram_changes)
+
+    def make_entry(self, successors) -> PrefixEntry:
+        total = sum(successors.values())
+        items = [(word, count) for word, count in successors.items() if word != '</s>']
+        top = heapq.nlargest(self.top_n, items, key=lambda item: item[1])
+        return PrefixEntry(total, len(items), top, successors)
+
+    def rank_unigrams(self, unigrams):
+        self.unigram_total = sum(unigrams.values())
+        ranked = []
+        positions = {}
+        for gram, count in unigrams.items():
+            word = gram[0] if isinstance(gram, tuple) else gram
+            positions[word] = len(positions)
+            if word not in SPECIAL_TOKENS:
+                ranked.append((word, count))
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        self.unigram_ranked = ranked
+        self.unigram_positions = positions
+
+    def rerank_unigrams(self, unigrams, changes):
+        # same order as rank_unigrams (count desc, then first seen), but only
+        # the changed words move: a copy of the list and a bisect per word
+        new_words = {gram[0]: len(self.unigram_positions) + i
+                     for i, gram in enumerate(gram for gram in changes if gram[0] not in self.unigram_positions)}
+        positions = LayeredTable.wrap(self.unigram_positions).updated(new_words) if new_words \
+            else self.unigram_positions
+
+        def rank_key(item):
+            return -item[1], positions[item[0]]
+
+        ranked = list(self.unigram_ranked)
+        for gram, gained in changes.items():
+            word = gram[0]
+            if word in SPECIAL_TOKENS or not gained:
+                continue
+            count = unigrams.get(gram, 0)
+            if word not in new_words:
+                old = bisect_left(ranked, (-(count - gained), positions[word]), key=rank_key)
+                del ranked[old]
+            ranked.insert(bisect_left(ranked, (-count, positions[word]), key=rank_key), (word, count))
+        self.unigram_total += sum(changes.values())
+        self.unigram_ranked = ranked
+        self.unigram_positions = positions
+
+    def supports(self, top_k: int) -> bool:
+        return 2 * top_k <= self.top_n
+
+    def nbytes(self, sample_size: int = 1000) -> int:
+        """Approximate size of the entries and the unigram ranking, not of the tables they point into"""
+        def entry_bytes(row) -> int:
+            entry = row[1]
+            return sys.getsizeof(entry) + list_bytes(entry.top)
+
+        return sampled_bytes(self.trigrams, entry_bytes, sample_size) + \
+            sampled_bytes(self.bigrams, entry_bytes, sample_size) + list_bytes(self.unigram_ranked) + \
+            sampled_bytes(self.unigram_positions, lambda row: sys.getsizeof(row[1]), sample_size)
+
+    def predict(self, w1: str, w2: str, top_k: int, vocab_size: int,
+                higher: Sequence[Tuple[int, PrefixEntry]] = ()) -> List[Dict]:
+        # higher: (order, entry) of 4-gram and longer contexts, highest order first
+        rec = recorder()
+        stages = []
+        seen = set()
+        found = 0
+
+        # longest contexts first
+        for order, entry in higher:
+            if found >= top_k:
+                break
+            duplicates = sum(1 for word in seen if word in entry.successors)
+            stages.append(self.score(entry.top, entry.total, vocab_size, seen, top_k, f'{order}-gram'))
+            found += entry.size - duplicates
+        if rec and higher:
+            rec.mark('higher')
+
+        # then trigram
+        entry = self.trigrams.get((w1, w2))
+        if found < top_k and entry is not None:
+            duplicates = sum(1 for word in seen if word in entry.successors)
+            stages.append(self.score(entry.top, entry.total, vocab_size, seen, top_k, 'trigram'))
+            found += entry.size - duplicates
+        if rec:
+            rec.mark('trigram')
+
+        # then try bigram
+        entry = self.bigrams.get((w2,))
+        if found < top_k and entry is not None:
+            duplicates = sum(1 for word in seen if word in entry.successors)
+            stages.append(self.score(entry.top, entry.total, vocab_size, seen, top_k, 'bigram'))
+            found += entry.size - duplicates
+        if rec:
+            rec.mark('bigram')
+
+        # finally backoff to unigram
+        if found < top_k:
+            stages.append(self.score(self.unigram_ranked, self.unigram_total, vocab_size,
+                                     seen, top_k, 'unigram'))
+            if rec:
+                rec.mark('unigram')
+
+        # a longer context always ranks first, so the list for a larger top_k
+        # only ever extends the one for a smaller top_k
+        ranked = list(islice(chain.from_iterable(stages), top_k))
+        if rec:
+            rec.mark('sort')
+        return ranked
+
+    def predict_many(self, contexts: Sequence[Tuple[str, str]], top_k: int) -> List[List[str]]:
+        """The words ``predict`` ranks for each distinct (w1, w2) context, in one pass.
+
+        Contexts are grouped by w2, so each bigram entry is fetched once per
+        group and the unigram list once per call; only the trigram stage is
+        looked at per context. Stages follow one another as in ``predict``,
+        and within a stage the top list is already the order, so no
+        probability needs computing to rank words.
+        """
+        by_w2: Dict[str, List[int]] = defaultdict(list)
+        for j, (_, w2) in enumerate(contexts):
+            by_w2[w2].append(j)
+
+        results: List[List[str]] = [None] * len(contexts)
+        unigram_stage = None
+        for w2, members in by_w2.items():
+            bigram = self.bigrams.get((w2,))
+            bigram_stage = None
+            for j in members:
+                entry = self.trigrams.get((contexts[j][0], w2))
+                if entry is not None and entry.size >= top_k:
+                    # nothing to back off to: the top list is the ranking
+                    results[j] = [word for word, _ in entry.top[:top_k]]
+                    continue
+
+                ranked = [word for word, _ in entry.top] if entry is not None else []
+                found = len(ranked)
+                seen = set(ranked)
+                if bigram is not None:
+                    if bigram_stage is None:
+                        # fewer than top_k trigram words to skip
+                        bigram_stage = [word for word, _ in bigram.top[:2 * top_k]]
+                    ranked += [word for word in bigram_stage if word not in seen][:top_k - found]
+                    found += bigram.size - sum(map(bigram.successors.__contains__, seen))
+                    seen.update(ranked)
+                if found < top_k:
+                    if unigram_stage is None:
+                        unigram_stage = [word for word, _ in self.unigram_ranked[:3 * top_k]]
+                    ranked += [word for word in unigram_stage if word not in seen][:top_k]
+                results[j] = ranked[:top_k]
+        return results
+
+    @staticmethod
+    def score(ranked: List[Tuple[str, int]], total: int, vocab_size: int,
+              seen: set, top_k: int, source: str) -> List[Dict]:
+        scored = []
+        for word, count in ranked:
+            if word in seen:
+                continue
+            seen.add(word)
+            prob = math.log((count + 1) / (total + vocab_size))
+            scored.append({'word': word, 'prob': prob, 'source': source})
+            if len(scored) == top_k:
+                break
+        return scored
@@ -0,0 +1,130 @@
+import heapq
+from collections import Counter
+from typing import Dict, List, Optional
+
+from core.index import SuccessorIndex, SPECIAL_TOKENS
+from core.metrics import recorder
+
+DEFAULT_WEIGHTS = [0.1, 0.3, 0.6]
+
+INTERPOLATION_MODES = ('fast', 'exact')
+
+
+class InterpolationEngine:
+    """Top-k search for linearly interpolated trigram probabilities.
+
+    ``exact`` scores every vocabulary word like the original implementation.
+    ``fast`` runs the threshold algorithm over the three count-sorted lists
+    of the successor index (trigram successors, bigram successors, unigrams):
+    a word that has not been reached in any list cannot score higher than the
+    interpolation of the current list positions, so the search stops as soon
+    as the k-th best score beats that bound. Both modes rank by
+    (probability desc, word asc) and return the same list.
+    """
+
+    def __init__(self, trigrams, bigrams, unigrams, index: SuccessorIndex):
+        self.trigrams = trigrams
+        self.bigrams = bigrams
+        self.unigrams = unigrams
+        self.index = index
+
+    def context(self, w1: str, w2: str):
+        # per-request denominators, shared by every candidate
+        unigram_w2 = self.unigrams.get((w2,), 0)
+        bigram_w1_w2 = self.bigrams.get((w1,), Counter()).get(w2, 0)
+        return unigram_w2, bigram_w1_w2
+
+    def score(self, unigram_count: int, bigram_count: int, trigram_count: int,
+              unigram_w2: int, bigram_w1_w2: int, weights: List[float]) -> float:
+        total_unigrams = self.index.unigram_total
+        prob1 = unigram_count / total_unigrams if total_unigrams > 0 else 0
+        prob2 = bigram_count / unigram_w2 if unigram_w2 > 0 else 0
+        prob3 = trigram_count / bigram_w1_w2 if bigram_w1_w2 > 0 else 0
+
+        return (prob1 * weights[0]) + (prob2 * weights[1]) + (prob3 * weights[2])
+
+    def predict(self, w1: str, w2: str, top_k: int = 5, mode: str = 'fast',
+                weights: Optional[List[float]] = None) -> List[Dict]:
+        if mode not in INTERPOLATION_MODES:
+            raise ValueError(f"Unknown interpolation mode: {mode}")
+        weights = weights or DEFAULT_WEIGHTS
+
+        if mode == 'exact':
+            scored = self.score_all(w1, w2, weights)
+        else:
+            scored = self.score_threshold(w1, w2, top_k, weights)
+        rec = recorder()
+        if rec:
+            rec.mark('score')
+
+        best = heapq.nsmallest(top_k, scored.items(), key=lambda item: (-item[1], item[0]))
+        if rec:
+            rec.mark('sort')
+        return [{'word': word, 'prob': prob} for word, prob in best]
+
+    def score_all(self, w1: str, w2: str, weights: List[float]) -> Dict[str, float]:
+        unigram_w2, bigram_w1_w2 = self.context(w1, w2)
+        trigram_next = self.trigrams.get((w1, w2), Counter())
+        bigram_next = self.bigrams.get((w2,), Counter())
+
+        scored = {}
+        for word, unigram_count in self.index.unigram_ranked:
+            prob = self.score(unigram_count, bigram_next.get(word, 0), trigram_next.get(word, 0),
+                              unigram_w2, bigram_w1_w2, weights)
+            if prob > 0:
+                scored[word] = prob
+        return scored
+
+    def score_threshold(self, w1: str, w2: str, top_k: int, weights: List[float]) -> Dict[str, float]:
+        unigram_w2, bigram_w1_w2 = self.context(w1, w2)
+        trigram_entry = self.index.trigrams.get((w1, w2))
+        bigram_entry = self.index.bigrams.get((w2,))
+        trigram_next = trigram_entry.successors if trigram_entry else Counter()
+        bigram_next = bigram_entry.successors if bigram_entry else Counter()
+
+        scored = {}
+        kth_best = []  # min-heap of the top_k scores seen so far
+
+        def visit(word: str):
+            if word in scored or word in SPECIAL_TOKENS:
+                return
+            prob = self.score(self.unigrams.get((word,), 0), bigram_next.get(word, 0),
+                              trigram_next.get(word, 0), unigram_w2, bigram_w1_w2, weights)
+            if prob <= 0:
+                return
+            scored[word] = prob
+            if len(kth_best) < top_k:
+                heapq.heappush(kth_best, prob)
+            elif prob > kth_best[0]:
+                heapq.heapreplace(kth_best, prob)
+
+        # a top list that was cut at top_n cannot bound the words after it,
+        # so visit that prefix's whole successor table instead
+        for entry in (trigram_entry, bigram_entry):
+            if entry is not None and len(entry.top) < entry.size:
+                for word in entry.successors:
+                    visit(word)
+
+        trigram_top = trigram_entry.top if trigram_entry else []
+        bigram_top = bigram_entry.top if bigram_entry else []
+        unigram_top = self.index.unigram_ranked
+        depth = 0
+
+        while True:
+            trigram_bound = trigram_top[depth][1] if depth < len(trigram_top) else 0
+            bigram_bound = bigram_top[depth][1] if depth < len(bigram_top) else 0
+            unigram_bound = unigram_top[depth][1] if depth < len(unigram_top) else 0
+            if not (trigram_bound or bigram_bound or unigram_bound):
+                break
+
+            for ranked in (trigram_top, bigram_top, unigram_top):
+                if depth < len(ranked):
+                    visit(ranked[depth][0])
+
+            threshold = self.score(unigram_bound, bigram_bound, trigram_bound,
+                                   unigram_w2, bigram_w1_w2, weights)
+            if len(kth_best) == top_k and kth_best[0] > threshold:
+                break
+            depth += 1
+
+        return scored
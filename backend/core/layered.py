@@ -0,0 +1,69 @@
+from collections.abc import Mapping
+from typing import Dict, List
+
+# a level is merged into the next older one once it holds a quarter of its keys
+MERGE_RATIO = 4
+
+_MISSING = object()
+
+
+class LayeredTable(Mapping):
+    """Read-only mapping made of stacked dicts, newest first, for copy-on-write updates.
+
+    ``updated(changes)`` returns a new table with ``changes`` stacked on top
+    and leaves this one untouched, sharing every level with it, so an
+    update costs about the size of its changes rather than the table's.
+    Small levels are merged into the next older one as they grow, which
+    keeps the number of levels logarithmic in the table size; a merge
+    builds a new dict and never modifies a level another table still
+    uses. Iteration yields keys in the order they first appeared.
+    """
+
+    __slots__ = ('levels', 'size')
+
+    def __init__(self, levels: List[Mapping], size: int):
+        self.levels = levels
+        self.size = size
+
+    @classmethod
+    def wrap(cls, table: Mapping) -> 'LayeredTable':
+        if isinstance(table, LayeredTable):
+            return table
+        return cls([table], len(table))
+
+    def updated(self, changes: Dict) -> 'LayeredTable':
+        added = sum(1 for key in changes if key not in self)
+        levels = [changes] + self.levels
+        while len(levels) > 1 and len(levels[0]) * MERGE_RATIO >= len(levels[1]):
+            merged = dict(levels[1])
+            merged.update(levels[0])
+            levels[:2] = [merged]
+        return LayeredTable(levels, self.size + added)
+
+    def get(self, key, default=None):
+        for level in self.levels:
+            # Mapping.get never inserts, even when a level is a defaultdict
+            value = level.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        return any(key in level for level in self.levels)
+
+    def __iter__(self):
+        levels = self.levels
+        for depth in range(len(levels) - 1, -1, -1):
+            older = levels[depth + 1:]
+            for key in levels[depth]:
+                if not any(key in level for level in older):
+                    yield key
+
+    def __len__(self) -> int:
+        return self.size
@@ -0,0 +1,221 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# seconds; predictions run from microseconds (indexed backoff) to tens of milliseconds
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# stage marks cost about as much as an indexed prediction, so they are sampled
+DEFAULT_STAGE_SAMPLE_EVERY = 16
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Local(threading.local):
+    # a class default keeps the lookup cheap on threads that are not being timed
+    recorder = None
+
+
+_local = _Local()
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class StageRecorder:
+    """Splits one prediction into consecutive stages.
+
+    Code on the hot path calls ``mark(stage)`` when a stage ends; the time
+    since the previous mark is charged to it.
+    """
+
+    __slots__ = ('last', 'stages')
+
+    def __init__(self):
+        self.last = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+
+def recorder() -> Optional[StageRecorder]:
+    """The recorder of the prediction running on this thread, if it is being timed."""
+    return _local.recorder
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Metrics:
+    """Counters and histograms rendered in the Prometheus text format.
+
+    Metric families are created on first use; ``collectors`` are called at
+    scrape time for gauges whose values live elsewhere (cache sizes etc.).
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.help: Dict[str, str] = {}
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, Dict, float]]]] = []
+        self.timers: Dict[Tuple[str, str], 'PredictionTimer'] = {}
+        self.lock = threading.Lock()
+        self.enabled = True
+        # every call is timed, one call in this many also gets a stage breakdown
+        self.stage_sample_every = DEFAULT_STAGE_SAMPLE_EVERY
+
+    def describe(self, name: str, text: str):
+        self.help[name] = text
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        key = tuple(sorted(labels.items()))
+        family = self.histograms.get(name)
+        histogram = family.get(key) if family is not None else None
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, {}).setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name: str, value: float, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.counters.setdefault(name, {})
+            family[key] = family.get(key, 0) + amount
+
+    def timed(self, fn: Callable, model: str, method: str) -> Callable:
+        """Wrap a prediction call so its total and per-stage times are recorded."""
+        if not self.enabled:
+            return fn
+        key = (model, method)
+        timer = self.timers.get(key)
+        if timer is None:
+            timer = PredictionTimer(self, model, method)
+            with self.lock:
+                timer = self.timers.setdefault(key, timer)
+        return timer.wrap(fn)
+
+    @staticmethod
+    def format_labels(labels: Labels, extra: str = '') -> str:
+        parts = [f'{key}="{escape(str(value))}"' for key, value in labels]
+        if extra:
+            parts.append(extra)
+        return '{' + ','.join(parts) + '}' if parts else ''
+
+    def header(self, lines: List[str], name: str, kind: str):
+        if name in self.help:
+            lines.append(f"# HELP {name} {self.help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self.lock:
+            counters = {name: dict(family) for name, family in self.counters.items()}
+            histograms = {name: dict(family) for name, family in self.histograms.items()}
+
+        for name, family in sorted(counters.items()):
+            self.header(lines, name, 'counter')
+            for labels, value in sorted(family.items()):
+                lines.append(f"{name}{self.format_labels(labels)} {value:g}")
+
+        for name, family in sorted(histograms.items()):
+            self.header(lines, name, 'histogram')
+            for labels, histogram in sorted(family.items()):
+                with histogram.lock:
+                    counts, total, count = list(histogram.counts), histogram.sum, histogram.count
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, counts):
+                    cumulative += bucket_count
+                    bucket_labels = self.format_labels(labels, 'le="%g"' % bound)
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                bucket_labels = self.format_labels(labels, 'le="+Inf"')
+                lines.append(f"{name}_bucket{bucket_labels} {count}")
+                lines.append(f"{name}_sum{self.format_labels(labels)} {total:.9g}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+
+        gauges: Dict[str, List[Tuple[Labels, float]]] = {}
+        for collect in self.collectors:
+            for name, text, labels, value in collect():
+                self.help.setdefault(name, text)
+                gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+        for name, samples in sorted(gauges.items()):
+            self.header(lines, name, 'gauge')
+            for labels, value in samples:
+                lines.append(f"{name}{self.format_labels(labels)} {value:g}")
+
+        return '\n'.join(lines) + '\n'
+
+
+class PredictionTimer:
+    """Histograms of one (model, method) pair, resolved once and reused by every call."""
+
+    def __init__(self, metrics: Metrics, model: str, method: str):
+        self.metrics = metrics
+        self.model = model
+        self.method = method
+        self.total = metrics.histogram('ngram_prediction_seconds', model=model, method=method)
+        self.stages: Dict[str, Histogram] = {}
+        self.calls = 0
+
+    def stage(self, name: str) -> Histogram:
+        histogram = self.stages.get(name)
+        if histogram is None:
+            histogram = self.stages[name] = self.metrics.histogram(
+                'ngram_prediction_stage_seconds', model=self.model, method=self.method, stage=name)
+        return histogram
+
+    def wrap(self, fn: Callable) -> Callable:
+        def run(*args, **kwargs):
+            self.calls += 1
+            stages = None
+            if self.calls % self.metrics.stage_sample_every == 0:
+                stages = _local.recorder = StageRecorder()
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                self.metrics.inc('ngram_prediction_errors_total', model=self.model, method=self.method)
+                raise
+            finally:
+                total = time.perf_counter() - start
+                self.total.observe(total)
+                if stages is not None:
+                    _local.recorder = None
+                    self.record_stages(stages, total)
+        return run
+
+    def record_stages(self, stages: StageRecorder, total: float):
+        accounted = 0.0
+        for name, seconds in stages.stages:
+            self.stage(name).observe(seconds)
+            accounted += seconds
+        if stages.stages:
+            self.stage('other').observe(max(0.0, total - accounted))
+
+
+METRICS = Metrics()
+METRICS.describe('ngram_prediction_seconds', 'Time spent computing one prediction, by model and method')
+METRICS.describe('ngram_prediction_stage_seconds', 'Time spent in each stage of a sampled prediction')
+METRICS.describe('ngram_prediction_errors_total', 'Predictions that raised an error')
+METRICS.describe('ngram_requests_total', 'Prediction requests served, by model, method and cache outcome')
@@ -0,0 +1,297 @@
+import heapq
+import sys
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from core.index import SuccessorIndex, PrefixEntry, DEFAULT_TOP_N, sampled_bytes, list_bytes
+from core.interpolation import InterpolationEngine
+from core.metrics import recorder
+from core.tokenizer import DEFAULT_TOKENIZER
+
+DEFAULT_PREFIX_CACHE_ENTRIES = 50000
+FLOAT_BYTES = sys.getsizeof(1.0)
+
+
+def normalize_weights(weights: Dict[str, float]) -> Dict[str, float]:
+    """Validated weights without the zero ones, in name order."""
+    if not weights:
+        raise ValueError("A mixture needs at least one component")
+    for name, weight in weights.items():
+        if not isinstance(weight, (int, float)) or weight < 0:
+            raise ValueError(f"Mixture weight for '{name}' must be a non-negative number")
+    kept = {name: float(weight) for name, weight in sorted(weights.items()) if weight > 0}
+    if not kept:
+        raise ValueError("At least one mixture weight must be positive")
+    return kept
+
+
+class MergedEntries:
+    """Per-prefix PrefixEntry records merged from the component indexes on demand.
+
+    A merged entry sums every component's successor counts scaled by its
+    weight, so it costs one pass over those successors; the result is kept
+    in an LRU of ``max_entries`` prefixes. Prefixes no component has are
+    not cached, they are cheap to miss again.
+    """
+
+    def __init__(self, parts: List[Tuple[float, object]], top_n: int, max_entries: int):
+        self.parts = parts  # (weight, component table of PrefixEntry records)
+        self.top_n = top_n
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Tuple[str, ...], PrefixEntry]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, prefix, default=None):
+        with self.lock:
+            entry = self.entries.get(prefix)
+            if entry is not None:
+                self.entries.move_to_end(prefix)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = self.merge(prefix)
+        if entry is None:
+            return default
+        if self.max_entries > 0:
+            with self.lock:
+                self.entries[prefix] = entry
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return entry
+
+    def __contains__(self, prefix) -> bool:
+        return any(prefix in table for _, table in self.parts)
+
+    def merge(self, prefix) -> Optional[PrefixEntry]:
+        found = []
+        for weight, table in self.parts:
+            entry = table.get(prefix)
+            if entry is not None:
+                found.append((weight, entry))
+        if not found:
+            return None
+        if len(found) == 1 and found[0][0] == 1.0:
+            return found[0][1]
+
+        counts = Counter()
+        for weight, entry in found:
+            for word, count in entry.successors.items():
+                counts[word] += weight * count
+        items = [(word, count) for word, count in counts.items() if word != '</s>']
+        top = heapq.nlargest(self.top_n, items, key=lambda item: item[1])
+        return PrefixEntry(sum(weight * entry.total for weight, entry in found), len(items), top, counts)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def nbytes(self, sample_size: int = 1000) -> int:
+        def entry_bytes(row) -> int:
+            entry = row[1]
+            size = sys.getsizeof(row[0])
+            # merged totals are weighted sums, so floats; an entry passed
+            # through from a single component keeps its int total and is the component's
+            if isinstance(entry.total, float):
+                # merged counts are floats, one per successor; the words are the components'
+                size += sys.getsizeof(entry) + list_bytes(entry.top) + sys.getsizeof(entry.successors) + \
+                    len(entry.successors) * FLOAT_BYTES
+            return size
+
+        with self.lock:
+            return sampled_bytes(self.entries, entry_bytes, sample_size)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class SuccessorTables:
+    """prefix -> successor counts, read through merged entries (what InterpolationEngine looks up)."""
+
+    def __init__(self, entries: MergedEntries):
+        self.entries = entries
+
+    def get(self, prefix, default=None):
+        entry = self.entries.get(prefix)
+        return default if entry is None else entry.successors
+
+
+class MixtureIndex(SuccessorIndex):
+    """SuccessorIndex whose counts are the weighted sum of several models' indexes.
+
+    Trigram and bigram entries are merged per prefix on first use and
+    cached; the unigram ranking is merged once up front. Everything
+    NgramModel does with an index (backoff ranking, the interpolation
+    threshold search) then runs on the mixture unchanged.
+    """
+
+    def __init__(self, parts: List[Tuple[float, SuccessorIndex]], top_n: int = DEFAULT_TOP_N,
+                 cache_entries: int = DEFAULT_PREFIX_CACHE_ENTRIES):
+        super().__init__(min([top_n] + [index.top_n for _, index in parts]))
+        self.trigrams = MergedEntries([(weight, index.trigrams) for weight, index in parts],
+                                      self.top_n, cache_entries)
+        self.bigrams = MergedEntries([(weight, index.bigrams) for weight, index in parts],
+                                     self.top_n, cache_entries)
+        unigram_counts = Counter()
+        for weight, index in parts:
+            for word, count in index.unigram_ranked:
+                unigram_counts[word] += weight * count
+        self.unigram_total = sum(weight * index.unigram_total for weight, index in parts)
+        self.unigram_ranked = sorted(unigram_counts.items(), key=lambda item: item[1], reverse=True)
+
+    def supports(self, top_k: int) -> bool:
+        # merged top lists hold top_n words even when the components' lists are longer
+        return 2 * top_k <= self.top_n
+
+    def nbytes(self, sample_size: int = 1000) -> int:
+        return self.trigrams.nbytes(sample_size) + self.bigrams.nbytes(sample_size) + \
+            list_bytes(self.unigram_ranked)
+
+
+class ComposedModel:
+    """Query side of a read-only model built over other models' indexes.
+
+    Subclasses set ``index`` (a SuccessorIndex), ``interpolator``,
+    ``vocab_size`` and ``total_tokens``; backoff and interpolation run
+    on them at the trigram level like NgramModel, other methods are
+    rejected the way QuantizedModel rejects them.
+    """
+
+    methods = ('backoff', 'interpolation')
+    kind = 'Composed'
+    order = 3
+    is_trained = True
+
+    def tokenize(self, text: str, special_tokens: bool = True) -> List[str]:
+        return DEFAULT_TOKENIZER.tokenize(text, special_tokens)
+
+    def context_key(self, text: str, method: str = 'backoff') -> Tuple:
+        return tuple(self.tokenize(text, False)[-2:])
+
+    def rank_next(self, w1: str, w2: str, top_k: int) -> List[Dict]:
+        return self.index.predict(w1, w2, top_k, self.vocab_size)
+
+    def predict_next(self, context: str, top_k: int = 5) -> List[str]:
+        tokens = self.tokenize(context, False)
+        rec = recorder()
+        if rec:
+            rec.mark('tokenize')
+        if len(tokens) < 2:
+            return []
+        return [c['word'] for c in self.rank_next(tokens[-2], tokens[-1], top_k)]
+
+    def predict_with_interpolation(self, text: str, top_k: int = 5, mode: str = 'fast') -> List[str]:
+        tokens = self.tokenize(text, False)
+        rec = recorder()
+        if rec:
+            rec.mark('tokenize')
+        if len(tokens) < 2:
+            return []
+        return [p['word'] for p in self.interpolator.predict(tokens[-2], tokens[-1], top_k, mode)]
+
+    def predict_batch(self, texts: List[str], top_k: int = 5, method: str = 'backoff',
+                      mode: str = 'fast') -> List[List[str]]:
+        self.require(method)
+        cache: Dict[Tuple[str, ...], List[str]] = {}
+        results = []
+        for text in texts:
+            tokens = self.tokenize(text, False)
+            if len(tokens) < 2:
+                results.append([])
+                continue
+            key = (tokens[-2], tokens[-1])
+            if key not in cache:
+                if method == 'interpolation':
+                    ranked = self.interpolator.predict(key[0], key[1], top_k, mode)
+                else:
+                    ranked = self.rank_next(key[0], key[1], top_k)
+                cache[key] = [c['word'] for c in ranked]
+            results.append(list(cache[key]))
+        return results
+
+    def require(self, method: str):
+        if method not in self.methods:
+            raise ValueError(f"{self.kind} models only support {', '.join(self.methods)} prediction, not '{method}'")
+
+    def complete(self, text: str, top_k: int = 5) -> List[str]:
+        self.require('completion')
+
+    def has_scorer(self, method: str) -> bool:
+        return False
+
+    def scorer(self, method: str):
+        self.require(method)
+
+    def predict_scored(self, text: str, top_k: int = 5, method: str = 'kneser_ney') -> List[str]:
+        self.require(method)
+
+
+class MixtureModel(ComposedModel):
+    """Read-only model that answers from several loaded models at query time.
+
+    Counts are combined as ``sum(weight * count)`` over the components, so
+    weights of 1.0 reproduce a model trained on all of their corpora
+    together, and other weights blend styles without retraining. Backoff
+    and interpolation are supported; both run on the trigram level, so
+    components' higher orders are not used.
+    """
+
+    kind = 'Mixture'
+
+    def __init__(self, components: Dict[str, object], weights: Dict[str, float],
+                 cache_entries: int = DEFAULT_PREFIX_CACHE_ENTRIES):
+        weights = normalize_weights(weights)
+        missing = [name for name in weights if components.get(name) is None]
+        if missing:
+            raise ValueError(f"Mixture components not available: {', '.join(missing)}")
+        for name in weights:
+            if getattr(components[name], 'index', None) is None:
+                raise ValueError(f"Mixture component '{name}' has no successor index (quantized models cannot be mixed)")
+
+        self.weights = weights
+        self.components = {name: components[name] for name in weights}
+        self.cache_entries = cache_entries
+        self.index = MixtureIndex([(weight, self.components[name].index) for name, weight in weights.items()],
+                                  cache_entries=cache_entries)
+
+        # full unigram counts, specials included, for the interpolation denominators
+        self.unigrams = Counter()
+        for name, weight in weights.items():
+            for gram, count in self.components[name].unigrams.items():
+                self.unigrams[gram if isinstance(gram, tuple) else (gram,)] += weight * count
+        self.interpolator = InterpolationEngine(SuccessorTables(self.index.trigrams),
+                                                SuccessorTables(self.index.bigrams), self.unigrams, self.index)
+        self.vocab_size = len(self.unigrams)
+        self.total_tokens = sum(model.total_tokens for model in self.components.values())
+
+    @property
+    def name(self) -> str:
+        return "+".join(f"{name}*{weight:g}" for name, weight in self.weights.items())
+
+    def updated(self, texts) -> 'MixtureModel':
+        raise ValueError("Mixture models are read-only; update one of their component models instead")
+
+    def replacing(self, old, new) -> Optional['MixtureModel']:
+        """A copy with component ``old`` swapped for ``new``, or None if ``old`` is not a component."""
+        names = [name for name, model in self.components.items() if model is old]
+        if not names:
+            return None
+        components = dict(self.components)
+        for name in names:
+            components[name] = new
+        return MixtureModel(components, self.weights, self.cache_entries)
+
+    def cache_stats(self) -> Dict:
+        return {"trigrams": self.index.trigrams.stats(), "bigrams": self.index.bigrams.stats()}
+
+    def memory_bytes(self, sample_size: int = 1000) -> int:
+        # the components are accounted for as models of their own; this is the
+        # merged unigram tables and the prefix caches as filled so far
+        def unigram_bytes(row) -> int:
+            return sys.getsizeof(row[0]) + sys.getsizeof(row[1])
+
+        return sampled_bytes(self.unigrams, unigram_bytes, sample_size) + self.index.nbytes(sample_size)
@@ -1,13 +1,43 @@
 import os
 import sys
-import re
+import copy
 import math
+import logging
+import threading
 import pickle
 from collections import defaultdict, Counter
-from typing import List, Dict, Tuple, Optional, Union
+from itertools import chain, islice
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, Sequence
+from core.layered import LayeredTable
+from core.index import SuccessorIndex, PrefixEntry, DEFAULT_TOP_N, SPECIAL_TOKENS, sampled_bytes
+from core.interpolation import InterpolationEngine
+from core.storage import CompactNgramStore
+from core.binary import MappedNgramStore, BINARY_EXTENSION, write_binary
+from core.parallel import count_files_parallel
+from core.completion import CompletionIndex
+from core.tokenizer import DEFAULT_TOKENIZER
+from core.catalog import catalog_for, write_metadata
+from core.highorder import HighOrderStore, count_higher, MAX_ORDER
+from core.metrics import recorder
+from core.scoring import (SCORING_METHODS, KneserNeyTables, KneserNeyEngine,
+                          StupidBackoffEngine)
+
+logger = logging.getLogger(__name__)
 
 class NgramModel:
-    def __init__(self, model_data: Optional[Dict] = None):
+    def __init__(self, model_data: Optional[Dict] = None, order: int = 3):
+        if not 3 <= order <= MAX_ORDER:
+            raise ValueError(f"Model order must be between 3 and {MAX_ORDER}, got {order}")
+        self.order = order
+        self.higher = None  # HighOrderStore for 4-grams and up
+        self.higher_counts = {}
+        self.index = None
+        self.interpolator = None
+        self.storage = None
+        self.completer = None
+        self.kn_tables = None
+        self.scorers = {}
+        self.scorer_lock = threading.Lock()
         if model_data:
             self.load_from_dict(model_data)
         else:
@@ -78,222 +108,492 @@ class NgramModel:
                     tuple_key = (key,) if isinstance(key, str) else key
                     self.unigrams[tuple_key] = count
         
+        if 'scoring' in model_data:
+            self.kn_tables = KneserNeyTables.from_dict(model_data['scoring'])
+        
+        self.order = model_data.get('order', 3)
+        if 'higher_orders' in model_data:
+            self.higher = HighOrderStore.from_dict(model_data['higher_orders'])
+        
         self.vocab_size = model_data.get('vocab_size', len(self.unigrams))
         self.total_tokens = model_data.get('total_tokens', sum(self.unigrams.values()))
         self.is_trained = True
+        self.build_index()
         
-        print(f'Loaded N-gram model with vocabulary size: {self.vocab_size}')
-        print(f'Total tokens: {self.total_tokens}')
+        logger.info('Loaded N-gram model with vocabulary size: %d, total tokens: %d',
+                    self.vocab_size, self.total_tokens)
     
     def normalize(self, text: str) -> str:
-        text = text.lower().strip()
-        text = re.sub(r"[^\w\s']|'(?![a-z])|(?<![a-z])'", '', text)
-        text = re.sub(r"\s+'\s+|^'\s+|\s+'$", ' ', text)
-        
-        return text
+        return DEFAULT_TOKENIZER.normalize(text)
     
     def tokenize(self, text: str, special_tokens: bool = True) -> List[str]:
-        if not text.strip():
-            return []
-        normalized_text = self.normalize(text)
-        tokens = normalized_text.split()
-        tokens = [t for t in tokens if t]
-        
-        if special_tokens:
-            return ['<s>'] + tokens + ['</s>']
-        return tokens
-    
-    def generate_ngrams(self, tokens: List[str], n: int = 3) -> Dict[Tuple[str, ...], int]:
-        ngrams = defaultdict(int)
-        sentence = []
-        total_tokens = len(tokens)
-        
-        # only show progress for large datasets
-        show_progress = total_tokens > 10000
-        if show_progress:
-            print(f"Generating {n}-grams from {total_tokens:,} tokens...")
-            update_freq = max(1, total_tokens // 100)
-        
-        for i, token in enumerate(tokens):
-            sentence.append(token)
-            
-            if token == '</s>':
-                if len(sentence) >= n:
-                    for j in range(len(sentence) - n + 1):
-                        gram = tuple(sentence[j:j + n])
-                        ngrams[gram] += 1
-                sentence = []
-            
-            if show_progress and (i % update_freq == 0 or i == total_tokens - 1):
-                percent = (i + 1) / total_tokens
-                bar_length = 30
-                filled_length = int(bar_length * percent)
-                bar = "█" * filled_length + "░" * (bar_length - filled_length)
-                sys.stdout.write(f"\r  [{bar}] {percent:.0%} ({i+1:,}/{total_tokens:,})")
-                sys.stdout.flush()
-        
-        if show_progress:
-            print(f"\n  ✓ Generated {len(ngrams):,} unique {n}-grams")
-        
-        return dict(ngrams)
-    
-    def create_freq_table(self, ngrams: Dict[Tuple[str, ...], int], n: int = 3) -> Union[Dict, defaultdict]:
-        if n == 1:
-            return Counter({gram: count for gram, count in ngrams.items()})
-        
-        freq = defaultdict(Counter)
-        
-        for gram, count in ngrams.items():
-            if len(gram) == n:
-                prefix = gram[:-1]
-                next_word = gram[-1]
-                freq[prefix][next_word] = count
-        
-        return freq
+        return DEFAULT_TOKENIZER.tokenize(text, special_tokens)
     
     def train(self, training_data: Optional[List[str]] = None):
         if training_data:
             self.training_data = training_data
         
-        all_tokens = []
         total_samples = len(self.training_data)
         print(f"Processing {total_samples} training samples...")
-
+        self.train_stream(self.training_data, total_samples)
+    
+    def reset_counts(self):
+        self.unigrams = Counter()
+        self.bigrams = defaultdict(Counter)
+        self.trigrams = defaultdict(Counter)
+        self.storage = None
+        self.index = None
+        self.interpolator = None
+        self.completer = None
+        self.kn_tables = None
+        self.higher = None
+        self.higher_counts = {n: Counter() for n in range(4, self.order + 1)}
+    
+    def count_tokens(self, tokens: List[str]):
+        # one sentence, all three orders in a single pass
+        n_tokens = len(tokens)
+        for i in range(n_tokens):
+            word = tokens[i]
+            self.unigrams[(word,)] += 1
+            if i + 1 < n_tokens:
+                self.bigrams[(word,)][tokens[i + 1]] += 1
+            if i + 2 < n_tokens:
+                self.trigrams[(word, tokens[i + 1])][tokens[i + 2]] += 1
+        if self.higher_counts:
+            count_higher(tokens, self.order, self.higher_counts)
+    
+    def train_stream(self, texts: Iterable[str], total_samples: Optional[int] = None):
+        """Count n-grams sentence by sentence; memory grows with the model, not the corpus."""
+        self.train_tokens((self.tokenize(text) for text in texts), total_samples)
+    
+    def train_tokens(self, sentences: Iterable[List[str]], total_samples: Optional[int] = None):
+        self.reset_counts()
         bar_length = 40
 
-        for i, text in enumerate(self.training_data, start=1):
-            tokens = self.tokenize(text)
-            all_tokens.extend(tokens)
+        for i, tokens in enumerate(sentences, start=1):
+            if tokens:
+                self.count_tokens(tokens)
 
-            # Update progress bar
-            if i % 1000 == 0 or i == total_samples:
+            # Update progress
+            if total_samples and (i % 1000 == 0 or i == total_samples):
                 percent = i / total_samples
                 filled_length = int(bar_length * percent)
                 bar = "=" * filled_length + "-" * (bar_length - filled_length)
                 sys.stdout.write(f"\r[{bar}] {percent:.0%} ({i}/{total_samples})")
                 sys.stdout.flush()
+            elif not total_samples and i % 100000 == 0:
+                sys.stdout.write(f"\rProcessed {i:,} sentences")
+                sys.stdout.flush()
 
         print()
-
-        print("Building n-gram models...")
-        trigram_counts = self.generate_ngrams(all_tokens, 3)
-        bigram_counts = self.generate_ngrams(all_tokens, 2)
-        unigram_counts = self.generate_ngrams(all_tokens, 1)
-        
-        self.trigrams = self.create_freq_table(trigram_counts, 3)
-        self.bigrams = self.create_freq_table(bigram_counts, 2)
-        self.unigrams = self.create_freq_table(unigram_counts, 1)
-        
+        self.finish_training()
+    
+    def finish_training(self):
         self.vocab_size = len(self.unigrams)
         self.total_tokens = sum(self.unigrams.values())
         self.is_trained = True
+        self.kn_tables = None
+        if any(self.higher_counts.values()):
+            self.higher = HighOrderStore.build(self.higher_counts)
+        self.higher_counts = {}
+        self.build_index()
         
         print(f'N-gram model trained with vocabulary size: {self.vocab_size}')
         print(f'Total tokens: {self.total_tokens}')
+        if self.higher is not None:
+            print(f'Higher orders: {self.higher.stats()} ({self.higher.nbytes() / (1024 * 1024):.1f} MB)')
+
+    def update(self, texts: Iterable[str]) -> int:
+        """Add sentence counts to the live model without retraining.
 
-    def read_text_files(self, file_paths: List[str], encoding: str = 'utf-8') -> List[str]:
-        training_data = []
+        Changed rows are stacked on the tables as a new LayeredTable level
+        rather than written into them, so the update costs about the size
+        of the new text and a snapshot() taken before it never sees it.
+        Returns the number of tokens added.
+        """
+        if self.storage is not None:
+            raise ValueError("Compact and memory-mapped models are read-only")
+        if self.higher is not None:
+            raise ValueError(f"Order-{self.order} models are read-only; retrain to add text")
+        
+        delta = NgramModel()
+        delta.reset_counts()
+        for text in texts:
+            tokens = self.tokenize(text)
+            if tokens:
+                delta.count_tokens(tokens)
+        
+        def merged_rows(table, changes):
+            rows = {}
+            for prefix, successors in changes.items():
+                merged = Counter(table.get(prefix, ()))
+                merged.update(successors)
+                rows[prefix] = merged
+            return rows
+        
+        self.trigrams = LayeredTable.wrap(self.trigrams).updated(merged_rows(self.trigrams, delta.trigrams))
+        self.bigrams = LayeredTable.wrap(self.bigrams).updated(merged_rows(self.bigrams, delta.bigrams))
+        self.unigrams = LayeredTable.wrap(self.unigrams).updated(
+            {gram: self.unigrams.get(gram, 0) + count for gram, count in delta.unigrams.items()})
+        
+        added = sum(delta.unigrams.values())
+        self.vocab_size = len(self.unigrams)
+        self.total_tokens += added
+        self.is_trained = self.is_trained or added > 0
+        
+        # continuation counts and discounts depend on the whole table; rebuilt on next use
+        self.kn_tables = None
+        self.scorers = {}
+        if self.index is not None:
+            self.index.refresh(self.trigrams, delta.trigrams, self.bigrams, delta.bigrams, self.unigrams,
+                               delta.unigrams)
+            self.interpolator = InterpolationEngine(self.trigrams, self.bigrams, self.unigrams, self.index)
+            self.completer = None
+        elif self.is_trained:
+            self.build_index()
+        return added
+    
+    def snapshot(self) -> 'NgramModel':
+        """Copy that shares all tables with this model; update() replaces rather than mutates them."""
+        if self.storage is not None:
+            raise ValueError("Compact and memory-mapped models are read-only")
+        
+        clone = copy.copy(self)
+        if self.index is not None:
+            clone.index = self.index.copy()
+            clone.interpolator = InterpolationEngine(clone.trigrams, clone.bigrams, clone.unigrams, clone.index)
+            clone.completer = None
+        clone.scorers = {}
+        clone.scorer_lock = threading.Lock()
+        return clone
+    
+    def updated(self, texts: Iterable[str]) -> 'NgramModel':
+        # readers keep using self until the caller swaps in the returned model
+        clone = self.snapshot()
+        clone.update(texts)
+        return clone
+    
+    def iter_file_tokens(self, file_paths: List[str], encoding: str = 'utf-8',
+                         block_lines: int = 8192) -> Iterator[List[str]]:
+        # tokenizes blocks of lines at once; same sentences as iter_text_files
         total_files = len(file_paths)
         
-        print(f"Reading {total_files} files...")
-        
         for i, file_path in enumerate(file_paths, 1):
+            file_name = os.path.basename(file_path)
+            print(f"Reading [{i}/{total_files}]: {file_name}")
             try:
-                # Show file progress
-                percent = i / total_files
-                bar_length = 30
-                filled_length = int(bar_length * percent)
-                bar = "█" * filled_length + "░" * (bar_length - filled_length)
-                
-                file_name = os.path.basename(file_path)
-                sys.stdout.write(f"\r[{bar}] {percent:.0%} Reading: {file_name:<30}")
-                sys.stdout.flush()
-                
                 with open(file_path, 'r', encoding=encoding, errors='ignore') as f:
-                    content = f.read()
-                    
-                    # Split into sentences
-                    sentences = [line.strip() for line in content.split('\n') if line.strip()]
-                    training_data.extend(sentences)
-                    
+                    while True:
+                        block = ''.join(islice(f, block_lines))
+                        if not block:
+                            break
+                        yield from DEFAULT_TOKENIZER.tokenize_many(block)
             except Exception as e:
                 print(f"\nError reading {file_path}: {e}")
                 continue
+
+    def iter_text_files(self, file_paths: List[str], encoding: str = 'utf-8') -> Iterator[str]:
+        total_files = len(file_paths)
         
-        print(f"\n✓ Loaded {len(training_data):,} sentences from {total_files} files")
-        return training_data
+        for i, file_path in enumerate(file_paths, 1):
+            file_name = os.path.basename(file_path)
+            print(f"Reading [{i}/{total_files}]: {file_name}")
+            try:
+                with open(file_path, 'r', encoding=encoding, errors='ignore') as f:
+                    for line in f:
+                        line = line.strip()
+                        if line:
+                            yield line
+            except Exception as e:
+                print(f"\nError reading {file_path}: {e}")
+                continue
 
-    def train_from_files(self, file_paths: List[str], encoding: str = 'utf-8'):
-        training_data = self.read_text_files(file_paths, encoding)
+    def train_from_files(self, file_paths: List[str], encoding: str = 'utf-8', workers: int = 1):
+        if workers > 1:
+            self.train_parallel(file_paths, workers, encoding)
+            return
         
-        if not training_data:
+        sentences = self.iter_file_tokens(file_paths, encoding)
+        first = next(sentences, None)
+        
+        if first is None:
             print("No training data found in files!")
             return
         
-        print(f"Loaded {len(training_data)} sentences from {len(file_paths)} files")
+        self.train_tokens(chain([first], sentences))
+    
+    def train_parallel(self, file_paths: List[str], workers: int, encoding: str = 'utf-8') -> Dict:
+        (trigrams, bigrams, unigrams, higher), stats = count_files_parallel(file_paths, workers, encoding,
+                                                                             self.order)
         
-        self.train(training_data)
+        if not unigrams:
+            print("No training data found in files!")
+            return stats
+        
+        self.reset_counts()
+        self.higher_counts = higher
+        self.trigrams = defaultdict(Counter, trigrams)
+        self.bigrams = defaultdict(Counter, bigrams)
+        self.unigrams = unigrams
+        self.finish_training()
+        return stats
+    
+    @classmethod
+    def from_storage(cls, storage: CompactNgramStore, vocab_size: int, total_tokens: int) -> 'NgramModel':
+        model = cls()
+        model.storage = storage
+        model.trigrams = storage.trigrams
+        model.bigrams = storage.bigrams
+        model.unigrams = storage.unigrams
+        model.vocab_size = vocab_size
+        model.total_tokens = total_tokens
+        model.is_trained = True
+        model.build_index()
+        return model
+    
+    def compact(self):
+        # swap the dict tables for integer-id CSR arrays; the model becomes read-only
+        if self.storage is None:
+            self.storage = CompactNgramStore.from_tables(self.trigrams, self.bigrams, self.unigrams)
+            self.trigrams = self.storage.trigrams
+            self.bigrams = self.storage.bigrams
+            self.unigrams = self.storage.unigrams
+        self.build_index()
+        return self
+    
+    def memory_bytes(self, sample_size: int = 1000) -> int:
+        """Approximate resident size of the count tables and everything built from them.
+
+        Compact and mapped models report their array sizes exactly; dict
+        models and the derived structures (successor index, completion
+        index, Kneser-Ney tables, whichever exist yet) are sized from a
+        sample of rows, which is close enough for budgeting and far cheaper
+        than walking every Counter.
+        """
+        derived = self.higher.nbytes() if self.higher is not None else 0
+        if self.index is not None:
+            derived += self.index.nbytes(sample_size)
+        if self.completer is not None:
+            derived += self.completer.nbytes(sample_size)
+        if self.kn_tables is not None:
+            derived += self.kn_tables.nbytes(sample_size)
+        if self.storage is not None:
+            return self.storage.nbytes() + derived
+
+        # word strings are shared by every table, so they are counted once, with the unigrams
+        def row_bytes(row) -> int:
+            return sys.getsizeof(row[0]) + sys.getsizeof(row[1])
+
+        def unigram_bytes(row) -> int:
+            return sys.getsizeof(row[0]) + sys.getsizeof(row[0][0])
+
+        return sampled_bytes(self.trigrams, row_bytes, sample_size) + \
+            sampled_bytes(self.bigrams, row_bytes, sample_size) + \
+            sampled_bytes(self.unigrams, unigram_bytes, sample_size) + derived
+    
+    def ngram_counts(self) -> Dict[int, int]:
+        """Distinct n-grams per order"""
+        if self.storage is not None:
+            counts = {1: self.storage.unigram_types,
+                      2: len(self.storage.bigram_table.successors),
+                      3: len(self.storage.trigram_table.successors)}
+        else:
+            counts = {1: len(self.unigrams),
+                      2: sum(len(successors) for successors in self.bigrams.values()),
+                      3: sum(len(successors) for successors in self.trigrams.values())}
+        if self.higher is not None:
+            counts.update((n, len(table.successors)) for n, table in self.higher.tables.items())
+        return counts
     
     def get_vocabulary_size(self) -> int:
         return self.vocab_size
     
+    def build_index(self, top_n: int = DEFAULT_TOP_N):
+        self.completer = None
+        self.scorers = {}
+        if self.storage is not None:
+            self.index = self.storage.build_index(top_n)
+        else:
+            self.index = SuccessorIndex(top_n).build(self.trigrams, self.bigrams, self.unigrams)
+        self.interpolator = InterpolationEngine(self.trigrams, self.bigrams, self.unigrams, self.index)
+    
     def predict_next(self, context: str, top_k: int = 5) -> List[str]:
         if not self.is_trained:
             return []
         
         tokens = self.tokenize(context, False)
+        rec = recorder()
+        if rec:
+            rec.mark('tokenize')
         if len(tokens) < 2:
             return []
         
-        w1 = tokens[-2]
-        w2 = tokens[-1]
-        bigram_key = (w1, w2)
-        
+        probabilities = self.rank_context(tokens, top_k)
+
+        logger.debug("Top predictions: %s", probabilities[:top_k])
+
+        return [c['word'] for c in probabilities[:top_k]]
+    
+    def rank_next(self, w1: str, w2: str, top_k: int) -> List[Dict]:
+        if self.index is not None and self.index.supports(top_k):
+            return self.index.predict(w1, w2, top_k, self.vocab_size)
+        return self.score_candidates(w1, w2, top_k)[:top_k]
+    
+    def rank_context(self, tokens: List[str], top_k: int) -> List[Dict]:
+        """Backoff ranking over every order the model has, from the longest context down"""
+        if self.higher is None:
+            return self.rank_next(tokens[-2], tokens[-1], top_k)
+        higher = self.higher.contexts(tokens[-(self.order - 1):])
+        if self.index is not None and self.index.supports(top_k):
+            return self.index.predict(tokens[-2], tokens[-1], top_k, self.vocab_size, higher)
+        return self.score_candidates(tokens[-2], tokens[-1], top_k, higher)[:top_k]
+    
+    def predict_batch(self, texts: List[str], top_k: int = 5, method: str = 'backoff',
+                      mode: str = 'fast') -> List[List[str]]:
+        """Predict for many contexts; contexts ending in the same words are scored once.
+
+        Only the last words of each text are tokenized, and backoff ranks
+        the whole batch in one ``SuccessorIndex.predict_many`` pass.
+        """
+        if method not in ('backoff', 'interpolation') + SCORING_METHODS:
+            raise ValueError(f"Batch prediction supports 'backoff', 'interpolation', "
+                             f"{', '.join(repr(m) for m in SCORING_METHODS)}, not '{method}'")
+        
+        results: List[List[str]] = [[] for _ in texts]
+        if not self.is_trained:
+            return results
+        
+        # backoff looks at order - 1 words of context, the other methods at two
+        context_length = self.order - 1 if method == 'backoff' else 2
+        groups: Dict[Tuple[str, ...], List[int]] = defaultdict(list)
+        for i, tokens in enumerate(DEFAULT_TOKENIZER.tails(texts, context_length)):
+            if len(tokens) >= 2:
+                groups[tuple(tokens)].append(i)
+        rec = recorder()
+        if rec:
+            rec.mark('tokenize')
+        
+        if method == 'backoff' and self.higher is None and self.index is not None \
+                and self.index.supports(top_k):
+            contexts = list(groups)
+            ranked = self.index.predict_many(contexts, top_k)
+            for context, words in zip(contexts, ranked):
+                positions = groups[context]
+                results[positions[0]] = words
+                for i in positions[1:]:
+                    results[i] = list(words)
+            return results
+        
+        for context, positions in groups.items():
+            w1, w2 = context[-2], context[-1]
+            if method == 'interpolation' and self.interpolator is not None:
+                ranked = self.interpolator.predict(w1, w2, top_k, mode)
+                words = [p['word'] for p in ranked]
+            elif method == 'interpolation':
+                words = self.predict_with_interpolation(texts[positions[0]], top_k)
+            elif method in SCORING_METHODS:
+                words = [c['word'] for c in self.scorer(method).predict(w1, w2, top_k)]
+            else:
+                words = [c['word'] for c in self.rank_context(list(context), top_k)]
+            for i in positions:
+                results[i] = list(words)
+        
+        return results
+    
+    def score_candidates(self, w1: str, w2: str, top_k: int,
+                         higher: Sequence[Tuple[int, PrefixEntry]] = ()) -> List[Dict]:
+        # full scan over the tables, used when no index covers top_k;
+        # higher: (order, entry) of 4-gram and longer contexts, highest order first
+        rec = recorder()
         probabilities = []
-        
-        # try trigram first
-        if bigram_key in self.trigrams:
-            next_words = self.trigrams[bigram_key]
-            total = sum(next_words.values())
-            
-            for word, count in next_words.items():
-                if word != '</s>':
+        seen = set()
+        
+        def add_stage(successors, total: int, source: str):
+            # sorted within the stage only: a longer context always ranks first
+            stage = []
+            for word, count in successors:
+                if word not in SPECIAL_TOKENS and word not in seen:
+                    seen.add(word)
                     prob = math.log((count + 1) / (total + self.vocab_size))
-                    probabilities.append({'word': word, 'prob': prob, 'source': 'trigram'})
+                    stage.append({'word': word, 'prob': prob, 'source': source})
+            stage.sort(key=lambda x: x['prob'], reverse=True)
+            probabilities.extend(stage)
+        
+        # longest contexts first
+        for order, entry in higher:
+            if len(probabilities) >= top_k:
+                break
+            add_stage(entry.top, entry.total, f'{order}-gram')
+        if rec and higher:
+            rec.mark('higher')
+        
+        # then trigram
+        bigram_key = (w1, w2)
+        if len(probabilities) < top_k and bigram_key in self.trigrams:
+            next_words = self.trigrams[bigram_key]
+            add_stage(next_words.items(), sum(next_words.values()), 'trigram')
+        if rec:
+            rec.mark('trigram')
         
         # then try bigram
         unigram_w2 = (w2,)
         if len(probabilities) < top_k and unigram_w2 in self.bigrams:
             next_words = self.bigrams[unigram_w2]
-            total = sum(next_words.values())
-            
-            for word, count in next_words.items():
-                if word != '</s>' and not any(c['word'] == word for c in probabilities):
-                    prob = math.log((count + 1) / (total + self.vocab_size))
-                    probabilities.append({'word': word, 'prob': prob, 'source': 'bigram'})
+            add_stage(next_words.items(), sum(next_words.values()), 'bigram')
+        if rec:
+            rec.mark('bigram')
         
         # finally backoff to unigram
         if len(probabilities) < top_k:
-            total = sum(self.unigrams.values())
-            for gram, count in self.unigrams.items():
-                word = gram[0] if isinstance(gram, tuple) else gram
-                if (word != '<s>' and word != '</s>' and 
-                    not any(c['word'] == word for c in probabilities)):
-                    prob = math.log((count + 1) / (total + self.vocab_size))
-                    probabilities.append({'word': word, 'prob': prob, 'source': 'unigram'})
+            add_stage(((gram[0] if isinstance(gram, tuple) else gram, count)
+                       for gram, count in self.unigrams.items()), sum(self.unigrams.values()), 'unigram')
+        if rec:
+            rec.mark('unigram')
+        return probabilities
+    
+    def context_key(self, text: str, method: str = 'backoff') -> Tuple:
+        """The normalized part of the input a prediction depends on, for caching"""
+        tokens = self.tokenize(text, False)
+        if method == 'completion':
+            mid_word = bool(text) and (text[-1].isalnum() or text[-1] == "'")
+            return (mid_word,) + tuple(tokens[-max(3, self.order - 1):])
+        if method == 'interpolation' or method in SCORING_METHODS:
+            return tuple(tokens[-2:])
+        # backoff, and the fallback for unknown methods, use every order
+        return tuple(tokens[-(self.order - 1):])
+    
+    def complete(self, text: str, top_k: int = 5) -> List[str]:
+        """Complete the word being typed, or predict the next one after a space"""
+        if not self.is_trained or not text.strip():
+            return []
         
-        probabilities.sort(key=lambda x: x['prob'], reverse=True)
-
-        print(f"Top predictions: ${probabilities[:top_k]}")
-
-        return [c['word'] for c in probabilities[:top_k]]
+        if not text[-1].isalnum() and text[-1] != "'":
+            return self.predict_next(text, top_k)
+        
+        tokens = self.tokenize(text, False)
+        rec = recorder()
+        if rec:
+            rec.mark('tokenize')
+        if not tokens:
+            return []
+        
+        # sentence-start padding lets "i li" use the ('<s>', 'i') trigram
+        context = ['<s>', '<s>'] + tokens[:-1]
+        completions = self.completion_index().complete(context[-2], context[-1], tokens[-1], top_k)
+        if rec:
+            rec.mark('complete')
+        
+        return [word for word, _ in completions]
     
     def interpolate(self, w1: str, w2: str, w3: str, weights: List[float] = [0.1, 0.3, 0.6]) -> float:
         # P(w₃ | w₁, w₂) = λ₁ × P(w₃) + λ₂ × P(w₃ | w₂) + λ₃ × P(w₃ | w₁, w₂)
         
         # Unigram probability
         w3_tuple = (w3,)
-        total_unigrams = sum(self.unigrams.values())
+        if self.index is not None:
+            total_unigrams = self.index.unigram_total
+        else:
+            total_unigrams = sum(self.unigrams.values())
         prob1 = self.unigrams.get(w3_tuple, 0) / total_unigrams if total_unigrams > 0 else 0
         
         # Bigram probability
@@ -311,13 +611,16 @@ class NgramModel:
         
         return (prob1 * weights[0]) + (prob2 * weights[1]) + (prob3 * weights[2])
     
-    def predict_with_interpolation(self, text: str, top_k: int = 5) -> List[str]:
+    def predict_with_interpolation(self, text: str, top_k: int = 5, mode: str = 'fast') -> List[str]:
         """Predict next words using linear interpolation"""
         if not self.is_trained:
             return []
         
         tokens = self.tokenize(text, False)
-        print('Tokens:', tokens)
+        rec = recorder()
+        if rec:
+            rec.mark('tokenize')
+        logger.debug('Tokens: %s', tokens)
         
         if len(tokens) < 2:
             return []
@@ -325,7 +628,12 @@ class NgramModel:
         w1 = tokens[-2]
         w2 = tokens[-1]
         
-        print('Context words:', w1, w2)
+        logger.debug('Context words: %s %s', w1, w2)
+        
+        if self.interpolator is not None:
+            probabilities = self.interpolator.predict(w1, w2, top_k, mode)
+            logger.debug('Top predictions: %s', probabilities[:top_k])
+            return [p['word'] for p in probabilities[:top_k]]
         
         vocabulary = set()
         for gram in self.unigrams:
@@ -333,7 +641,7 @@ class NgramModel:
             if word not in ['<s>', '</s>']:
                 vocabulary.add(word)
         
-        print('Vocabulary size:', len(vocabulary))
+        logger.debug('Vocabulary size: %d', len(vocabulary))
         
         probabilities = []
         
@@ -341,102 +649,143 @@ class NgramModel:
             prob = self.interpolate(w1, w2, token)
             if prob > 0:
                 probabilities.append({'word': token, 'prob': prob})
+        if rec:
+            rec.mark('score')
         
         probabilities.sort(key=lambda x: x['prob'], reverse=True)
+        if rec:
+            rec.mark('sort')
         
-        print('Top predictions:', probabilities[:top_k])
+        logger.debug('Top predictions: %s', probabilities[:top_k])
         
         return [p['word'] for p in probabilities[:top_k]]
     
-    def save_model(self, filepath: str):
+    def kneser_ney_tables(self) -> KneserNeyTables:
+        if self.kn_tables is None:
+            self.kn_tables = KneserNeyTables.build(self.trigrams)
+        return self.kn_tables
+    
+    def has_scorer(self, method: str) -> bool:
+        return method in self.scorers
+    
+    def scorer(self, method: str):
+        """The scoring engine for ``method``, built on first use"""
+        engine = self.scorers.get(method)
+        if engine is None:
+            with self.scorer_lock:
+                engine = self.scorers.get(method)
+                if engine is None:
+                    if method == 'stupid_backoff':
+                        engine = StupidBackoffEngine(self.index, self.unigrams)
+                    elif method == 'kneser_ney':
+                        engine = KneserNeyEngine(self.index, self.kneser_ney_tables())
+                    else:
+                        raise ValueError(f"Unknown scoring method: {method}")
+                    self.scorers[method] = engine
+        return engine
+    
+    def completion_index(self) -> CompletionIndex:
+        """The prefix index used by complete(); the server builds it at load, so requests find it ready"""
+        completer = self.completer
+        if completer is None:
+            with self.scorer_lock:
+                completer = self.completer
+                if completer is None:
+                    completer = self.completer = CompletionIndex(self.index)
+        return completer
+    
+    def predict_scored(self, text: str, top_k: int = 5, method: str = 'kneser_ney') -> List[str]:
+        """Predict next words with one of the SCORING_METHODS engines"""
+        if not self.is_trained:
+            return []
+        
+        tokens = self.tokenize(text, False)
+        rec = recorder()
+        if rec:
+            rec.mark('tokenize')
+        if len(tokens) < 2:
+            return []
+        
+        probabilities = self.scorer(method).predict(tokens[-2], tokens[-1], top_k)
+        logger.debug('Top predictions: %s', probabilities)
+        
+        return [p['word'] for p in probabilities]
+    
+    def to_dict(self, scoring: bool = False) -> Dict:
+        """What save_model pickles; the tables are shared with the model, not copied"""
+        if self.storage is not None:
+            model_data = self.storage.to_dict()
+        else:
+            model_data = {
+                'trigrams': dict(self.trigrams),
+                'bigrams': dict(self.bigrams), 
+                'unigrams': dict(self.unigrams),
+            }
+        model_data['vocab_size'] = self.vocab_size
+        model_data['total_tokens'] = self.total_tokens
+        model_data['order'] = self.order
+        if self.higher is not None:
+            model_data['higher_orders'] = self.higher.to_dict()
+        if scoring:
+            # precomputed here so loading a model never pays for it
+            model_data['scoring'] = self.kneser_ney_tables().to_dict()
+        return model_data
+    
+    def save_model(self, filepath: str, binary: bool = False, scoring: bool = False):
+        """Write the model under trained_models/; ``scoring`` also stores its Kneser-Ney tables.
+
+        Without them a server builds the tables on the first Kneser-Ney
+        request, which costs about a pass over the trigram table.
+        """
         save_dir = 'trained_models'
         os.makedirs(save_dir, exist_ok=True)
         full_path = os.path.join(save_dir, filepath)
 
-        model_data = {
-            'trigrams': dict(self.trigrams),
-            'bigrams': dict(self.bigrams), 
-            'unigrams': dict(self.unigrams),
-            'vocab_size': self.vocab_size,
-            'total_tokens': self.total_tokens
-        }
-        
+        if binary:
+            storage = self.storage or CompactNgramStore.from_tables(self.trigrams, self.bigrams, self.unigrams)
+            write_binary(storage, full_path, self.vocab_size, self.total_tokens)
+            # describes what the file holds: the orders above 3 are left out of it
+            written = {n: count for n, count in self.ngram_counts().items() if n <= 3}
+            write_metadata(full_path, self.vocab_size, self.total_tokens, 3, written)
+            file_size = os.path.getsize(full_path) / (1024 * 1024)  # MB
+            print(f"Model saved to {full_path} ({file_size:.2f} MB)")
+            if self.higher is not None:
+                print(f"Note: the binary format holds orders up to 3; the order-{self.order} tables were not written")
+            return
+
         with open(full_path, 'wb') as f:
-            pickle.dump(model_data, f)
+            pickle.dump(self.to_dict(scoring), f)
+        write_metadata(full_path, self.vocab_size, self.total_tokens, self.order, self.ngram_counts())
         
         file_size = os.path.getsize(full_path) / (1024 * 1024)  # MB
         print(f"Model saved to {full_path} ({file_size:.2f} MB)")
     
     @classmethod
-    def load_model(cls, filepath: str) -> 'NgramModel':
+    def load_model(cls, filepath: str, compact: bool = False) -> 'NgramModel':
         load_dir = 'trained_models'
         full_path = os.path.join(load_dir, filepath)
 
         if not os.path.exists(full_path):
-            print(f"Model file {full_path} not found")
+            logger.warning("Model file %s not found", full_path)
             return None
         
+        if full_path.endswith(BINARY_EXTENSION):
+            storage = MappedNgramStore(full_path)
+            return cls.from_storage(storage, storage.vocab_size, storage.total_tokens)
+        
         with open(full_path, 'rb') as f:
             model_data = pickle.load(f)
         
-        return cls(model_data)
+        model = cls(model_data)
+        if compact:
+            del model_data
+            model.compact()
+        return model
     
     @classmethod
     def get_available_models(cls, models_dir: str = 'trained_models') -> Dict:
-        available_models = {}
-        
-        if not os.path.exists(models_dir):
-            os.makedirs(models_dir, exist_ok=True)
-            return {
-                "models": {},
-                "total_models": 0,
-                "message": "No models directory found"
-            }
-        
-        try:
-            model_files = [f for f in os.listdir(models_dir) if f.endswith('.pkl')]
-            
-            for model_file in model_files:
-                model_path = os.path.join(models_dir, model_file)
-                model_name = model_file.replace('.pkl', '')
-                
-                # Get basic file info
-                file_stats = os.stat(model_path)
-                file_size_mb = file_stats.st_size / (1024 * 1024)
-                
-                try:
-                    with open(model_path, 'rb') as f:
-                        model_data = pickle.load(f)
-                    
-                    available_models[model_name] = {
-                        "filename": model_file,
-                        "path": model_path,
-                        "size_mb": round(file_size_mb, 2),
-                        "vocab_size": model_data.get('vocab_size', 'Unknown'),
-                        "total_tokens": model_data.get('total_tokens', 'Unknown'),
-                        "last_modified": file_stats.st_mtime,
-                        "status": "valid"
-                    }
-                    
-                except Exception as e:
-                    available_models[model_name] = {
-                        "filename": model_file,
-                        "path": model_path,
-                        "size_mb": round(file_size_mb, 2),
-                        "vocab_size": "Error loading",
-                        "total_tokens": "Error loading",
-                        "last_modified": file_stats.st_mtime,
-                        "status": "corrupted",
-                        "error": str(e)
-                    }
-            
-            return {
-                "models": available_models,
-                "total_models": len(available_models)
-            }
-            
-        except Exception as e:
-            raise Exception(f"Failed to scan models directory: {str(e)}")
+        # sidecar metadata, so listing never unpickles the models
+        return catalog_for(models_dir).available_models()
 
 
 # Example usage and testing
@@ -0,0 +1,562 @@
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from collections import Counter, OrderedDict, defaultdict
+from collections.abc import Mapping, Sequence
+from itertools import chain, islice
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from core.index import SuccessorIndex, PrefixEntry, SPECIAL_TOKENS, sampled_bytes, list_bytes
+from core.interpolation import InterpolationEngine
+from core.metrics import recorder
+from core.mixture import ComposedModel, SuccessorTables
+from core.tokenizer import DEFAULT_TOKENIZER
+
+try:
+    import fcntl
+except ImportError:  # windows: writes stay atomic, but learns in different workers are not serialised
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+OVERLAY_VERSION = 1
+# an overlay count weighs this many base counts: a user's own phrasing should win
+DEFAULT_OVERLAY_WEIGHT = 5.0
+DEFAULT_MAX_NGRAMS = 100000
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+# rough resident cost of one learned n-gram: dict slot, key tuple, count
+BYTES_PER_NGRAM = 160
+
+OVERLAY_KEY = re.compile(r'(user|site):[^\s/\\]{1,200}')
+
+
+def validate_key(key: str) -> str:
+    if not isinstance(key, str) or not OVERLAY_KEY.fullmatch(key):
+        raise ValueError("Overlay keys look like 'user:<id>' or 'site:<host>' (no whitespace, at most 200 characters)")
+    return key
+
+
+class OverlayCounts:
+    """Sparse n-gram counts learned from one user's or one site's text.
+
+    Same layout as NgramModel's tables (``unigrams`` keyed by 1-tuples,
+    ``bigrams``/``trigrams`` by prefix tuple), but holding only what was
+    learned, so its size follows the text and not the base model. An
+    instance is never changed once models read it: ``learned`` returns a
+    new revision.
+    """
+
+    def __init__(self):
+        self.unigrams: Counter = Counter()
+        self.bigrams: Dict[Tuple[str, ...], Counter] = defaultdict(Counter)
+        self.trigrams: Dict[Tuple[str, ...], Counter] = defaultdict(Counter)
+        self.total_tokens = 0
+        self.revision = 0
+
+    @property
+    def ngrams(self) -> int:
+        return len(self.unigrams) + sum(len(successors) for successors in self.bigrams.values()) + \
+            sum(len(successors) for successors in self.trigrams.values())
+
+    def nbytes(self) -> int:
+        return self.ngrams * BYTES_PER_NGRAM
+
+    def copy(self) -> 'OverlayCounts':
+        clone = OverlayCounts()
+        clone.unigrams = Counter(self.unigrams)
+        clone.bigrams = defaultdict(Counter, {prefix: Counter(c) for prefix, c in self.bigrams.items()})
+        clone.trigrams = defaultdict(Counter, {prefix: Counter(c) for prefix, c in self.trigrams.items()})
+        clone.total_tokens = self.total_tokens
+        clone.revision = self.revision
+        return clone
+
+    def learned(self, texts: Iterable[str], max_ngrams: int = DEFAULT_MAX_NGRAMS) -> 'OverlayCounts':
+        """A new revision with ``texts`` counted in, pruned back to ``max_ngrams``"""
+        counts = self.copy()
+        for text in texts:
+            tokens = DEFAULT_TOKENIZER.tokenize(text)
+            if not tokens:
+                continue
+            # same windows as NgramModel.count_tokens
+            for token in tokens:
+                counts.unigrams[(token,)] += 1
+            for i in range(len(tokens) - 1):
+                counts.bigrams[(tokens[i],)][tokens[i + 1]] += 1
+            for i in range(len(tokens) - 2):
+                counts.trigrams[(tokens[i], tokens[i + 1])][tokens[i + 2]] += 1
+            counts.total_tokens += len(tokens)
+        counts.revision += 1
+        counts.prune(max_ngrams)
+        return counts
+
+    def prune(self, max_ngrams: int):
+        # the rarest trigrams go first, then bigrams, then unigrams; 10%
+        # headroom so the next few learns do not prune again
+        excess = self.ngrams - max_ngrams
+        if excess <= 0:
+            return
+        excess += max_ngrams // 10
+        for table in (self.trigrams, self.bigrams):
+            entries = sorted(((count, prefix, word) for prefix, successors in table.items()
+                              for word, count in successors.items()), key=lambda entry: entry[0])
+            for count, prefix, word in entries[:excess]:
+                del table[prefix][word]
+                if not table[prefix]:
+                    del table[prefix]
+            excess -= min(excess, len(entries))
+            if excess <= 0:
+                return
+        for gram, _ in sorted(self.unigrams.items(), key=lambda item: item[1])[:excess]:
+            del self.unigrams[gram]
+
+    def to_dict(self) -> Dict:
+        # words never contain whitespace, so a prefix joins into one JSON key
+        return {
+            'version': OVERLAY_VERSION,
+            'revision': self.revision,
+            'total_tokens': self.total_tokens,
+            'unigrams': {gram[0]: count for gram, count in self.unigrams.items()},
+            'bigrams': {' '.join(prefix): dict(c) for prefix, c in self.bigrams.items()},
+            'trigrams': {' '.join(prefix): dict(c) for prefix, c in self.trigrams.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'OverlayCounts':
+        if data.get('version') != OVERLAY_VERSION:
+            raise ValueError(f"Unsupported overlay version: {data.get('version')}")
+        counts = cls()
+        counts.revision = data['revision']
+        counts.total_tokens = data['total_tokens']
+        counts.unigrams = Counter({(word,): count for word, count in data['unigrams'].items()})
+        for table, name in ((counts.bigrams, 'bigrams'), (counts.trigrams, 'trigrams')):
+            for prefix, successors in data[name].items():
+                table[tuple(prefix.split(' '))] = Counter(successors)
+        return counts
+
+
+class CombinedCounts(Mapping):
+    """``base[key] + weight * overlay[key]`` per lookup, without copying ``base``."""
+
+    __slots__ = ('base', 'overlay', 'weight')
+
+    def __init__(self, base: Mapping, overlay: Mapping, weight: float):
+        self.base = base
+        self.overlay = overlay
+        self.weight = weight
+
+    def get(self, key, default=None):
+        count = self.base.get(key, 0) + self.weight * self.overlay.get(key, 0)
+        return count if count else default
+
+    def __getitem__(self, key):
+        count = self.get(key)
+        if count is None:
+            raise KeyError(key)
+        return count
+
+    def __contains__(self, key) -> bool:
+        return key in self.overlay or key in self.base
+
+    def __iter__(self):
+        yield from self.base
+        for key in self.overlay:
+            if key not in self.base:
+                yield key
+
+    def __len__(self) -> int:
+        return len(self.base) + sum(1 for key in self.overlay if key not in self.base)
+
+
+class OverlayEntries:
+    """A base index table with the overlay's successors added to the prefixes it has.
+
+    Prefixes the overlay never saw return the base entry itself; the others
+    get a merged entry whose top list is the base top list with the
+    overlay's words re-scored, built once per overlay revision.
+    """
+
+    def __init__(self, base, overlay: Dict[Tuple[str, ...], Counter], weight: float, top_n: int):
+        self.base = base
+        self.overlay = overlay
+        self.weight = weight
+        self.top_n = top_n
+        self.merged: Dict[Tuple[str, ...], PrefixEntry] = {}
+
+    def get(self, prefix, default=None):
+        successors = self.overlay.get(prefix)
+        if successors is None:
+            return self.base.get(prefix, default)
+        entry = self.merged.get(prefix)
+        if entry is None:
+            entry = self.merged[prefix] = self.merge(self.base.get(prefix), successors)
+        return entry
+
+    def __contains__(self, prefix) -> bool:
+        return prefix in self.overlay or prefix in self.base
+
+    def merge(self, base: Optional[PrefixEntry], successors: Counter) -> PrefixEntry:
+        base_successors = base.successors if base is not None else {}
+        boosted = [(word, base_successors.get(word, 0) + self.weight * count)
+                   for word, count in successors.items() if word != '</s>']
+        # a base word outside the top list cannot outrank the ones in it, so
+        # the merged top list only needs the head of the base list
+        kept = []
+        if base is not None:
+            kept = [(word, count) for word, count in islice(base.top, self.top_n + len(successors))
+                    if word not in successors]
+        top = heapq.nlargest(self.top_n, chain(kept, boosted), key=lambda item: item[1])
+        total = (base.total if base is not None else 0) + self.weight * sum(successors.values())
+        size = (base.size if base is not None else 0) + \
+            sum(1 for word, _ in boosted if word not in base_successors)
+        return PrefixEntry(total, size, top, CombinedCounts(base_successors, successors, self.weight))
+
+    def nbytes(self, sample_size: int = 1000) -> int:
+        def entry_bytes(row) -> int:
+            # the prefix key is the overlay's own; the top list is a new list,
+            # holding the base's tuples (or copies of them) and the re-scored ones
+            entry = row[1]
+            return sys.getsizeof(entry) + list_bytes(entry.top) + sys.getsizeof(entry.successors)
+
+        return sampled_bytes(self.merged, entry_bytes, sample_size)
+
+
+class OverlayUnigrams(Sequence):
+    """The base unigram ranking with the overlay's words re-scored, merged lazily.
+
+    Backoff only reads the head of the ranking, so entries are produced on
+    demand from the base list and the (small) sorted list of overlay words.
+    """
+
+    def __init__(self, base_ranked, base_unigrams, overlay: Counter, weight: float):
+        self.base_ranked = base_ranked
+        self.overlay = overlay
+        boosted = [(gram[0], base_unigrams.get(gram, 0) + weight * count)
+                   for gram, count in overlay.items() if gram[0] not in SPECIAL_TOKENS]
+        boosted.sort(key=lambda item: item[1], reverse=True)
+        self.boosted = boosted
+        self.new_words = sum(1 for gram in overlay if gram[0] not in SPECIAL_TOKENS and not base_unigrams.get(gram))
+        self.items: List[Tuple[str, float]] = []
+        self.base_pos = 0
+        self.boosted_pos = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.base_ranked) + self.new_words
+
+    def extend(self, length: int):
+        with self.lock:
+            base, boosted = self.base_ranked, self.boosted
+            while len(self.items) < length:
+                while self.base_pos < len(base) and (base[self.base_pos][0],) in self.overlay:
+                    self.base_pos += 1
+                next_base = base[self.base_pos] if self.base_pos < len(base) else None
+                next_boosted = boosted[self.boosted_pos] if self.boosted_pos < len(boosted) else None
+                if next_base is None and next_boosted is None:
+                    return
+                if next_boosted is None or (next_base is not None and next_base[1] >= next_boosted[1]):
+                    self.items.append(next_base)
+                    self.base_pos += 1
+                else:
+                    self.items.append(next_boosted)
+                    self.boosted_pos += 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i >= len(self.items):
+            self.extend(i + 1)
+        return self.items[i]
+
+    def __iter__(self):
+        i = 0
+        while True:
+            if i >= len(self.items):
+                self.extend(i + 1)
+                if i >= len(self.items):
+                    return
+            yield self.items[i]
+            i += 1
+
+
+class OverlayIndex(SuccessorIndex):
+    """SuccessorIndex of a base model with an overlay's counts added in."""
+
+    def __init__(self, base: SuccessorIndex, base_unigrams, counts: OverlayCounts, weight: float):
+        super().__init__(base.top_n)
+        self.trigrams = OverlayEntries(base.trigrams, counts.trigrams, weight, base.top_n)
+        self.bigrams = OverlayEntries(base.bigrams, counts.bigrams, weight, base.top_n)
+        self.unigram_total = base.unigram_total + weight * sum(counts.unigrams.values())
+        self.unigram_ranked = OverlayUnigrams(base.unigram_ranked, base_unigrams, counts.unigrams, weight)
+
+    def supports(self, top_k: int) -> bool:
+        return 2 * top_k <= self.top_n
+
+
+class OverlayModel(ComposedModel):
+    """A shared read-only base model as seen by one user or site.
+
+    Backoff and interpolation read the base tables through the overlay's
+    count deltas (``base + weight * overlay``); nothing of the base is
+    copied, so the model costs memory in proportion to the overlay. A base
+    with 4-grams and up keeps using them, the overlay only adds to the
+    trigram level and below.
+    """
+
+    kind = 'Overlay'
+
+    def __init__(self, base, counts: OverlayCounts, weight: float = DEFAULT_OVERLAY_WEIGHT):
+        if getattr(base, 'index', None) is None:
+            raise ValueError("Overlays need a base model with a successor index (not a quantized model)")
+        self.base = base
+        self.counts = counts
+        self.weight = weight
+        self.index = OverlayIndex(base.index, base.unigrams, counts, weight)
+        self.interpolator = InterpolationEngine(SuccessorTables(self.index.trigrams),
+                                                SuccessorTables(self.index.bigrams),
+                                                CombinedCounts(base.unigrams, counts.unigrams, weight), self.index)
+        self.vocab_size = base.vocab_size + self.index.unigram_ranked.new_words
+        self.total_tokens = base.total_tokens + counts.total_tokens
+        self.higher = getattr(base, 'higher', None)
+        self.order = base.order if self.higher is not None else 3
+
+    def context_key(self, text: str, method: str = 'backoff') -> Tuple:
+        tokens = self.tokenize(text, False)
+        if method == 'backoff':
+            return tuple(tokens[-(self.order - 1):])
+        return tuple(tokens[-2:])
+
+    def predict_next(self, context: str, top_k: int = 5) -> List[str]:
+        tokens = self.tokenize(context, False)
+        rec = recorder()
+        if rec:
+            rec.mark('tokenize')
+        if len(tokens) < 2:
+            return []
+        higher = self.higher.contexts(tokens[-(self.order - 1):]) if self.higher is not None else ()
+        return [c['word'] for c in self.index.predict(tokens[-2], tokens[-1], top_k, self.vocab_size, higher)]
+
+    def updated(self, texts) -> 'OverlayModel':
+        raise ValueError("Overlay models are read-only; learn text into the overlay instead")
+
+    def memory_bytes(self, sample_size: int = 1000) -> int:
+        # the base is accounted for as a model of its own; this is the overlay's
+        # counts, the entries merged so far and the merged head of the unigram ranking
+        unigrams = self.index.unigram_ranked
+        return self.counts.nbytes() + self.index.trigrams.nbytes(sample_size) + \
+            self.index.bigrams.nbytes(sample_size) + sys.getsizeof(unigrams.items) + list_bytes(unigrams.boosted)
+
+
+class OverlayStore:
+    """Overlays by key ("user:..." or "site:..."), persisted as JSON files.
+
+    Overlays in use stay in memory; when their estimated size passes
+    ``memory_budget`` the least recently used are dropped (they are saved
+    on every learn, so dropping loses nothing) and reloaded from disk on
+    their next use. Each resident overlay also keeps the OverlayModel built
+    for the current base model, so its merged entries are reused.
+
+    Several server workers can share the directory: every use stats the
+    overlay's file and reloads it when another worker replaced or deleted
+    it, and learns re-read the file under an exclusive lock before writing
+    it back, so no worker overwrites what another one learned.
+    """
+
+    def __init__(self, directory: str, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 max_ngrams: int = DEFAULT_MAX_NGRAMS):
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.max_ngrams = max_ngrams
+        # key -> [counts, model or None, version of the file counts was read from]
+        self.entries: "OrderedDict[str, List]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.learn_lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def path(self, key: str) -> str:
+        # keys come from clients; hashing keeps them out of the file system paths
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + '.json')
+
+    @staticmethod
+    def file_version(st: os.stat_result) -> Tuple[int, int, int]:
+        # every write replaces the file, so a new inode alone already means a new revision
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def version(self, key: str) -> Optional[Tuple[int, int, int]]:
+        try:
+            return self.file_version(os.stat(self.path(key)))
+        except FileNotFoundError:
+            return None
+
+    def peek(self, key: str, base, weight: float = DEFAULT_OVERLAY_WEIGHT) -> Tuple[bool, Optional[OverlayModel]]:
+        """(known, model) from one ``os.stat``, without reading files or building models; ``model`` does both when not known"""
+        version = self.version(key)
+        with self.lock:
+            if version is None:
+                self.entries.pop(key, None)
+                return True, None
+            entry = self.entries.get(key)
+            if entry is None or entry[2] != version or not self.current(entry[1], entry[0], base, weight):
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[1]
+
+    @staticmethod
+    def current(model: Optional[OverlayModel], counts: OverlayCounts, base, weight: float) -> bool:
+        return model is not None and model.base is base and model.counts is counts and model.weight == weight
+
+    def get(self, key: str) -> Optional[OverlayCounts]:
+        """The key's overlay, (re)loaded from disk if needed; None if nothing was learned for it"""
+        version = self.version(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if version is None:
+                self.entries.pop(key, None)
+                return None
+            if entry is not None and entry[2] == version:
+                self.entries.move_to_end(key)
+                return entry[0]
+        loaded = self.read(key)
+        with self.lock:
+            if loaded is None:
+                self.entries.pop(key, None)
+                return None
+            counts, version = loaded
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] == version:
+                return entry[0]  # loaded meanwhile by another caller
+            self.entries[key] = [counts, None, version]
+            self.entries.move_to_end(key)
+            self.loads += 1
+            self.evict()
+        return counts
+
+    def model(self, key: str, base, weight: float = DEFAULT_OVERLAY_WEIGHT) -> Optional[OverlayModel]:
+        counts = self.get(key)
+        if counts is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            model = entry[1] if entry is not None else None
+        if self.current(model, counts, base, weight):
+            return model
+        model = OverlayModel(base, counts, weight)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is counts:
+                entry[1] = model
+                # the replaced model's merged entries are measured, and freed, with it
+                self.evict()
+        return model
+
+    def release(self, base):
+        """Forget the models built on ``base``; the learned counts stay"""
+        with self.lock:
+            for entry in self.entries.values():
+                if entry[1] is not None and entry[1].base is base:
+                    entry[1] = None
+
+    @contextmanager
+    def locked(self):
+        """Serialises learns and deletes across threads and, through an flock, across workers"""
+        with self.learn_lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def learn(self, key: str, texts: List[str]) -> OverlayCounts:
+        # readers keep the revision they grabbed
+        with self.locked():
+            # always the file, not the resident copy: another worker may have learned since
+            loaded = self.read(key)
+            counts = (loaded[0] if loaded is not None else OverlayCounts()).learned(texts, self.max_ngrams)
+            version = self.write(key, counts)
+            with self.lock:
+                self.entries[key] = [counts, None, version]
+                self.entries.move_to_end(key)
+                self.evict()
+        return counts
+
+    def delete(self, key: str) -> bool:
+        with self.locked():
+            with self.lock:
+                resident = self.entries.pop(key, None) is not None
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                return resident
+            return True
+
+    @staticmethod
+    def entry_bytes(entry: List) -> int:
+        # the model, once built, holds the counts and what it merged from them
+        counts, model, _ = entry
+        return model.memory_bytes() if model is not None else counts.nbytes()
+
+    def evict(self):
+        # caller holds the lock; the most recent overlay always stays
+        resident = sum(map(self.entry_bytes, self.entries.values()))
+        while resident > self.memory_budget and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            resident -= self.entry_bytes(entry)
+            self.evictions += 1
+
+    def read(self, key: str) -> Optional[Tuple[OverlayCounts, Tuple[int, int, int]]]:
+        """(counts, file version), or None when the key has no file"""
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as f:
+                version = self.file_version(os.fstat(f.fileno()))
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        if data.get('key') != key:
+            logger.warning("Overlay file %s belongs to another key", self.path(key))
+            return None
+        return OverlayCounts.from_dict(data), version
+
+    def write(self, key: str, counts: OverlayCounts) -> Tuple[int, int, int]:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        data = counts.to_dict()
+        data['key'] = key
+        data['saved_at'] = time.time()
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+            f.flush()
+            version = self.file_version(os.fstat(f.fileno()))
+        os.replace(tmp_path, path)
+        return version
+
+    def stats(self) -> Dict:
+        with self.lock:
+            overlays = {}
+            for key, entry in self.entries.items():
+                counts = entry[0]
+                overlays[key] = {"revision": counts.revision, "ngrams": counts.ngrams,
+                                 "total_tokens": counts.total_tokens,
+                                 "size_kb": round(self.entry_bytes(entry) / 1024, 1)}
+            resident = sum(map(self.entry_bytes, self.entries.values()))
+            return {
+                "overlays": overlays,
+                "resident_mb": round(resident / (1024 * 1024), 2),
+                "memory_budget_mb": round(self.memory_budget / (1024 * 1024), 2),
+                "loads": self.loads,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,126 @@
+import io
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+# shards smaller than this cost more in process overhead than they save
+MIN_SHARD_BYTES = 1 << 20
+SHARDS_PER_WORKER = 4
+
+Shard = Tuple[str, int, int]  # (path, start byte, end byte)
+
+
+def plan_shards(file_paths: List[str], workers: int, encoding: str = 'utf-8') -> List[Shard]:
+    """Split files into byte ranges that start and end on line boundaries.
+
+    Only encodings where b'\\n' is always a newline can be split inside a
+    file; anything else is sharded one file at a time.
+    """
+    sizes = {path: os.path.getsize(path) for path in file_paths if os.path.exists(path)}
+    splittable = encoding.lower().replace('_', '-') in ('utf-8', 'utf8', 'ascii', 'latin-1', 'latin1')
+    target = max(MIN_SHARD_BYTES, sum(sizes.values()) // max(1, workers * SHARDS_PER_WORKER))
+
+    shards = []
+    for path in file_paths:
+        if path not in sizes:
+            # let the worker report the missing file like iter_text_files does
+            shards.append((path, 0, -1))
+            continue
+        size = sizes[path]
+        if not splittable or size <= target:
+            shards.append((path, 0, size))
+            continue
+        with open(path, 'rb') as f:
+            start = 0
+            while start < size:
+                f.seek(min(start + target, size))
+                f.readline()  # finish the current line
+                end = min(f.tell(), size)
+                shards.append((path, start, end))
+                start = end
+    return shards
+
+
+def count_shard(shard: Shard, encoding: str = 'utf-8', order: int = 3) -> Tuple[Dict, Dict, Counter, Dict]:
+    from core.ngrams import NgramModel
+    from core.tokenizer import DEFAULT_TOKENIZER
+
+    path, start, end = shard
+    model = NgramModel(order=order)
+    model.reset_counts()
+    try:
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start) if end >= 0 else f.read()
+        # same newline handling as reading the whole file in text mode
+        text = io.TextIOWrapper(io.BytesIO(data), encoding=encoding, errors='ignore').read()
+        for tokens in DEFAULT_TOKENIZER.tokenize_many(text):
+            model.count_tokens(tokens)
+    except Exception as e:
+        print(f"\nError reading {path}: {e}")
+
+    return dict(model.trigrams), dict(model.bigrams), model.unigrams, model.higher_counts
+
+
+def merge_tables(left: Dict, right: Dict) -> Dict:
+    # left keeps its order and right's new prefixes are appended, so merging
+    # shards in corpus order reproduces a serial count exactly
+    for prefix, successors in right.items():
+        if prefix in left:
+            left[prefix].update(successors)
+        else:
+            left[prefix] = successors
+    return left
+
+
+def merge_counts(left: Tuple, right: Tuple) -> Tuple:
+    trigrams, bigrams, unigrams, higher = left
+    merge_tables(trigrams, right[0])
+    merge_tables(bigrams, right[1])
+    unigrams.update(right[2])
+    for n, counts in right[3].items():
+        higher[n].update(counts)
+    return trigrams, bigrams, unigrams, higher
+
+
+def tree_reduce(parts: List[Tuple]) -> Tuple:
+    # pairwise merges of neighbours keep shard order at every level
+    while len(parts) > 1:
+        merged = [merge_counts(parts[i], parts[i + 1]) for i in range(0, len(parts) - 1, 2)]
+        if len(parts) % 2:
+            merged.append(parts[-1])
+        parts = merged
+    return parts[0]
+
+
+def count_files_parallel(file_paths: List[str], workers: int, encoding: str = 'utf-8',
+                         order: int = 3) -> Tuple[Tuple, Dict]:
+    """Count n-grams over sharded files in a process pool.
+
+    Returns the merged (trigrams, bigrams, unigrams, higher) tables, where
+    higher maps each order above 3 to its flat n-gram Counter, and run stats.
+    The tables are identical whatever the worker count.
+    """
+    start = time.perf_counter()
+    shards = plan_shards(file_paths, workers, encoding)
+    print(f"Counting {len(shards)} shards with {workers} workers...")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(count_shard, shards, [encoding] * len(shards), [order] * len(shards)))
+    counted = time.perf_counter()
+
+    tables = tree_reduce(parts) if parts else ({}, {}, Counter(), {n: Counter() for n in range(4, order + 1)})
+    elapsed = time.perf_counter() - start
+
+    total_tokens = sum(tables[2].values())
+    stats = {
+        "shards": len(shards),
+        "workers": workers,
+        "count_seconds": round(counted - start, 3),
+        "merge_seconds": round(elapsed - (counted - start), 3),
+        "tokens_per_second": round(total_tokens / elapsed) if elapsed > 0 else 0,
+    }
+    print(f"✓ Counted {total_tokens:,} tokens in {elapsed:.2f}s ({stats['tokens_per_second']:,} tokens/sec)")
+    return tables, stats
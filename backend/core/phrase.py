@@ -0,0 +1,104 @@
+import heapq
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from core.metrics import recorder
+
+PHRASE_METHODS = ('backoff', 'interpolation')
+DEFAULT_MAX_WORDS = 4
+MAX_PHRASE_WORDS = 8
+DEFAULT_BEAM_WIDTH = 4
+MAX_BEAM_WIDTH = 16
+# score = log p / words ** alpha: 0 ranks by plain probability (short phrases win), 1 by the per-word mean
+DEFAULT_LENGTH_PENALTY = 0.7
+DEFAULT_EXPANSION_ENTRIES = 20000
+
+
+class PhraseSearch:
+    """Multi-word continuations of a text by beam search over one model's next-word rankings.
+
+    A hypothesis grows by the ``beam_width`` best next words after its last
+    two words, adding their log probabilities; the ``beam_width`` best
+    hypotheses of each length are kept and every kept hypothesis is a
+    candidate phrase, ranked by length-normalized log probability.
+
+    Expansions (the ranked next words of a two-word context) are memoized in
+    an LRU shared by every search on this model, so beams that meet in the
+    same context and requests that continue the same text reuse them; a
+    search usually costs a handful of single-word rankings.
+    """
+
+    def __init__(self, model, max_entries: int = DEFAULT_EXPANSION_ENTRIES):
+        self.model = model
+        self.max_entries = max_entries
+        # (method, mode, w1, w2) -> (width asked for, ((word, log prob), ...))
+        self.expansions: "OrderedDict[Tuple, Tuple[int, Tuple[Tuple[str, float], ...]]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def expand(self, w1: str, w2: str, width: int, method: str, mode: str) -> Tuple[Tuple[str, float], ...]:
+        key = (method, mode, w1, w2)
+        with self.lock:
+            cached = self.expansions.get(key)
+            # a shorter list is complete too when it was cut short by the model, not by the width
+            if cached is not None and (cached[0] >= width or len(cached[1]) < cached[0]):
+                self.expansions.move_to_end(key)
+                self.hits += 1
+                return cached[1][:width]
+            self.misses += 1
+
+        if method == 'interpolation':
+            ranked = self.model.interpolator.predict(w1, w2, width, mode)
+            expansion = tuple((c['word'], math.log(c['prob'])) for c in ranked if c['prob'] > 0)
+        else:
+            # backoff rankings already carry log probabilities
+            expansion = tuple((c['word'], c['prob']) for c in self.model.rank_next(w1, w2, width))
+        if self.max_entries > 0:
+            with self.lock:
+                self.expansions[key] = (width, expansion)
+                self.expansions.move_to_end(key)
+                while len(self.expansions) > self.max_entries:
+                    self.expansions.popitem(last=False)
+        return expansion
+
+    def search(self, text: str, max_words: int = DEFAULT_MAX_WORDS, beam_width: int = DEFAULT_BEAM_WIDTH,
+               top_k: int = 3, method: str = 'backoff', mode: str = 'fast',
+               length_penalty: float = DEFAULT_LENGTH_PENALTY, min_words: int = 1) -> List[Dict]:
+        if method not in PHRASE_METHODS:
+            raise ValueError(f"Phrase search supports {', '.join(PHRASE_METHODS)}, not '{method}'")
+        if method == 'interpolation' and getattr(self.model, 'interpolator', None) is None:
+            raise ValueError("This model has no interpolation index for phrase search")
+        tokens = self.model.tokenize(text, False)
+        rec = recorder()
+        if rec:
+            rec.mark('tokenize')
+        if len(tokens) < 2:
+            return []
+
+        beams: List[Tuple[float, Tuple[str, ...]]] = [(0.0, ())]
+        candidates: List[Tuple[float, float, Tuple[str, ...]]] = []
+        for length in range(1, max_words + 1):
+            grown = []
+            for log_prob, words in beams:
+                history = (tokens[-2:] + list(words))[-2:]
+                for word, word_log_prob in self.expand(history[0], history[1], beam_width, method, mode):
+                    grown.append((log_prob + word_log_prob, words + (word,)))
+            if not grown:
+                break
+            beams = heapq.nlargest(beam_width, grown, key=lambda beam: beam[0])
+            if length >= min_words:
+                norm = length ** length_penalty
+                candidates.extend((log_prob / norm, log_prob, words) for log_prob, words in beams)
+        if rec:
+            rec.mark('search')
+
+        best = heapq.nlargest(top_k, candidates, key=lambda candidate: candidate[0])
+        return [{'phrase': ' '.join(words), 'words': list(words), 'score': score, 'log_prob': log_prob}
+                for score, log_prob, words in best]
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {"expansions": len(self.expansions), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+DEFAULT_INTERVAL = 0.005
+MAX_DEPTH = 64
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+class SamplingProfiler:
+    """Statistical profiler: a background thread snapshots every thread's stack.
+
+    Costs nothing while stopped; while running, overhead is roughly one
+    stack walk per thread per ``interval``. Stacks are kept in the collapsed
+    "outer;...;inner count" format that flame graph tools read.
+    """
+
+    def __init__(self):
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.interval = DEFAULT_INTERVAL
+        self.started_at: Optional[float] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval: float = DEFAULT_INTERVAL):
+        with self.lock:
+            if self.running:
+                return
+            self.stacks = Counter()
+            self.samples = 0
+            self.interval = interval
+            self.started_at = time.time()
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.sample_loop, name="sampling-profiler", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            thread = self.thread
+            self.stop_event.set()
+        if thread is not None:
+            thread.join()
+
+    def sample_loop(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                names = []
+                while frame is not None and len(names) < MAX_DEPTH:
+                    names.append(frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(names))] += 1
+            self.samples += 1
+
+    def report(self, limit: int = 30) -> Dict:
+        stacks = self.stacks.copy()
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in stacks.items():
+            names = stack.split(';')
+            self_counts[names[-1].rsplit(':', 1)[0]] += count
+            for name in {name.rsplit(':', 1)[0] for name in names}:
+                total_counts[name] += count
+
+        # threads parked in the executor or the event loop dominate otherwise
+        idle = ('threading.py:wait', 'thread.py:_worker', 'selectors.py:select', 'queue.py:get')
+        busy = {name: count for name, count in self_counts.items() if not name.endswith(idle)}
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "started_at": self.started_at,
+            "samples": self.samples,
+            "self": [{"function": name, "samples": count}
+                     for name, count in Counter(busy).most_common(limit)],
+            "cumulative": [{"function": name, "samples": count}
+                           for name, count in total_counts.most_common(limit)],
+            "collapsed": [f"{stack} {count}" for stack, count in stacks.most_common(limit * 10)],
+        }
+
+
+PROFILER = SamplingProfiler()
@@ -0,0 +1,305 @@
+import argparse
+import itertools
+import json
+import math
+import pickle
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from core.ngrams import NgramModel
+from core.highorder import MAX_ORDER
+
+# configurations tried by --sweep; each is a set of keyword arguments for prune_model
+SWEEP_CONFIGS = [
+    {"min_counts": {3: 2}},
+    {"min_counts": {3: 3, 2: 2}},
+    {"top_n": 50},
+    {"top_n": 20},
+    {"entropy_threshold": 1e-7},
+    {"entropy_threshold": 1e-6},
+    {"entropy_threshold": 1e-5},
+    {"min_counts": {3: 2}, "top_n": 50, "entropy_threshold": 1e-6},
+]
+DEFAULT_EVAL_POSITIONS = 50000
+PICKLE_CHUNK_ROWS = 5000
+
+
+def row_totals(table) -> Dict:
+    return {prefix: sum(successors.values()) for prefix, successors in table.items()}
+
+
+def entropy_prune(table, lower_table, lower_totals: Dict, threshold: float) -> Dict[tuple, Counter]:
+    """Stolcke-style relative entropy pruning of one order against the next lower one.
+
+    Dropping w after history h moves P(w|h) to the lower-order estimate,
+    which costs roughly P(h, w) * |log P(w|h) - log P_lower(w|h')| in
+    relative entropy; entries costing less than ``threshold`` are dropped.
+    The magnitude is used because these models have no Katz backoff
+    weights to renormalise with, so an estimate well below the lower
+    order's is as informative as one well above it.
+    """
+    order_total = sum(sum(successors.values()) for successors in table.values()) or 1
+    pruned = {}
+    for prefix, successors in table.items():
+        history_total = sum(successors.values())
+        lower_prefix = prefix[1:]
+        kept = Counter()
+        for word, count in successors.items():
+            if lower_prefix:
+                lower_count = lower_table.get(lower_prefix, {}).get(word, 0)
+                lower_total = lower_totals.get(lower_prefix, 0)
+            else:
+                lower_count = lower_table.get((word,), 0)
+                lower_total = lower_totals[()]
+            if not lower_count or not lower_total:
+                kept[word] = count  # nothing to back off to
+                continue
+            gain = (count / order_total) * abs(math.log(count / history_total) - math.log(lower_count / lower_total))
+            if gain >= threshold:
+                kept[word] = count
+        if kept:
+            pruned[prefix] = kept
+    return pruned
+
+
+def prune_table(table, min_count: int = 1, top_n: Optional[int] = None) -> Dict[tuple, Counter]:
+    pruned = {}
+    for prefix, successors in table.items():
+        kept = Counter({word: count for word, count in successors.items() if count >= min_count})
+        if top_n is not None and len(kept) > top_n:
+            kept = Counter(dict(kept.most_common(top_n)))
+        if kept:
+            pruned[prefix] = kept
+    return pruned
+
+
+def keep_trigram_prefixes(bigrams: Dict[tuple, Counter], trigrams: Dict[tuple, Counter], original) -> None:
+    # a kept trigram (w1, w2, w3) needs its (w1, w2) bigram, or the backoff
+    # and interpolation paths see a trigram context with no bigram mass
+    for w1, w2 in trigrams:
+        row = bigrams.get((w1,))
+        if row is not None and w2 in row:
+            continue
+        count = original.get((w1,), {}).get(w2, 0)
+        if count:
+            bigrams.setdefault((w1,), Counter())[w2] = count
+
+
+def prune_model(model: NgramModel, min_counts: Optional[Dict[int, int]] = None,
+                top_n: Optional[int] = None, entropy_threshold: Optional[float] = None) -> NgramModel:
+    """Return a pruned copy of ``model``; the model itself is left untouched.
+
+    ``min_counts`` maps an order (2 and up) to the smallest count kept,
+    ``top_n`` caps the successors kept per prefix, and ``entropy_threshold``
+    enables entropy pruning of orders 2 and 3. Unigrams are never pruned, so
+    the vocabulary and unigram probabilities are unchanged, and bigrams that
+    prefix a kept trigram are kept whatever their count.
+    """
+    min_counts = min_counts or {}
+    trigrams, bigrams = model.trigrams, model.bigrams
+
+    if entropy_threshold is not None:
+        # both orders are judged against the unpruned lower order
+        bigram_totals = row_totals(bigrams)
+        unigram_totals = {(): sum(model.unigrams.values())}
+        trigrams = entropy_prune(trigrams, bigrams, bigram_totals, entropy_threshold)
+        bigrams = entropy_prune(bigrams, model.unigrams, unigram_totals, entropy_threshold)
+
+    trigrams = prune_table(trigrams, min_counts.get(3, 1), top_n)
+    bigrams = prune_table(bigrams, min_counts.get(2, 1), top_n)
+    keep_trigram_prefixes(bigrams, trigrams, model.bigrams)
+
+    pruned = NgramModel(order=model.order)
+    pruned.reset_counts()
+    pruned.trigrams = defaultdict(Counter, trigrams)
+    pruned.bigrams = defaultdict(Counter, bigrams)
+    pruned.unigrams = Counter(dict(model.unigrams.items()))
+    pruned.higher_counts = {}
+    pruned.finish_training()
+    if model.higher is not None:
+        pruned.higher = model.higher.pruned(min_counts, top_n)
+    return pruned
+
+
+class ByteCounter:
+    """Write-only file that counts the bytes written to it and keeps none of them"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        return len(data)
+
+
+def pickled_size(data: Dict, chunk_rows: int = PICKLE_CHUNK_ROWS) -> int:
+    """Bytes ``data`` takes pickled, without holding the pickle or its memo whole.
+
+    The memo of a whole-model pickle references every object written, so it
+    costs about ten times the pickle itself. Tables are pickled instead in
+    chunks of ``chunk_rows`` rows, clearing the memo in between. Words
+    shared across chunks are written once per chunk, so the estimate is a
+    few percent off the saved file (7% over for all.pkl).
+    """
+    def chunks(value) -> Iterable:
+        if not isinstance(value, dict):
+            yield value
+            return
+        rows = iter(value.items())
+        while True:
+            chunk = dict(itertools.islice(rows, chunk_rows))
+            if not chunk:
+                return
+            yield chunk
+
+    counter = ByteCounter()
+    pickler = pickle.Pickler(counter)
+    for value in data.values():
+        for chunk in chunks(value):
+            pickler.dump(chunk)
+            pickler.clear_memo()
+    return counter.size
+
+
+def model_stats(model: NgramModel) -> Dict:
+    return {
+        "trigram_prefixes": len(model.trigrams),
+        "trigram_entries": sum(len(successors) for successors in model.trigrams.values()),
+        "bigram_entries": sum(len(successors) for successors in model.bigrams.values()),
+        "size_mb": round(pickled_size(model.to_dict()) / (1024 * 1024), 2),
+    }
+
+
+def evaluate(model: NgramModel, texts: Iterable[str], top_k: int = 3,
+             max_positions: int = DEFAULT_EVAL_POSITIONS) -> Dict:
+    """Held-out perplexity (interpolated) and next-word accuracy (backoff ranking).
+
+    Out-of-vocabulary targets have zero probability under the model, so they
+    are left out of the perplexity and reported as ``oov_rate``.
+    """
+    log_prob = 0.0
+    scored = positions = oov = top1 = topk = 0
+    start = time.perf_counter()
+
+    for text in texts:
+        tokens = model.tokenize(text)
+        for i in range(2, len(tokens)):
+            if positions >= max_positions:
+                break
+            w1, w2, w3 = tokens[i - 2], tokens[i - 1], tokens[i]
+            positions += 1
+
+            if (w3,) in model.unigrams:
+                log_prob += math.log(model.interpolate(w1, w2, w3))
+                scored += 1
+            else:
+                oov += 1
+
+            ranked = [c['word'] for c in model.rank_context(tokens[max(0, i - model.order + 1):i], top_k)]
+            top1 += bool(ranked) and ranked[0] == w3
+            topk += w3 in ranked
+        if positions >= max_positions:
+            break
+
+    elapsed = time.perf_counter() - start
+    return {
+        "positions": positions,
+        "perplexity": round(math.exp(-log_prob / scored), 3) if scored else None,
+        "oov_rate": round(oov / positions, 4) if positions else 0.0,
+        "top1_accuracy": round(top1 / positions, 4) if positions else 0.0,
+        f"top{top_k}_accuracy": round(topk / positions, 4) if positions else 0.0,
+        "eval_us_per_position": round(elapsed / positions * 1e6, 1) if positions else 0.0,
+    }
+
+
+def describe(config: Dict) -> str:
+    parts = []
+    for order, count in sorted(config.get("min_counts", {}).items()):
+        parts.append(f"min{order}={count}")
+    if config.get("top_n") is not None:
+        parts.append(f"top_n={config['top_n']}")
+    if config.get("entropy_threshold") is not None:
+        parts.append(f"entropy={config['entropy_threshold']:g}")
+    return ",".join(parts) or "unpruned"
+
+
+def pruning_report(model: NgramModel, heldout: List[str], configs: List[Dict], top_k: int = 3,
+                   max_positions: int = DEFAULT_EVAL_POSITIONS) -> List[Dict]:
+    """Size and held-out quality of the unpruned model and each pruning config."""
+    rows = []
+    for config in [{}] + configs:
+        candidate = prune_model(model, **config) if config else model
+        row = {"config": describe(config), **model_stats(candidate),
+               **evaluate(candidate, heldout, top_k, max_positions)}
+        rows.append(row)
+        print(f"{row['config']:>40}: {row['size_mb']:8.2f} MB  ppl {row['perplexity']}  "
+              f"top1 {row['top1_accuracy']:.3f}  top{top_k} {row[f'top{top_k}_accuracy']:.3f}")
+    return rows
+
+
+def add_prune_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--min-trigram-count", type=int, default=1, help="drop trigrams seen fewer times")
+    parser.add_argument("--min-bigram-count", type=int, default=1, help="drop bigrams seen fewer times")
+    parser.add_argument("--min-higher-order-count", type=int, default=1,
+                        help="drop 4-grams and longer seen fewer times")
+    parser.add_argument("--top-n", type=int, default=None, help="keep at most this many successors per prefix")
+    parser.add_argument("--entropy-threshold", type=float, default=None,
+                        help="relative entropy pruning threshold, e.g. 1e-7")
+
+
+def prune_options(args: argparse.Namespace) -> Dict:
+    options = {}
+    min_counts = {order: count for order, count in ((3, args.min_trigram_count), (2, args.min_bigram_count))
+                  if count > 1}
+    if args.min_higher_order_count > 1:
+        min_counts.update({order: args.min_higher_order_count for order in range(4, MAX_ORDER + 1)})
+    if min_counts:
+        options["min_counts"] = min_counts
+    if args.top_n is not None:
+        options["top_n"] = args.top_n
+    if args.entropy_threshold is not None:
+        options["entropy_threshold"] = args.entropy_threshold
+    return options
+
+
+def main():
+    # python -m core.pruning all.pkl --heldout data/std-en.txt --entropy-threshold 1e-7 --output all-pruned.pkl
+    parser = argparse.ArgumentParser(description="Prune a saved n-gram model and report size vs. quality")
+    parser.add_argument("model", help="model file name inside trained_models/")
+    parser.add_argument("--heldout", nargs="*", default=[], help="held-out text files for the report")
+    parser.add_argument("--output", help="save the pruned model under this name inside trained_models/")
+    parser.add_argument("--report", help="write the report rows as JSON to this path")
+    parser.add_argument("--sweep", action="store_true", help="report a built-in grid of pruning settings")
+    parser.add_argument("--top-k", type=int, default=3, help="k for the top-k accuracy column")
+    parser.add_argument("--max-positions", type=int, default=DEFAULT_EVAL_POSITIONS,
+                        help="held-out positions evaluated per model")
+    parser.add_argument("--kneser-ney", action="store_true",
+                        help="also save the Kneser-Ney scoring tables with the pruned model")
+    add_prune_arguments(parser)
+    args = parser.parse_args()
+
+    model = NgramModel.load_model(args.model)
+    if not model:
+        raise SystemExit(1)
+    options = prune_options(args)
+
+    if args.heldout:
+        heldout = list(model.iter_text_files(args.heldout))
+        configs = SWEEP_CONFIGS if args.sweep else []
+        if options and options not in configs:
+            configs = configs + [options]
+        rows = pruning_report(model, heldout, configs, args.top_k, args.max_positions)
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(rows, f, indent=2)
+            print(f"Report written to {args.report}")
+
+    if args.output:
+        prune_model(model, **options).save_model(args.output, scoring=args.kneser_ney)
+    elif not args.heldout:
+        print("Nothing to do: pass --heldout for a report and/or --output to save a pruned model")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+import argparse
+import math
+import os
+import pickle
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain, islice
+from typing import Dict, List, Optional, Tuple
+
+from core.ngrams import NgramModel
+from core.storage import CompactNgramStore, CsrTable, Vocabulary, END_TOKEN
+from core.tokenizer import DEFAULT_TOKENIZER
+from core.metrics import recorder
+
+QUANTIZED_EXTENSION = '.ngq'
+QUANTIZED_VERSION = 1
+SUPPORTED_BITS = (8, 16)
+
+
+def build_codebook(values: List[float], bits: int) -> Tuple[array, array]:
+    """Equal-population codebook over sorted ``values``.
+
+    Returns (boundaries, levels): a value encodes to
+    ``bisect_right(boundaries, value)`` and decodes to the mean of its bucket.
+    Codes are monotone in the value, so rows sorted by count stay sorted.
+    """
+    n = len(values)
+    buckets = min(1 << bits, n) or 1
+    boundaries = array('d')
+    for i in range(1, buckets):
+        edge = values[(i * n) // buckets]
+        if not boundaries or edge > boundaries[-1]:
+            boundaries.append(edge)
+
+    sums = [0.0] * (len(boundaries) + 1)
+    sizes = [0] * (len(boundaries) + 1)
+    code = 0
+    for value in values:
+        while code < len(boundaries) and value >= boundaries[code]:
+            code += 1
+        sums[code] += value
+        sizes[code] += 1
+    levels = array('d', (total / size if size else 0.0 for total, size in zip(sums, sizes)))
+    return boundaries, levels
+
+
+class QuantizedTable:
+    """One n-gram order: CSR rows of rank-ordered successors and log-prob codes."""
+
+    def __init__(self, keys: array, offsets: array, successors: array, codes: array,
+                 boundaries: array, levels: array):
+        self.keys = keys
+        self.offsets = offsets
+        self.successors = successors
+        self.codes = codes
+        self.boundaries = boundaries
+        self.levels = levels
+
+    @classmethod
+    def from_csr(cls, table: CsrTable, vocab_size: int, bits: int, word_type: str) -> 'QuantizedTable':
+        successors = array(word_type)
+        logprobs = []
+        for row in range(len(table.keys)):
+            start, end = table.span(row)
+            denominator = table.totals[row] + vocab_size
+            for i in range(start, end):
+                position = start + table.ranks[i]
+                successors.append(table.successors[position])
+                logprobs.append(math.log((table.counts[position] + 1) / denominator))
+
+        boundaries, levels = build_codebook(sorted(logprobs), bits)
+        codes = array('B' if bits == 8 else 'H', (bisect_right(boundaries, lp) for lp in logprobs))
+        offsets = array('I', table.offsets) if len(successors) < 1 << 32 else array('Q', table.offsets)
+        return cls(array('Q', table.keys), offsets, successors, codes, boundaries, levels)
+
+    def find_row(self, key: int) -> int:
+        row = bisect_left(self.keys, key)
+        if row < len(self.keys) and self.keys[row] == key:
+            return row
+        return -1
+
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.keys, self.offsets, self.successors,
+                                                 self.codes, self.boundaries, self.levels))
+
+    def to_dict(self) -> Dict:
+        return {field: getattr(self, field) for field in
+                ('keys', 'offsets', 'successors', 'codes', 'boundaries', 'levels')}
+
+
+class QuantizedModel:
+    """Backoff-only serving model with precomputed, quantized log-probabilities.
+
+    Each trigram and bigram row holds its successors already in rank order
+    with an 8- or 16-bit code per entry; codes index a per-order codebook of
+    smoothed log-probs. Counts and totals are not kept, so scoring is a table
+    lookup and the model is read-only. Ranking is the same staged
+    trigram -> bigram -> unigram backoff as NgramModel.predict_next, up to
+    quantisation ties; ``ranking_agreement`` measures the difference.
+    """
+
+    methods = ('backoff',)
+
+    def __init__(self, words: List[str], trigrams: QuantizedTable, bigrams: QuantizedTable,
+                 unigram_ids: array, unigram_codes: array, unigram_boundaries: array,
+                 unigram_levels: array, vocab_size: int, total_tokens: int, bits: int):
+        self.vocab = Vocabulary(words)
+        self.radix = max(len(words), 1)
+        self.end_id = self.vocab.lookup(END_TOKEN)
+        self.trigrams = trigrams
+        self.bigrams = bigrams
+        self.unigram_ids = unigram_ids
+        self.unigram_codes = unigram_codes
+        self.unigram_boundaries = unigram_boundaries
+        self.unigram_levels = unigram_levels
+        self.vocab_size = vocab_size
+        self.total_tokens = total_tokens
+        self.bits = bits
+        self.is_trained = True
+
+    @classmethod
+    def from_model(cls, model: NgramModel, bits: int = 8) -> 'QuantizedModel':
+        if bits not in SUPPORTED_BITS:
+            raise ValueError(f"bits must be one of {SUPPORTED_BITS}")
+        store = model.storage or CompactNgramStore.from_tables(model.trigrams, model.bigrams, model.unigrams)
+        vocab_size = model.vocab_size
+        word_type = 'H' if len(store.vocab) <= 1 << 16 else 'I'
+
+        unigram_ids = array(word_type, store.unigram_ranks)
+        denominator = store.unigram_total + vocab_size
+        logprobs = [math.log((store.unigram_counts[word_id] + 1) / denominator) for word_id in unigram_ids]
+        boundaries, levels = build_codebook(sorted(logprobs), bits)
+        codes = array('B' if bits == 8 else 'H', (bisect_right(boundaries, lp) for lp in logprobs))
+
+        return cls([store.vocab[i] for i in range(len(store.vocab))],
+                   QuantizedTable.from_csr(store.trigram_table, vocab_size, bits, word_type),
+                   QuantizedTable.from_csr(store.bigram_table, vocab_size, bits, word_type),
+                   unigram_ids, codes, boundaries, levels, vocab_size, model.total_tokens, bits)
+
+    def pack(self, prefix) -> int:
+        key = 0
+        for word in prefix:
+            word_id = self.vocab.lookup(word)
+            if word_id < 0:
+                return -1
+            key = key * self.radix + word_id
+        return key
+
+    def score_row(self, table: QuantizedTable, row: int, seen: set, top_k: int, source: str) -> List[Dict]:
+        scored = []
+        words, levels = self.vocab.words, table.levels
+        for i in range(table.offsets[row], table.offsets[row + 1]):
+            word_id = table.successors[i]
+            if word_id == self.end_id:
+                break  # ranked last in every row
+            word = words[word_id]
+            if word in seen:
+                continue
+            seen.add(word)
+            scored.append({'word': word, 'prob': levels[table.codes[i]], 'source': source})
+            if len(scored) == top_k:
+                break
+        return scored
+
+    def score_unigrams(self, seen: set, top_k: int) -> List[Dict]:
+        scored = []
+        words, levels = self.vocab.words, self.unigram_levels
+        for word_id, code in zip(self.unigram_ids, self.unigram_codes):
+            word = words[word_id]
+            if word in seen:
+                continue
+            seen.add(word)
+            scored.append({'word': word, 'prob': levels[code], 'source': 'unigram'})
+            if len(scored) == top_k:
+                break
+        return scored
+
+    def rank_next(self, w1: str, w2: str, top_k: int) -> List[Dict]:
+        rec = recorder()
+        stages = []
+        seen = set()
+        scored = 0
+
+        # a lower order is only needed while fewer than top_k words were found,
+        # which is the same test NgramModel.predict_next makes on its counts
+        for table, prefix, source in ((self.trigrams, (w1, w2), 'trigram'), (self.bigrams, (w2,), 'bigram')):
+            if scored >= top_k:
+                break
+            key = self.pack(prefix)
+            row = table.find_row(key) if key >= 0 else -1
+            if row >= 0:
+                stages.append(self.score_row(table, row, seen, top_k, source))
+                scored += len(stages[-1])
+            if rec:
+                rec.mark(source)
+
+        if scored < top_k:
+            stages.append(self.score_unigrams(seen, top_k))
+            if rec:
+                rec.mark('unigram')
+
+        # a longer context always ranks first, as in SuccessorIndex.predict
+        ranked = list(islice(chain.from_iterable(stages), top_k))
+        if rec:
+            rec.mark('sort')
+        return ranked
+
+    def tokenize(self, text: str, special_tokens: bool = True) -> List[str]:
+        return DEFAULT_TOKENIZER.tokenize(text, special_tokens)
+
+    def context_key(self, text: str, method: str = 'backoff') -> Tuple:
+        return tuple(self.tokenize(text, False)[-2:])
+
+    def predict_next(self, context: str, top_k: int = 5) -> List[str]:
+        tokens = self.tokenize(context, False)
+        rec = recorder()
+        if rec:
+            rec.mark('tokenize')
+        if len(tokens) < 2:
+            return []
+        return [c['word'] for c in self.rank_next(tokens[-2], tokens[-1], top_k)]
+
+    def predict_batch(self, texts: List[str], top_k: int = 5, method: str = 'backoff',
+                      mode: str = 'fast') -> List[List[str]]:
+        self.require(method)
+        cache: Dict[Tuple[str, ...], List[str]] = {}
+        results = []
+        for text in texts:
+            tokens = self.tokenize(text, False)
+            if len(tokens) < 2:
+                results.append([])
+                continue
+            key = (tokens[-2], tokens[-1])
+            if key not in cache:
+                cache[key] = [c['word'] for c in self.rank_next(key[0], key[1], top_k)]
+            results.append(list(cache[key]))
+        return results
+
+    def require(self, method: str):
+        if method not in self.methods:
+            raise ValueError(f"Quantized models only support {', '.join(self.methods)} prediction, not '{method}'")
+
+    def predict_with_interpolation(self, text: str, top_k: int = 5, mode: str = 'fast') -> List[str]:
+        self.require('interpolation')
+
+    def complete(self, text: str, top_k: int = 5) -> List[str]:
+        self.require('completion')
+
+    def has_scorer(self, method: str) -> bool:
+        return False
+
+    def scorer(self, method: str):
+        self.require(method)
+
+    def predict_scored(self, text: str, top_k: int = 5, method: str = 'kneser_ney') -> List[str]:
+        self.require(method)
+
+    def updated(self, texts) -> 'QuantizedModel':
+        raise ValueError("Quantized models are read-only")
+
+    def memory_bytes(self) -> int:
+        unigram_arrays = (self.unigram_ids, self.unigram_codes, self.unigram_boundaries, self.unigram_levels)
+        return self.trigrams.nbytes() + self.bigrams.nbytes() + \
+            sum(a.itemsize * len(a) for a in unigram_arrays) + \
+            sum(sys.getsizeof(word) for word in self.vocab.words)
+
+    def save(self, filepath: str):
+        save_dir = 'trained_models'
+        os.makedirs(save_dir, exist_ok=True)
+        full_path = os.path.join(save_dir, filepath)
+        data = {
+            'version': QUANTIZED_VERSION,
+            'bits': self.bits,
+            'words': self.vocab.words,
+            'trigrams': self.trigrams.to_dict(),
+            'bigrams': self.bigrams.to_dict(),
+            'unigram_ids': self.unigram_ids,
+            'unigram_codes': self.unigram_codes,
+            'unigram_boundaries': self.unigram_boundaries,
+            'unigram_levels': self.unigram_levels,
+            'vocab_size': self.vocab_size,
+            'total_tokens': self.total_tokens,
+        }
+        with open(full_path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        file_size = os.path.getsize(full_path) / (1024 * 1024)  # MB
+        print(f"Quantized model saved to {full_path} ({file_size:.2f} MB)")
+
+    @classmethod
+    def load(cls, filepath: str) -> Optional['QuantizedModel']:
+        full_path = os.path.join('trained_models', filepath)
+        if not os.path.exists(full_path):
+            print(f"Model file {full_path} not found")
+            return None
+        with open(full_path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('version') != QUANTIZED_VERSION:
+            raise ValueError(f"Unsupported quantized model version {data.get('version')}")
+        model = cls(data['words'], QuantizedTable(**data['trigrams']), QuantizedTable(**data['bigrams']),
+                    data['unigram_ids'], data['unigram_codes'], data['unigram_boundaries'],
+                    data['unigram_levels'], data['vocab_size'], data['total_tokens'], data['bits'])
+        print(f"Loaded {data['bits']}-bit quantized model with vocabulary size: {model.vocab_size}")
+        return model
+
+
+def exact_logprob(model: NgramModel, w1: str, w2: str, word: str) -> float:
+    """The log-prob NgramModel.predict_next would give ``word`` after (w1, w2)."""
+    for table, prefix in ((model.trigrams, (w1, w2)), (model.bigrams, (w2,))):
+        successors = table.get(prefix)
+        if successors is not None and word in successors:
+            return math.log((successors[word] + 1) / (sum(successors.values()) + model.vocab_size))
+    total = model.index.unigram_total if model.index is not None else sum(model.unigrams.values())
+    return math.log((model.unigrams.get((word,), 0) + 1) / (total + model.vocab_size))
+
+
+def ranking_agreement(model: NgramModel, quantized: QuantizedModel, contexts: List[Tuple[str, str]],
+                      top_k: int = 5) -> Dict:
+    """Compare quantized rankings with exact backoff rankings over ``contexts``.
+
+    ``tie_aware_match`` counts a context as agreeing when the quantized top-k,
+    rescored exactly, has the same probabilities as the exact top-k: words
+    with equal counts may legitimately come out in a different order.
+    """
+    top1 = overlap = exact = tie_aware = 0
+    abs_error = 0.0
+    errors = 0
+    for w1, w2 in contexts:
+        expected = model.rank_next(w1, w2, top_k)
+        got = quantized.rank_next(w1, w2, top_k)
+        expected_words = [c['word'] for c in expected]
+        got_words = [c['word'] for c in got]
+
+        rescored = [exact_logprob(model, w1, w2, word) for word in got_words]
+        expected_probs = [c['prob'] for c in expected]
+        for c, true_prob in zip(got, rescored):
+            abs_error += abs(c['prob'] - true_prob)
+            errors += 1
+
+        exact += got_words == expected_words
+        # both lists run stage by stage, so tied words only swap within equal probabilities
+        tie_aware += all(math.isclose(a, b) for a, b in zip(rescored, expected_probs)) \
+            and len(rescored) == len(expected_probs)
+        top1 += bool(got) and bool(expected) and math.isclose(rescored[0], expected_probs[0])
+        overlap += len(set(got_words) & set(expected_words)) / max(1, len(expected_words))
+
+    n = len(contexts) or 1
+    return {
+        "contexts": len(contexts),
+        "top_k": top_k,
+        "exact_match": round(exact / n, 4),
+        "tie_aware_match": round(tie_aware / n, 4),
+        "top1_agreement": round(top1 / n, 4),
+        "topk_overlap": round(overlap / n, 4),
+        "mean_abs_logprob_error": round(abs_error / errors, 5) if errors else 0.0,
+    }
+
+
+def heldout_contexts(model: NgramModel, texts: List[str], limit: int) -> List[Tuple[str, str]]:
+    contexts = []
+    for text in texts:
+        tokens = model.tokenize(text)
+        for i in range(2, len(tokens)):
+            contexts.append((tokens[i - 2], tokens[i - 1]))
+            if len(contexts) >= limit:
+                return contexts
+    return contexts
+
+
+def main():
+    # python -m core.quantized all.pkl --bits 8 --heldout data/std-en.txt
+    parser = argparse.ArgumentParser(description="Export a quantized serving model and report ranking agreement")
+    parser.add_argument("model", help="model file name inside trained_models/")
+    parser.add_argument("--bits", type=int, default=8, choices=SUPPORTED_BITS)
+    parser.add_argument("--output", help="output name inside trained_models/ (default: <model>.ngq)")
+    parser.add_argument("--heldout", nargs="*", default=[], help="text files whose contexts are compared")
+    parser.add_argument("--contexts", type=int, default=20000, help="number of held-out contexts compared")
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    model = NgramModel.load_model(args.model)
+    if not model:
+        raise SystemExit(1)
+    quantized = QuantizedModel.from_model(model, args.bits)
+    quantized.save(args.output or os.path.splitext(args.model)[0] + QUANTIZED_EXTENSION)
+
+    print(f"Resident size: dict ~{model.memory_bytes() / (1024 * 1024):.2f} MB, "
+          f"quantized {quantized.memory_bytes() / (1024 * 1024):.2f} MB")
+    if args.heldout:
+        contexts = heldout_contexts(model, list(model.iter_text_files(args.heldout)), args.contexts)
+        print(ranking_agreement(model, quantized, contexts, args.top_k))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from core.ngrams import NgramModel
+
+logger = logging.getLogger(__name__)
+
+
+class ModelEntry:
+    def __init__(self, model: NgramModel, load_seconds: float):
+        self.model = model
+        self.load_seconds = load_seconds
+        self.size_bytes = model.memory_bytes()
+        self.loaded_at = time.time()
+        self.last_used = time.monotonic()
+        self.hits = 0
+
+
+class PendingLoad:
+    """A load in progress; later callers wait on it instead of loading again."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.model: Optional[NgramModel] = None
+        self.error: Optional[BaseException] = None
+
+
+class ModelRegistry:
+    """Loads models on first use and keeps them under a memory budget.
+
+    ``loader`` maps a model file name to a model (or None if it is missing).
+    Loads are single-flight: concurrent ``get`` calls for the same model
+    share one load. When the resident models exceed ``memory_budget`` bytes
+    the least recently used ones are evicted, except pinned models (the
+    active one) and the components of a resident mixture model. A budget
+    of 0 means no limit. ``on_evict`` is called with each evicted model,
+    under the registry lock, so that whatever else holds on to the model
+    can let it go.
+    """
+
+    def __init__(self, model_files: Dict[str, str], loader: Callable[[str], Optional[NgramModel]],
+                 memory_budget: int = 0, on_evict: Optional[Callable[[NgramModel], None]] = None):
+        self.model_files = model_files
+        self.loader = loader
+        self.memory_budget = memory_budget
+        self.on_evict = on_evict
+        self.entries: "OrderedDict[str, ModelEntry]" = OrderedDict()
+        self.pending: Dict[str, PendingLoad] = {}
+        self.pinned = set()
+        self.lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+        self.shared_loads = 0
+
+    def names(self) -> List[str]:
+        return list(self.model_files)
+
+    def get(self, name: str, pin: bool = False) -> Optional[NgramModel]:
+        if name not in self.model_files:
+            raise KeyError(name)
+
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None:
+                self.touch(name, entry)
+                if pin:
+                    self.pinned = {name}
+                    self.evict()
+                return entry.model
+            pending = self.pending.get(name)
+            owner = pending is None
+            if owner:
+                pending = self.pending[name] = PendingLoad()
+            else:
+                self.shared_loads += 1
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            if pin and pending.model is not None:
+                with self.lock:
+                    self.pinned = {name}
+                    self.evict()
+            return pending.model
+
+        start = time.perf_counter()
+        try:
+            model = self.loader(self.model_files[name])
+            if model is not None:
+                entry = ModelEntry(model, time.perf_counter() - start)
+                logger.info("Loaded %s model in %.2fs (~%.1f MB)",
+                            name, entry.load_seconds, entry.size_bytes / (1024 * 1024))
+                with self.lock:
+                    self.entries[name] = entry
+                    self.loads += 1
+                    # only a model that loaded replaces the pinned one
+                    if pin:
+                        self.pinned = {name}
+                    self.evict()
+            pending.model = model
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.pending[name]
+            pending.done.set()
+        return model
+
+    def is_resident(self, name: str) -> bool:
+        with self.lock:
+            return name in self.entries
+
+    def touch(self, name: str, entry: ModelEntry):
+        entry.last_used = time.monotonic()
+        entry.hits += 1
+        self.entries.move_to_end(name)
+
+    def evict(self):
+        # caller holds the lock; the oldest unpinned models go first
+        if not self.memory_budget:
+            return
+        self.remeasure()
+        resident = sum(entry.size_bytes for entry in self.entries.values())
+        evicted = True
+        while evicted and resident > self.memory_budget:
+            # a mixture's components stay while the mixture does; once it goes,
+            # another pass may evict them too
+            in_use = {id(component) for entry in self.entries.values()
+                      for component in getattr(entry.model, 'components', {}).values()}
+            evicted = False
+            for name in list(self.entries):
+                if resident <= self.memory_budget:
+                    break
+                if name in self.pinned or id(self.entries[name].model) in in_use:
+                    continue
+                entry = self.entries.pop(name)
+                resident -= entry.size_bytes
+                self.evictions += 1
+                evicted = True
+                logger.info("Evicted %s model to stay within the memory budget", name)
+                if self.on_evict is not None:
+                    self.on_evict(entry.model)
+
+    def remeasure(self):
+        # caller holds the lock; mixtures grow as their merged prefix caches fill
+        for entry in self.entries.values():
+            if hasattr(entry.model, 'cache_stats'):
+                entry.size_bytes = entry.model.memory_bytes()
+
+    def replace(self, old: NgramModel, new: NgramModel):
+        """Swap a resident model for an updated snapshot of it."""
+        with self.lock:
+            for name, entry in self.entries.items():
+                if entry.model is old:
+                    entry.model = new
+                    entry.size_bytes = new.memory_bytes()
+                elif hasattr(entry.model, 'replacing'):
+                    # mixtures built on the old snapshot answer from the new one
+                    mixture = entry.model.replacing(old, new)
+                    if mixture is not None:
+                        entry.model = mixture
+            self.evict()
+
+    def resize(self, model):
+        """Re-measure a resident model after structures were built on it (scoring tables, ...)"""
+        with self.lock:
+            for entry in self.entries.values():
+                if entry.model is model:
+                    entry.size_bytes = model.memory_bytes()
+            self.evict()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            self.remeasure()
+            now = time.monotonic()
+            models = {
+                name: {
+                    "vocab_size": entry.model.vocab_size,
+                    "total_tokens": entry.model.total_tokens,
+                    "is_trained": entry.model.is_trained,
+                    "size_mb": round(entry.size_bytes / (1024 * 1024), 2),
+                    "load_seconds": round(entry.load_seconds, 3),
+                    "loaded_at": entry.loaded_at,
+                    "idle_seconds": round(now - entry.last_used, 1),
+                    "hits": entry.hits,
+                    "pinned": name in self.pinned
+                }
+                for name, entry in self.entries.items()
+            }
+            resident = sum(entry.size_bytes for entry in self.entries.values())
+            return {
+                "models": models,
+                "loading": list(self.pending),
+                "resident_mb": round(resident / (1024 * 1024), 2),
+                "memory_budget_mb": round(self.memory_budget / (1024 * 1024), 2) if self.memory_budget else None,
+                "loads": self.loads,
+                "shared_loads": self.shared_loads,
+                "evictions": self.evictions
+            }
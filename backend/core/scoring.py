@@ -0,0 +1,333 @@
+import heapq
+import math
+import sys
+from collections import Counter, defaultdict, namedtuple
+from itertools import islice
+from typing import Dict, Iterator, List, Tuple
+
+from core.index import SuccessorIndex, SPECIAL_TOKENS, DEFAULT_TOP_N, sampled_bytes, list_bytes
+from core.metrics import recorder
+
+SCORING_METHODS = ('stupid_backoff', 'kneser_ney')
+STUPID_BACKOFF_ALPHA = 0.4
+SCORING_TABLES_VERSION = 1
+
+# used when an order has too few distinct counts to estimate discounts from
+FALLBACK_DISCOUNTS = (0.5, 1.0, 1.5)
+
+# total: sum of continuation counts in the row
+# gamma: backoff weight, the mass the discounts moved to the lower order
+# size: number of successors that can be predicted (excluding '</s>')
+# top: [(word, continuation count)] sorted desc, capped at top_n
+# counts: word -> continuation count, for random access
+KnRow = namedtuple('KnRow', ['total', 'gamma', 'size', 'top', 'counts'])
+
+Discounts = Tuple[float, float, float]
+
+
+def modified_discounts(count_of_counts: Counter) -> Discounts:
+    """Chen & Goodman's D1, D2, D3+ from the number of n-grams seen 1..4 times.
+
+    The estimates are clamped so that ``c - D(c)`` never decreases with
+    ``c``; the top-k search relies on count-sorted lists being sorted by
+    discounted count as well.
+    """
+    n1, n2, n3, n4 = (count_of_counts.get(i, 0) for i in range(1, 5))
+    if not (n1 and n2 and n3 and n4):
+        return FALLBACK_DISCOUNTS
+    y = n1 / (n1 + 2 * n2)
+    d1 = min(max(1 - 2 * y * n2 / n1, 0.0), 1.0)
+    d2 = min(max(2 - 3 * y * n3 / n2, 0.0), 1.0 + d1)
+    d3 = min(max(3 - 4 * y * n4 / n3, 0.0), 1.0 + d2)
+    return d1, d2, d3
+
+
+def discounted(count: int, discounts: Discounts) -> float:
+    if count <= 0:
+        return 0.0
+    return count - discounts[min(count, 3) - 1]
+
+
+def backoff_weight(counts, total: int, discounts: Discounts) -> float:
+    if not total:
+        return 1.0
+    removed = 0.0
+    for count in counts:
+        removed += discounts[min(count, 3) - 1]
+    return removed / total
+
+
+def count_of_counts(rows) -> Counter:
+    counts = Counter()
+    for successors in rows:
+        for count in successors.values():
+            if count <= 4:
+                counts[count] += 1
+    return counts
+
+
+class KneserNeyTables:
+    """Everything interpolated modified Kneser-Ney needs beyond the raw counts.
+
+    Built once from the trigram table: the trigram backoff weights, the
+    middle order's continuation counts N1+(. v w) with their totals and
+    weights, and the final unigram continuation probabilities, so a query
+    only does dictionary lookups and a few multiplications per candidate.
+    """
+
+    def __init__(self, discounts: Dict[int, Discounts], trigram_gammas: Dict[Tuple[str, ...], float],
+                 bigram_rows: Dict[Tuple[str, ...], KnRow], unigram_probs: Dict[str, float],
+                 unigram_floor: float, top_n: int = DEFAULT_TOP_N):
+        self.discounts = discounts
+        self.trigram_gammas = trigram_gammas
+        self.bigram_rows = bigram_rows
+        self.unigram_probs = unigram_probs
+        self.unigram_floor = unigram_floor
+        self.top_n = top_n
+        self.unigram_ranked = sorted(((word, prob) for word, prob in unigram_probs.items()
+                                      if word not in SPECIAL_TOKENS),
+                                     key=lambda item: item[1], reverse=True)
+
+    @classmethod
+    def build(cls, trigrams, top_n: int = DEFAULT_TOP_N) -> 'KneserNeyTables':
+        # trigram order: raw counts
+        trigram_discounts = modified_discounts(count_of_counts(trigrams.values()))
+        trigram_gammas = {}
+        continuation = defaultdict(Counter)
+        for prefix, successors in trigrams.items():
+            counts = successors.values()
+            trigram_gammas[prefix] = backoff_weight(counts, sum(counts), trigram_discounts)
+            row = continuation[prefix[1:]]
+            for word in successors:
+                row[word] += 1
+
+        # bigram order: number of distinct words seen before "v w"
+        bigram_discounts = modified_discounts(count_of_counts(continuation.values()))
+        bigram_rows = {}
+        unigram_continuation = Counter()
+        for prefix, row in continuation.items():
+            total = sum(row.values())
+            predictable = [(word, count) for word, count in row.items() if word != '</s>']
+            top = heapq.nlargest(top_n, predictable, key=lambda item: item[1])
+            gamma = backoff_weight(row.values(), total, bigram_discounts)
+            bigram_rows[prefix] = KnRow(total, gamma, len(predictable), top, dict(row))
+            unigram_continuation.update(row.keys())
+
+        # unigram order: distinct "v w" types ending in w, interpolated with a uniform distribution
+        unigram_discounts = modified_discounts(count_of_counts([unigram_continuation]))
+        total = sum(unigram_continuation.values())
+        gamma = backoff_weight(unigram_continuation.values(), total, unigram_discounts)
+        vocabulary = set(unigram_continuation) | {word for prefix in continuation for word in prefix}
+        vocabulary.discard('<s>')
+        unigram_floor = gamma / len(vocabulary) if vocabulary else 0.0
+        unigram_probs = {word: discounted(count, unigram_discounts) / total + unigram_floor
+                         for word, count in unigram_continuation.items()}
+
+        discounts = {3: trigram_discounts, 2: bigram_discounts, 1: unigram_discounts}
+        return cls(discounts, trigram_gammas, bigram_rows, unigram_probs, unigram_floor, top_n)
+
+    def nbytes(self, sample_size: int = 1000) -> int:
+        """Approximate resident size, sampled like NgramModel.memory_bytes"""
+        # prefix keys are counted even where they are shared with the model's
+        # tables: tables built from a compact store or loaded from disk have their own
+        def gamma_bytes(row) -> int:
+            return sys.getsizeof(row[0]) + sys.getsizeof(row[1])
+
+        def probability_bytes(row) -> int:
+            return sys.getsizeof(row[1])
+
+        def row_bytes(row) -> int:
+            prefix, kn_row = row
+            return sys.getsizeof(prefix) + sys.getsizeof(kn_row) + list_bytes(kn_row.top) + \
+                sys.getsizeof(kn_row.counts)
+
+        return sampled_bytes(self.trigram_gammas, gamma_bytes, sample_size) + \
+            sampled_bytes(self.bigram_rows, row_bytes, sample_size) + \
+            sampled_bytes(self.unigram_probs, probability_bytes, sample_size) + list_bytes(self.unigram_ranked)
+
+    def to_dict(self) -> Dict:
+        # plain containers only, like the count tables in the same pickle
+        return {
+            'version': SCORING_TABLES_VERSION,
+            'top_n': self.top_n,
+            'discounts': self.discounts,
+            'trigram_gammas': self.trigram_gammas,
+            'bigram_rows': {prefix: tuple(row) for prefix, row in self.bigram_rows.items()},
+            'unigram_probs': self.unigram_probs,
+            'unigram_floor': self.unigram_floor,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'KneserNeyTables':
+        if data.get('version') != SCORING_TABLES_VERSION:
+            raise ValueError(f"Unsupported scoring tables version: {data.get('version')}")
+        bigram_rows = {prefix: KnRow._make(row) for prefix, row in data['bigram_rows'].items()}
+        return cls(data['discounts'], data['trigram_gammas'], bigram_rows, data['unigram_probs'],
+                   data['unigram_floor'], data['top_n'])
+
+
+def ranked_successors(entry) -> Iterator[Tuple[str, int]]:
+    """(word, count) pairs of an index entry, count desc, past the top-N cut if needed."""
+    yield from entry.top
+    if len(entry.top) < entry.size:
+        listed = {word for word, _ in entry.top}
+        rest = [(word, count) for word, count in entry.successors.items()
+                if word != '</s>' and word not in listed]
+        rest.sort(key=lambda item: item[1], reverse=True)
+        yield from rest
+
+
+class StupidBackoffEngine:
+    """Brants et al.'s Stupid Backoff over the successor index.
+
+    S(w | u v) is c(u v w) / c(u v) when the trigram was seen, otherwise
+    ``alpha`` times the bigram score, otherwise ``alpha`` squared times the
+    unigram relative frequency. The index already holds every row total and
+    count-sorted successor list, so each order is a sorted stream and the
+    top k is a lazy merge of the three.
+    """
+
+    def __init__(self, index: SuccessorIndex, unigrams, alpha: float = STUPID_BACKOFF_ALPHA):
+        self.index = index
+        self.unigrams = unigrams
+        self.alpha = alpha
+        self.log_alpha = math.log(alpha)
+
+    def score(self, w1: str, w2: str, word: str) -> float:
+        entry = self.index.trigrams.get((w1, w2))
+        if entry is not None and entry.successors.get(word, 0):
+            return math.log(entry.successors[word] / entry.total)
+        entry = self.index.bigrams.get((w2,))
+        if entry is not None and entry.successors.get(word, 0):
+            return self.log_alpha + math.log(entry.successors[word] / entry.total)
+        count = self.unigrams.get((word,), 0)
+        if count and word not in SPECIAL_TOKENS:
+            return 2 * self.log_alpha + math.log(count / self.index.unigram_total)
+        return float('-inf')
+
+    @staticmethod
+    def stage(ranked, total: int, weight: float, shadowed: List, source: str) -> Iterator[Dict]:
+        # words seen at a higher order keep that order's score
+        for word, count in ranked:
+            if any(word in successors for successors in shadowed):
+                continue
+            yield {'word': word, 'prob': weight + math.log(count / total), 'source': source}
+
+    def predict(self, w1: str, w2: str, top_k: int) -> List[Dict]:
+        rec = recorder()
+        streams = []
+        shadowed = []
+
+        entry = self.index.trigrams.get((w1, w2))
+        if entry is not None and entry.total:
+            streams.append(self.stage(ranked_successors(entry), entry.total, 0.0, [], 'trigram'))
+            shadowed.append(entry.successors)
+
+        entry = self.index.bigrams.get((w2,))
+        if entry is not None and entry.total:
+            streams.append(self.stage(ranked_successors(entry), entry.total, self.log_alpha,
+                                      list(shadowed), 'bigram'))
+            shadowed.append(entry.successors)
+
+        if self.index.unigram_total:
+            streams.append(self.stage(self.index.unigram_ranked, self.index.unigram_total,
+                                      2 * self.log_alpha, shadowed, 'unigram'))
+
+        ranked = list(islice(heapq.merge(*streams, key=lambda c: -c['prob']), top_k))
+        if rec:
+            rec.mark('score')
+        return ranked
+
+
+class KneserNeyEngine:
+    """Interpolated modified Kneser-Ney with precomputed tables.
+
+    P(w | u v) = max(c(u v w) - D3, 0) / c(u v) + gamma(u v) * P2(w | v), where
+    P2 is built the same way from continuation counts and falls back to the
+    unigram continuation probability. The top k comes from the threshold
+    algorithm over the three sorted lists, as in ``InterpolationEngine``.
+    """
+
+    def __init__(self, index: SuccessorIndex, tables: KneserNeyTables):
+        self.index = index
+        self.tables = tables
+
+    def context(self, w1: str, w2: str):
+        entry = self.index.trigrams.get((w1, w2))
+        if entry is not None and not entry.total:
+            entry = None
+        gamma3 = self.tables.trigram_gammas.get((w1, w2), 1.0) if entry is not None else 1.0
+        row = self.tables.bigram_rows.get((w2,))
+        if row is not None and not row.total:
+            row = None
+        gamma2 = row.gamma if row is not None else 1.0
+        return entry, gamma3, row, gamma2
+
+    def prob(self, w1: str, w2: str, word: str) -> float:
+        return self.combine(word, *self.context(w1, w2))
+
+    def combine(self, word: str, entry, gamma3: float, row, gamma2: float) -> float:
+        p = self.tables.unigram_probs.get(word, self.tables.unigram_floor)
+        if row is not None:
+            p = discounted(row.counts.get(word, 0), self.tables.discounts[2]) / row.total + gamma2 * p
+        else:
+            p *= gamma2
+        if entry is not None:
+            p = discounted(entry.successors.get(word, 0), self.tables.discounts[3]) / entry.total + gamma3 * p
+        return p
+
+    def predict(self, w1: str, w2: str, top_k: int) -> List[Dict]:
+        rec = recorder()
+        entry, gamma3, row, gamma2 = self.context(w1, w2)
+        scored = {}
+        kth_best = []  # min-heap of the top_k scores seen so far
+
+        def visit(word: str):
+            if word in scored or word in SPECIAL_TOKENS:
+                return
+            prob = self.combine(word, entry, gamma3, row, gamma2)
+            if prob <= 0:
+                return
+            scored[word] = prob
+            if len(kth_best) < top_k:
+                heapq.heappush(kth_best, prob)
+            elif prob > kth_best[0]:
+                heapq.heapreplace(kth_best, prob)
+
+        # a top list that was cut at top_n cannot bound the words after it
+        for candidate in (entry, row):
+            if candidate is not None and len(candidate.top) < candidate.size:
+                for word in (candidate.successors if candidate is entry else candidate.counts):
+                    visit(word)
+
+        trigram_top = entry.top if entry is not None else []
+        bigram_top = row.top if row is not None else []
+        unigram_top = self.tables.unigram_ranked
+        d3, d2 = self.tables.discounts[3], self.tables.discounts[2]
+        depth = 0
+
+        while depth < len(trigram_top) or depth < len(bigram_top) or depth < len(unigram_top):
+            for ranked in (trigram_top, bigram_top, unigram_top):
+                if depth < len(ranked):
+                    visit(ranked[depth][0])
+
+            # no unvisited word can score above the interpolation of the current positions
+            bound = unigram_top[depth][1] if depth < len(unigram_top) else self.tables.unigram_floor
+            if row is not None:
+                count = bigram_top[depth][1] if depth < len(bigram_top) else 0
+                bound = discounted(count, d2) / row.total + gamma2 * bound
+            else:
+                bound *= gamma2
+            if entry is not None:
+                count = trigram_top[depth][1] if depth < len(trigram_top) else 0
+                bound = discounted(count, d3) / entry.total + gamma3 * bound
+            if len(kth_best) == top_k and kth_best[0] > bound:
+                break
+            depth += 1
+        if rec:
+            rec.mark('score')
+
+        best = heapq.nsmallest(top_k, scored.items(), key=lambda item: (-item[1], item[0]))
+        if rec:
+            rec.mark('sort')
+        return [{'word': word, 'prob': math.log(prob)} for word, prob in best]
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional
+
+DEFAULT_PREDICT_WORKERS = 4
+DEFAULT_LOAD_WORKERS = 1
+DEFAULT_MAX_PENDING = 64
+DEFAULT_PREDICT_TIMEOUT = 2.0
+DEFAULT_LOAD_TIMEOUT = 120.0
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Superseded(Exception):
+    pass
+
+
+class WorkTimeout(Exception):
+    pass
+
+
+class Ticket:
+    """One client's latest request; a newer ticket for the same client cancels it."""
+
+    def __init__(self):
+        self.cancelled = False
+        self.future: Optional[asyncio.Future] = None
+
+    def cancel(self):
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+
+class ServingExecutor:
+    """Runs blocking model work off the event loop.
+
+    Predictions and model loads use separate thread pools, so a slow load
+    never takes a prediction slot. At most ``max_pending`` predictions are
+    queued or running, counting calls whose caller has stopped waiting but
+    whose thread is still busy; beyond that callers get ``Overloaded``
+    straight away instead of queueing behind work that will time out anyway.
+
+    A prediction tagged with a ``client_id`` supersedes that client's
+    previous one: if it has not started it never runs, and if it is running
+    its caller stops waiting and gets ``Superseded``. A thread cannot be
+    interrupted, so a running superseded or timed out call still finishes in
+    the background, but its result is dropped.
+    """
+
+    def __init__(self, predict_workers: int = DEFAULT_PREDICT_WORKERS,
+                 load_workers: int = DEFAULT_LOAD_WORKERS,
+                 max_pending: int = DEFAULT_MAX_PENDING,
+                 predict_timeout: float = DEFAULT_PREDICT_TIMEOUT,
+                 load_timeout: float = DEFAULT_LOAD_TIMEOUT):
+        self.predict_pool = ThreadPoolExecutor(max_workers=predict_workers, thread_name_prefix="predict")
+        self.load_pool = ThreadPoolExecutor(max_workers=load_workers, thread_name_prefix="load")
+        self.predict_workers = predict_workers
+        self.load_workers = load_workers
+        self.max_pending = max_pending
+        self.predict_timeout = predict_timeout
+        self.load_timeout = load_timeout
+
+        self.latest: Dict[Hashable, Ticket] = {}
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.superseded = 0
+        self.rejected = 0
+        self.loads = 0
+
+    async def predict(self, fn: Callable, *args, client_id: Optional[Hashable] = None,
+                      timeout: Optional[float] = None):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise Overloaded(f"More than {self.max_pending} predictions pending")
+            self.pending += 1
+            ticket = Ticket()
+            if client_id is not None:
+                previous = self.latest.get(client_id)
+                self.latest[client_id] = ticket
+                if previous is not None:
+                    previous.cancel()
+
+        def run():
+            # skip work superseded while it sat in the queue
+            if ticket.cancelled:
+                raise Superseded()
+            return fn(*args)
+
+        def release(_):
+            # counted until the thread is done, not when its caller stops waiting
+            with self.lock:
+                self.pending -= 1
+                if client_id is not None and self.latest.get(client_id) is ticket:
+                    del self.latest[client_id]
+
+        try:
+            work = self.predict_pool.submit(run)
+        except BaseException:
+            release(None)
+            raise
+        work.add_done_callback(release)
+        try:
+            ticket.future = asyncio.wrap_future(work)
+            result = await asyncio.wait_for(ticket.future, timeout or self.predict_timeout)
+            with self.lock:
+                self.completed += 1
+            return result
+        except asyncio.TimeoutError:
+            with self.lock:
+                self.timeouts += 1
+            raise WorkTimeout(f"Prediction took longer than {timeout or self.predict_timeout}s")
+        except (asyncio.CancelledError, Superseded):
+            if not ticket.cancelled:
+                raise  # the request itself was cancelled, e.g. the client went away
+            with self.lock:
+                self.superseded += 1
+            raise Superseded("Superseded by a newer request")
+
+    async def load(self, fn: Callable, *args, timeout: Optional[float] = None):
+        loop = asyncio.get_running_loop()
+        try:
+            # shielded so a caller giving up does not cancel a load other callers share
+            result = await asyncio.wait_for(asyncio.shield(loop.run_in_executor(self.load_pool, fn, *args)),
+                                            timeout or self.load_timeout)
+        except asyncio.TimeoutError:
+            raise WorkTimeout(f"Model load took longer than {timeout or self.load_timeout}s")
+        with self.lock:
+            self.loads += 1
+        return result
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                "predict_workers": self.predict_workers,
+                "load_workers": self.load_workers,
+                "max_pending": self.max_pending,
+                "predict_timeout": self.predict_timeout,
+                "load_timeout": self.load_timeout,
+                "pending": self.pending,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "superseded": self.superseded,
+                "rejected": self.rejected,
+                "loads": self.loads
+            }
+
+    def shutdown(self):
+        self.predict_pool.shutdown(wait=False, cancel_futures=True)
+        self.load_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,95 @@
+import re
+from typing import List, Optional, Tuple
+
+from core.tokenizer import DEFAULT_TOKENIZER
+
+# raw text a session keeps; older text only survives as its last tokens
+MAX_SESSION_CHARS = 1024
+# tokens kept for the context, enough for every order and for completion
+CONTEXT_TOKENS = 8
+
+# the same characters str.split() splits on
+WHITESPACE = re.compile(r'\s')
+
+
+class Resync(Exception):
+    """The edit reaches text the session no longer has; the client must resend it."""
+
+
+class SessionContext:
+    """Incrementally tokenized text of one input field for a suggestion session.
+
+    The client sends keystroke edits (drop ``delete`` characters from the
+    end, then append ``insert``). Tokenizing never looks across whitespace,
+    so the text before the last whitespace is tokenized once and kept as
+    ``tokens``; each edit only re-tokenizes from that boundary on, which is
+    usually the word being typed. ``context()`` rebuilds a short text from
+    the last tokens that predicts exactly like the full text.
+    """
+
+    def __init__(self, text: str = ''):
+        self.reset(text)
+
+    def reset(self, text: str):
+        self.text = ''
+        self.boundary = 0  # text[:boundary] is tokenized into self.tokens
+        self.tokens: List[str] = []
+        self.trimmed = False
+        self.append(text)
+
+    def edit(self, delete: int, insert: str):
+        # everything that can raise Resync runs before the session changes
+        if delete:
+            if delete > len(self.text):
+                raise Resync(f"Cannot delete {delete} characters, session holds {len(self.text)}")
+            text = self.text[:len(self.text) - delete]
+            if len(text) < self.boundary:
+                self.boundary, self.tokens = self.retokenize(text)
+            self.text = text
+        self.append(insert)
+
+    def append(self, insert: str):
+        self.text += insert
+        boundary = last_space(self.text, self.boundary) + 1
+        if boundary > self.boundary:
+            self.tokens.extend(DEFAULT_TOKENIZER.tokenize(self.text[self.boundary:boundary], False))
+            self.boundary = boundary
+            del self.tokens[:-CONTEXT_TOKENS]
+        if len(self.text) > MAX_SESSION_CHARS:
+            # drop whole words from the front; their tokens are already counted
+            space = WHITESPACE.search(self.text, len(self.text) - MAX_SESSION_CHARS, self.boundary)
+            if space is not None:
+                cut = space.start()
+                self.text = self.text[cut + 1:]
+                self.boundary -= cut + 1
+                self.trimmed = True
+
+    def retokenize(self, text: str) -> Tuple[int, List[str]]:
+        """(boundary, tokens) for ``text``, which ends before the current boundary"""
+        boundary = last_space(text, 0) + 1
+        tokens = DEFAULT_TOKENIZER.tokenize(text[:boundary], False)
+        if self.trimmed and len(tokens) < CONTEXT_TOKENS:
+            # the words the context needs were dropped with the trimmed text
+            raise Resync("Edit reaches text the session no longer holds")
+        return boundary, tokens[-CONTEXT_TOKENS:]
+
+    @property
+    def mid_word(self) -> bool:
+        return bool(self.text) and (self.text[-1].isalnum() or self.text[-1] == "'")
+
+    def context(self) -> Optional[str]:
+        """Normalized text to predict from, or None when there is nothing to predict from."""
+        tokens = self.tokens + DEFAULT_TOKENIZER.tokenize(self.text[self.boundary:], False)
+        if not tokens:
+            return None
+        # cleaned tokens tokenize to themselves; the trailing space keeps completion
+        # from treating the last word as unfinished when the text was not
+        return ' '.join(tokens[-CONTEXT_TOKENS:]) + ('' if self.mid_word else ' ')
+
+
+def last_space(text: str, start: int) -> int:
+    """Index of the last whitespace at or after ``start``, else ``start - 1``."""
+    for i in range(len(text) - 1, start - 1, -1):
+        if text[i].isspace():
+            return i
+    return start - 1
@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # windows: writes stay atomic, but concurrent writers are not serialised
+    fcntl = None
+
+
+class SharedSettings:
+    """Settings dict that every server worker process sees the same way.
+
+    With a ``path`` the settings live in a JSON file: writes take an
+    exclusive lock, re-read the file, apply the change and atomically
+    replace it; reads re-load only when the file's mtime or size changed, so
+    a read is normally one ``os.stat``. Without a path it is a plain
+    in-process dict, as for a single worker.
+    """
+
+    def __init__(self, defaults: Dict, path: Optional[str] = None, reset: bool = False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.values = dict(defaults)
+        self.version = None
+
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with self.locked():
+                stored = None if reset else self.read_file()
+                if stored is None:
+                    self.write_file(self.values)
+                else:
+                    # keys added since the file was written get their defaults
+                    self.values.update(stored)
+                    self.write_file(self.values)
+
+    def file_version(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def read_file(self) -> Optional[Dict]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write_file(self, values: Dict):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(values, f)
+        os.replace(tmp_path, self.path)
+        self.version = self.file_version()
+
+    def refresh(self):
+        if not self.path:
+            return
+        version = self.file_version()
+        if version != self.version:
+            stored = self.read_file()
+            if stored is not None:
+                self.values = stored
+                self.version = version
+
+    @contextmanager
+    def locked(self):
+        with self.lock:
+            if not self.path or fcntl is None:
+                yield
+                return
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def transaction(self):
+        """Read-modify-write that no other worker can interleave with."""
+        with self.locked():
+            if self.path:
+                # force a re-read: another writer may have landed within the mtime granularity
+                self.values = self.read_file() or self.values
+            values = dict(self.values)
+            yield values
+            if self.path:
+                self.write_file(values)
+            self.values = values
+
+    def update(self, changes: Dict) -> Dict:
+        with self.transaction() as values:
+            values.update(changes)
+        return dict(values)
+
+    def snapshot(self) -> Dict:
+        self.refresh()
+        return dict(self.values)
+
+    def __getitem__(self, key: str):
+        self.refresh()
+        return self.values[key]
+
+    def __setitem__(self, key: str, value):
+        self.update({key: value})
+
+    def get(self, key: str, default=None):
+        self.refresh()
+        return self.values.get(key, default)
@@ -0,0 +1,411 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from collections.abc import Mapping, Sequence
+from typing import Dict, List, Optional, Tuple
+
+from core.index import SuccessorIndex, PrefixEntry, DEFAULT_TOP_N, SPECIAL_TOKENS
+
+END_TOKEN = '</s>'
+
+
+class Vocabulary:
+    """Interns words into dense integer ids (first-seen order)."""
+
+    def __init__(self, words: Optional[List[str]] = None):
+        self.words: List[str] = []
+        self.ids: Dict[str, int] = {}
+        for word in words or []:
+            self.add(word)
+
+    def add(self, word: str) -> int:
+        word_id = self.ids.get(word)
+        if word_id is None:
+            word_id = len(self.words)
+            self.ids[word] = word_id
+            self.words.append(word)
+        return word_id
+
+    def lookup(self, word: str) -> int:
+        return self.ids.get(word, -1)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __getitem__(self, word_id: int) -> str:
+        return self.words[word_id]
+
+
+class CsrTable:
+    """One n-gram order stored as compressed sparse rows.
+
+    keys[r] is the packed prefix of row r (sorted), offsets[r]:offsets[r + 1]
+    spans its successor ids (sorted) and counts. ranks holds, per row, the
+    relative positions ordered by count desc with '</s>' moved last, so a
+    row's top-N list is a prefix of it. Tied counts keep the order the
+    successors were first seen in, like the stable sorts over the dict
+    model's Counters, so both backends rank identically.
+    """
+
+    def __init__(self, keys: array, offsets: array, successors: array,
+                 counts: array, totals: array, ranks: array, sizes: array):
+        self.keys = keys
+        self.offsets = offsets
+        self.successors = successors
+        self.counts = counts
+        self.totals = totals
+        self.ranks = ranks
+        self.sizes = sizes
+
+    @classmethod
+    def build(cls, rows: Dict[int, List[Tuple[int, int]]], end_id: int) -> 'CsrTable':
+        # rows list their (successor id, count) pairs in first-seen order
+        keys, offsets = array('Q'), array('Q', [0])
+        successors, counts = array('I'), array('I')
+        totals, ranks, sizes = array('Q'), array('I'), array('I')
+
+        for key in sorted(rows):
+            seen = rows[key]
+            by_id = sorted(range(len(seen)), key=lambda i: seen[i][0])
+            row = [seen[i] for i in by_id]
+            keys.append(key)
+            successors.extend(word_id for word_id, _ in row)
+            counts.extend(count for _, count in row)
+            offsets.append(len(successors))
+            totals.append(sum(count for _, count in row))
+            # first-seen position breaks ties between equal counts
+            order = sorted(range(len(row)), key=lambda i: (row[i][0] == end_id, -row[i][1], by_id[i]))
+            ranks.extend(order)
+            sizes.append(sum(1 for word_id, _ in row if word_id != end_id))
+
+        return cls(keys, offsets, successors, counts, totals, ranks, sizes)
+
+    def find_row(self, key: int) -> int:
+        row = bisect_left(self.keys, key)
+        if row < len(self.keys) and self.keys[row] == key:
+            return row
+        return -1
+
+    def span(self, row: int) -> Tuple[int, int]:
+        return self.offsets[row], self.offsets[row + 1]
+
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.keys, self.offsets, self.successors,
+                                                 self.counts, self.totals, self.ranks, self.sizes))
+
+
+class SuccessorView(Mapping):
+    """Read-only Counter-like view over one CSR row."""
+
+    __slots__ = ('table', 'vocab', 'start', 'end')
+
+    def __init__(self, table: CsrTable, vocab: Vocabulary, start: int, end: int):
+        self.table = table
+        self.vocab = vocab
+        self.start = start
+        self.end = end
+
+    def position(self, word: str) -> int:
+        word_id = self.vocab.lookup(word)
+        if word_id < 0:
+            return -1
+        i = bisect_left(self.table.successors, word_id, self.start, self.end)
+        if i < self.end and self.table.successors[i] == word_id:
+            return i
+        return -1
+
+    def __getitem__(self, word: str) -> int:
+        i = self.position(word)
+        if i < 0:
+            raise KeyError(word)
+        return self.table.counts[i]
+
+    def get(self, word: str, default=None):
+        i = self.position(word)
+        return self.table.counts[i] if i >= 0 else default
+
+    def __contains__(self, word) -> bool:
+        return self.position(word) >= 0
+
+    def __iter__(self):
+        words = self.vocab.words
+        for i in range(self.start, self.end):
+            yield words[self.table.successors[i]]
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def values(self):
+        return self.table.counts[self.start:self.end]
+
+    def items(self):
+        words = self.vocab.words
+        successors, counts = self.table.successors, self.table.counts
+        return [(words[successors[i]], counts[i]) for i in range(self.start, self.end)]
+
+
+class PrefixTableView(Mapping):
+    """Read-only ``defaultdict(Counter)``-like view: prefix tuple -> SuccessorView."""
+
+    def __init__(self, store: 'CompactNgramStore', table: CsrTable, length: int):
+        self.store = store
+        self.table = table
+        self.length = length
+
+    def find_row(self, prefix) -> int:
+        key = self.store.pack(prefix)
+        return self.table.find_row(key) if key >= 0 else -1
+
+    def row_view(self, row: int) -> SuccessorView:
+        start, end = self.table.span(row)
+        return SuccessorView(self.table, self.store.vocab, start, end)
+
+    def __getitem__(self, prefix) -> SuccessorView:
+        row = self.find_row(prefix)
+        if row < 0:
+            raise KeyError(prefix)
+        return self.row_view(row)
+
+    def get(self, prefix, default=None):
+        row = self.find_row(prefix)
+        return self.row_view(row) if row >= 0 else default
+
+    def __contains__(self, prefix) -> bool:
+        return self.find_row(prefix) >= 0
+
+    def __iter__(self):
+        for key in self.table.keys:
+            yield self.store.unpack(key, self.length)
+
+    def __len__(self) -> int:
+        return len(self.table.keys)
+
+    def items(self):
+        for row, key in enumerate(self.table.keys):
+            yield self.store.unpack(key, self.length), self.row_view(row)
+
+
+class UnigramView(Mapping):
+    """Read-only view of the unigram Counter, keyed by 1-tuples like the dict model."""
+
+    def __init__(self, store: 'CompactNgramStore'):
+        self.store = store
+
+    def __getitem__(self, gram) -> int:
+        word_id = self.store.vocab.lookup(gram[0]) if isinstance(gram, tuple) and len(gram) == 1 else -1
+        if word_id < 0 or not self.store.unigram_counts[word_id]:
+            raise KeyError(gram)
+        return self.store.unigram_counts[word_id]
+
+    def get(self, gram, default=None):
+        try:
+            return self[gram]
+        except KeyError:
+            return default
+
+    def __contains__(self, gram) -> bool:
+        return self.get(gram) is not None
+
+    def __iter__(self):
+        for word_id, count in enumerate(self.store.unigram_counts):
+            if count:
+                yield (self.store.vocab.words[word_id],)
+
+    def __len__(self) -> int:
+        return self.store.unigram_types
+
+    def values(self):
+        return [count for count in self.store.unigram_counts if count]
+
+    def items(self):
+        words = self.store.vocab.words
+        return [((words[word_id],), count) for word_id, count in enumerate(self.store.unigram_counts) if count]
+
+
+class RankedRow(Sequence):
+    """Lazy (word, count) list for one row, in rank order, '</s>' excluded."""
+
+    __slots__ = ('table', 'vocab', 'start', 'size')
+
+    def __init__(self, table: CsrTable, vocab: Vocabulary, start: int, size: int):
+        self.table = table
+        self.vocab = vocab
+        self.start = start
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.size))]
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        position = self.start + self.table.ranks[self.start + i]
+        return self.vocab.words[self.table.successors[position]], self.table.counts[position]
+
+
+class RankedUnigrams(Sequence):
+    """Lazy (word, count) list of all non-special words by count desc."""
+
+    def __init__(self, store: 'CompactNgramStore'):
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.store.unigram_ranks)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        word_id = self.store.unigram_ranks[i]
+        return self.store.vocab.words[word_id], self.store.unigram_counts[word_id]
+
+
+class EntryView:
+    """Builds PrefixEntry records on demand instead of materialising them."""
+
+    def __init__(self, prefixes: PrefixTableView):
+        self.prefixes = prefixes
+
+    def get(self, prefix, default=None):
+        row = self.prefixes.find_row(prefix)
+        if row < 0:
+            return default
+        table = self.prefixes.table
+        start, _ = table.span(row)
+        top = RankedRow(table, self.prefixes.store.vocab, start, table.sizes[row])
+        return PrefixEntry(table.totals[row], table.sizes[row], top, self.prefixes.row_view(row))
+
+    def __contains__(self, prefix) -> bool:
+        return self.prefixes.find_row(prefix) >= 0
+
+
+class CompactIndex(SuccessorIndex):
+    """SuccessorIndex over a CompactNgramStore.
+
+    Every row is already rank-ordered, so top lists are complete and cost
+    nothing to build; any top_k is supported.
+    """
+
+    def __init__(self, store: 'CompactNgramStore', top_n: int = DEFAULT_TOP_N):
+        super().__init__(top_n)
+        self.trigrams = EntryView(store.trigrams)
+        self.bigrams = EntryView(store.bigrams)
+        self.unigram_total = store.unigram_total
+        self.unigram_ranked = RankedUnigrams(store)
+
+    def supports(self, top_k: int) -> bool:
+        return True
+
+    def nbytes(self, sample_size: int = 1000) -> int:
+        # entries and rankings are views over the store's arrays
+        return 0
+
+
+class CompactNgramStore:
+    """Integer-id, array-backed storage for the three n-gram tables.
+
+    Exposes ``trigrams``/``bigrams``/``unigrams`` views with the same lookup
+    interface as the dict tables, so NgramModel code runs on it unchanged.
+    The store is read-only.
+    """
+
+    def __init__(self, vocab: Vocabulary, unigram_counts: array, unigram_ranks: array,
+                 unigram_total: int, unigram_types: int, trigram_table: CsrTable,
+                 bigram_table: CsrTable):
+        self.vocab = vocab
+        self.radix = max(len(vocab), 1)
+        self.unigram_counts = unigram_counts
+        self.unigram_ranks = unigram_ranks
+        self.unigram_total = unigram_total
+        self.unigram_types = unigram_types
+
+        self.trigram_table = trigram_table
+        self.bigram_table = bigram_table
+        self.trigrams = PrefixTableView(self, trigram_table, 2)
+        self.bigrams = PrefixTableView(self, bigram_table, 1)
+        self.unigrams = UnigramView(self)
+
+    @classmethod
+    def from_tables(cls, trigrams, bigrams, unigrams) -> 'CompactNgramStore':
+        vocab = Vocabulary()
+        for gram in unigrams:
+            vocab.add(gram[0] if isinstance(gram, tuple) else gram)
+        for table in (bigrams, trigrams):
+            for prefix, successors in table.items():
+                for word in prefix:
+                    vocab.add(word)
+                for word in successors:
+                    vocab.add(word)
+
+        unigram_counts = array('Q', bytes(8 * len(vocab)))
+        for gram, count in unigrams.items():
+            unigram_counts[vocab.lookup(gram[0] if isinstance(gram, tuple) else gram)] = count
+
+        special_ids = {vocab.lookup(token) for token in SPECIAL_TOKENS}
+        ranked = [i for i, count in enumerate(unigram_counts) if count and i not in special_ids]
+        ranked.sort(key=lambda i: unigram_counts[i], reverse=True)
+        unigram_ranks = array('I', ranked)
+        unigram_total = sum(unigram_counts)
+        unigram_types = sum(1 for count in unigram_counts if count)
+
+        radix = max(len(vocab), 1)
+        end_id = vocab.lookup(END_TOKEN)
+
+        def rows_of(table):
+            rows = defaultdict(list)
+            for prefix, successors in table.items():
+                key = 0
+                for word in prefix:
+                    key = key * radix + vocab.lookup(word)
+                rows[key].extend((vocab.lookup(word), count) for word, count in successors.items())
+            return rows
+
+        return cls(vocab, unigram_counts, unigram_ranks, unigram_total, unigram_types,
+                   CsrTable.build(rows_of(trigrams), end_id), CsrTable.build(rows_of(bigrams), end_id))
+
+    def pack(self, prefix) -> int:
+        key = 0
+        for word in prefix:
+            word_id = self.vocab.lookup(word)
+            if word_id < 0:
+                return -1
+            key = key * self.radix + word_id
+        return key
+
+    def unpack(self, key: int, length: int) -> Tuple[str, ...]:
+        word_ids = []
+        for _ in range(length):
+            key, word_id = divmod(key, self.radix)
+            word_ids.append(word_id)
+        return tuple(self.vocab.words[word_id] for word_id in reversed(word_ids))
+
+    def build_index(self, top_n: int = DEFAULT_TOP_N) -> CompactIndex:
+        return CompactIndex(self, top_n)
+
+    def to_dict(self) -> Dict:
+        # the plain dict/Counter layout written by NgramModel.save_model; rows
+        # in rank order, so tied counts keep their order in the dict model
+        words = self.vocab.words
+
+        def counters(view):
+            table = view.table
+            result = {}
+            for row, (prefix, _) in enumerate(view.items()):
+                start, end = table.span(row)
+                ranked = [start + table.ranks[i] for i in range(start, end)]
+                result[prefix] = Counter({words[table.successors[i]]: table.counts[i] for i in ranked})
+            return result
+
+        return {
+            'trigrams': counters(self.trigrams),
+            'bigrams': counters(self.bigrams),
+            'unigrams': dict(self.unigrams.items()),
+        }
+
+    def nbytes(self) -> int:
+        arrays = self.unigram_counts.itemsize * len(self.unigram_counts) + \
+            self.unigram_ranks.itemsize * len(self.unigram_ranks)
+        return arrays + self.trigram_table.nbytes() + self.bigram_table.nbytes()
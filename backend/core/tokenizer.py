@@ -0,0 +1,136 @@
+import re
+import sys
+from typing import Iterator, List
+
+# the original two-pass normalisation, kept as the conformance reference
+LEGACY_STRIP = re.compile(r"[^\w\s']|'(?![a-z])|(?<![a-z])'")
+LEGACY_SPACED_APOSTROPHE = re.compile(r"\s+'\s+|^'\s+|\s+'$")
+
+# apostrophes that are not between two ascii letters; like LEGACY_STRIP the
+# lookarounds see the text before anything is removed
+STRAY_APOSTROPHE = re.compile(r"'(?![a-z])|(?<![a-z])'")
+
+# ascii characters LEGACY_STRIP deletes: everything but \w, \s and "'"
+ASCII_DELETE = str.maketrans('', '', ''.join(
+    chr(c) for c in range(128)
+    if not (chr(c).isalnum() or chr(c) == '_' or chr(c).isspace() or chr(c) == "'")
+))
+
+
+def reference_normalize(text: str) -> str:
+    text = text.lower().strip()
+    text = LEGACY_STRIP.sub('', text)
+    text = LEGACY_SPACED_APOSTROPHE.sub(' ', text)
+    return text
+
+
+def reference_tokenize(text: str, special_tokens: bool = True) -> List[str]:
+    if not text.strip():
+        return []
+    tokens = [t for t in reference_normalize(text).split() if t]
+    if special_tokens:
+        return ['<s>'] + tokens + ['</s>']
+    return tokens
+
+
+class Tokenizer:
+    """Drop-in replacement for the regex normalisation in NgramModel.
+
+    Every kept apostrophe sits between two letters, so the old second pass
+    (spaced apostrophes) can never match and is dropped. ASCII text, the
+    common case, is cleaned with one ``str.translate`` (plus one small regex
+    when it contains apostrophes); anything else goes through the compiled
+    original pattern. ``tokenize_many`` does the same over a whole buffer
+    of lines at once.
+    """
+
+    def clean(self, text: str) -> str:
+        # text must already be lowercased
+        if text.isascii():
+            if "'" in text:
+                text = STRAY_APOSTROPHE.sub('', text)
+            return text.translate(ASCII_DELETE)
+        return LEGACY_STRIP.sub('', text)
+
+    def normalize(self, text: str) -> str:
+        return self.clean(text.lower().strip())
+
+    def tokenize(self, text: str, special_tokens: bool = True) -> List[str]:
+        if not text.strip():
+            return []
+        tokens = self.clean(text.lower()).split()
+        if special_tokens:
+            return ['<s>'] + tokens + ['</s>']
+        return tokens
+
+    def tokenize_many(self, buffer: str, special_tokens: bool = True) -> Iterator[List[str]]:
+        """Tokenize every non-blank '\\n'-separated line of ``buffer``."""
+        # cleaning never touches whitespace, so the lines stay aligned
+        cleaned = self.clean(buffer.lower()).split('\n')
+        for raw, line in zip(buffer.split('\n'), cleaned):
+            if not raw or raw.isspace():
+                continue
+            tokens = line.split()
+            if special_tokens:
+                yield ['<s>'] + tokens + ['</s>']
+            else:
+                yield tokens
+
+    def tails(self, texts: List[str], length: int) -> List[List[str]]:
+        """The last ``length`` tokens of each text, as ``tokenize(text, False)[-length:]``.
+
+        A token never spans whitespace, so only the last ``length`` words of
+        each text are cleaned, all in one pass over a joined buffer; a text
+        whose last words clean away to fewer tokens is tokenized whole.
+        """
+        parts = [text.rsplit(None, length) for text in texts]
+        # the words hold no whitespace, so the lines stay aligned
+        buffer = '\n'.join(' '.join(words[-length:]) for words in parts)
+        cleaned = self.clean(buffer.lower()).split('\n')
+        tails = []
+        for text, words, line in zip(texts, parts, cleaned):
+            tokens = line.split()
+            if len(tokens) < length and len(words) > length:
+                tokens = self.tokenize(text, False)
+            tails.append(tokens[-length:])
+        return tails
+
+
+DEFAULT_TOKENIZER = Tokenizer()
+
+
+def check_conformance(file_paths: List[str], encoding: str = 'utf-8') -> int:
+    """Compare Tokenizer against the reference on every line of the given files.
+
+    Returns the number of mismatching lines.
+    """
+    tokenizer = DEFAULT_TOKENIZER
+    mismatches = 0
+    for file_path in file_paths:
+        with open(file_path, 'r', encoding=encoding, errors='ignore') as f:
+            content = f.read()
+        lines = [line.strip() for line in content.split('\n') if line.strip()]
+
+        expected = [reference_tokenize(line) for line in lines]
+        single = [tokenizer.tokenize(line) for line in lines]
+        bulk = list(tokenizer.tokenize_many(content))
+
+        file_mismatches = 0
+        for line, want, got in zip(lines, expected, single):
+            if want != got or tokenizer.normalize(line) != reference_normalize(line):
+                file_mismatches += 1
+                if file_mismatches <= 5:
+                    print(f"  mismatch: {line!r}\n    expected {want}\n    got      {got}")
+        if bulk != expected:
+            file_mismatches += 1
+            print("  tokenize_many output differs from line-by-line tokenization")
+
+        status = "✓" if not file_mismatches else "✗"
+        print(f"{status} {file_path}: {len(lines):,} lines, {file_mismatches} mismatches")
+        mismatches += file_mismatches
+    return mismatches
+
+
+if __name__ == "__main__":
+    # python -m core.tokenizer data/*.txt
+    sys.exit(1 if check_conformance(sys.argv[1:]) else 0)
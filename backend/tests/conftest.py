@@ -0,0 +1,40 @@
+import os
+import random
+import sys
+from typing import List
+
+import pytest
+
+# the app imports its modules as ``core.*`` from the backend directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.ngrams import NgramModel  # noqa: E402
+
+
+def synthetic_corpus(seed: int = 7, sentences: int = 400, words: int = 40) -> List[str]:
+    # a small vocabulary makes tied counts common, which is what the ranking has to agree on
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(words)]
+    return [" ".join(rng.choice(vocab) for _ in range(rng.randint(2, 12))) for _ in range(sentences)]
+
+
+@pytest.fixture(scope="session")
+def corpus() -> List[str]:
+    return synthetic_corpus()
+
+
+@pytest.fixture(scope="session")
+def train_model(corpus):
+    """Trains a new model on the corpus, for tests that change the model or need several"""
+    def train(order: int = 3) -> NgramModel:
+        model = NgramModel(order=order)
+        model.train(corpus)
+        return model
+
+    return train
+
+
+@pytest.fixture(scope="module")
+def trained_model(train_model) -> NgramModel:
+    """A trigram model shared by a module's tests, which only read from it"""
+    return train_model()
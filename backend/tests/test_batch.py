@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+from core.tokenizer import DEFAULT_TOKENIZER
+
+
+@pytest.fixture(scope="module")
+def models(trained_model, train_model):
+    compact_model = train_model()
+    compact_model.compact()
+    return trained_model, compact_model, train_model(order=4)
+
+
+def texts(count: int = 400, seed: int = 5):
+    # repeated and unseen words, punctuation that cleans away, short and blank texts
+    rng = random.Random(seed)
+    pieces = [f"w{i}" for i in range(44)] + ["W3,", "--", "'", "w1's", "!!", "w2."]
+    result = [" ".join(rng.choice(pieces) for _ in range(rng.randint(0, 6))) for _ in range(count)]
+    return result + ["", "   ", "w1", "w1 w2 !!", "w1 w2\n--  ''"]
+
+
+def test_batch_matches_predict_next(models):
+    for model in models:
+        batch = texts()
+        for top_k in (1, 3, 5, 16, 60):
+            expected = [model.predict_next(text, top_k) for text in batch]
+            assert model.predict_batch(batch, top_k) == expected, (model.order, top_k)
+
+
+def test_batch_results_are_independent_lists(models):
+    dict_model = models[0]
+    results = dict_model.predict_batch(["w1 w2", "w1 w2"], 3)
+    results[0].append("extra")
+    assert results[1] == dict_model.predict_next("w1 w2", 3)
+
+
+def test_tails_match_full_tokenization():
+    batch = texts() + ["Don't  STOP", "a 'b' c", "İstanbul çay'ı", "x   y"]
+    for length in (1, 2, 3):
+        expected = [DEFAULT_TOKENIZER.tokenize(text, False)[-length:] for text in batch]
+        assert DEFAULT_TOKENIZER.tails(batch, length) == expected
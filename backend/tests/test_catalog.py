@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+import core.catalog
+from core.catalog import ModelCatalog, sidecar_path
+
+
+@pytest.fixture
+def saved_model(tmp_path, monkeypatch, trained_model) -> str:
+    monkeypatch.chdir(tmp_path)
+    trained_model.save_model('small.pkl')
+    path = os.path.join('trained_models', 'small.pkl')
+    os.remove(sidecar_path(path))
+    return path
+
+
+def test_backfill_without_sidecar_writes_one(saved_model):
+    info = ModelCatalog('trained_models').describe('small.pkl')
+    assert info['status'] == 'valid'
+    assert os.path.exists(sidecar_path(saved_model))
+
+
+def test_unwritable_sidecar_still_lists_the_model(saved_model, monkeypatch):
+    def read_only(model_path, metadata):
+        raise PermissionError("read-only file system")
+
+    monkeypatch.setattr(core.catalog, 'store_metadata', read_only)
+    catalog = ModelCatalog('trained_models')
+    info = catalog.describe('small.pkl')
+    assert info['status'] == 'valid'
+    assert info['vocab_size'] > 0
+    # kept in memory, so the next listing does not unpickle it again
+    catalog.describe('small.pkl')
+    assert catalog.backfills == 1
@@ -0,0 +1,78 @@
+import math
+import random
+from collections import Counter, defaultdict
+from typing import List
+
+import pytest
+
+from core.index import SPECIAL_TOKENS
+
+
+@pytest.fixture(scope="module")
+def order5(train_model):
+    return train_model(order=5)
+
+
+def histories(corpus: List[str], count: int = 200, seed: int = 5):
+    # half taken from the corpus, so the 4- and 5-gram stages are reached
+    rng = random.Random(seed)
+    sentences = [s.split() for s in corpus if len(s.split()) >= 5]
+    found = []
+    for _ in range(count // 2):
+        words = rng.choice(sentences)
+        start = rng.randrange(len(words) - 3)
+        found.append(" ".join(words[start:start + 4]))
+    found += [" ".join(f"w{rng.randrange(42)}" for _ in range(4)) for _ in range(count - len(found))]
+    return found
+
+
+def test_larger_top_k_only_extends_the_ranking(order5, corpus):
+    sources = {c['source'] for history in histories(corpus)
+               for c in order5.rank_context(order5.tokenize(history, False), 80)}
+    assert {'4-gram', '5-gram'} <= sources
+    for history in histories(corpus):
+        longest = order5.predict_next(history, 80)  # past what the index covers
+        for top_k in (1, 3, 5, 10, 50):
+            assert order5.predict_next(history, top_k) == longest[:top_k], (history, top_k)
+
+
+def count_successors(model, corpus: List[str]):
+    # every n-gram counted afresh, keyed by its context
+    successors = defaultdict(Counter)
+    for text in corpus:
+        sentence = model.tokenize(text)
+        for n in range(1, model.order + 1):
+            for i in range(len(sentence) - n + 1):
+                successors[tuple(sentence[i:i + n - 1])][sentence[i + n - 1]] += 1
+    return successors
+
+
+def brute_force_ranking(model, successors, tokens: List[str], top_k: int):
+    # backs off from the longest context, as the model should
+    sources = {1: 'unigram', 2: 'bigram', 3: 'trigram'}
+    ranked, seen = [], set()
+    for n in range(model.order, 0, -1):
+        context = tuple(tokens[len(tokens) - n + 1:]) if n > 1 else ()
+        if len(ranked) >= top_k or len(context) < n - 1 or context not in successors:
+            continue
+        counts = successors[context]
+        total = sum(counts.values())
+        stage = [(word, math.log((count + 1) / (total + model.vocab_size)), sources.get(n, f'{n}-gram'))
+                 for word, count in counts.items() if word not in SPECIAL_TOKENS and word not in seen]
+        seen.update(word for word, _, _ in stage)
+        ranked += sorted(stage, key=lambda c: c[1], reverse=True)
+    return ranked
+
+
+def test_backoff_matches_brute_force_counts(order5, corpus):
+    successors = count_successors(order5, corpus)
+    for history in histories(corpus):
+        tokens = order5.tokenize(history, False)
+        for top_k in (1, 5, 50):
+            expected = brute_force_ranking(order5, successors, tokens, top_k)
+            got = order5.rank_context(tokens, top_k)
+            # tied words may come out in either order, so compare probabilities by position
+            assert [(c['source'], c['prob']) for c in got] == \
+                [(source, pytest.approx(prob)) for _, prob, source in expected[:top_k]], (history, top_k)
+            probs = {word: prob for word, prob, _ in expected}
+            assert all(c['prob'] == pytest.approx(probs[c['word']]) for c in got), (history, top_k)
@@ -0,0 +1,18 @@
+import random
+
+
+def contexts(model, count: int = 200, seed: int = 5):
+    # seen trigram prefixes, plus pairs that back off to the bigram and unigram stages
+    rng = random.Random(seed)
+    seen = sorted(model.trigrams)
+    found = [rng.choice(seen) for _ in range(count // 2)]
+    return found + [(f"w{rng.randrange(44)}", f"w{rng.randrange(44)}") for _ in range(count - len(found))]
+
+
+def test_index_ranks_like_the_full_scan(trained_model):
+    index = trained_model.index
+    for w1, w2 in contexts(trained_model):
+        for top_k in (1, 3, 5, 10, 50):
+            assert index.supports(top_k)
+            expected = trained_model.score_candidates(w1, w2, top_k)[:top_k]
+            assert index.predict(w1, w2, top_k, trained_model.vocab_size) == expected, (w1, w2, top_k)
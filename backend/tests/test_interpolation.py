@@ -0,0 +1,15 @@
+import random
+
+
+def texts(count: int = 200, seed: int = 5):
+    # words from the corpus and a few it never saw
+    rng = random.Random(seed)
+    return [" ".join(f"w{rng.randrange(44)}" for _ in range(rng.randint(2, 4))) for _ in range(count)]
+
+
+def test_fast_mode_returns_the_exact_ranking(trained_model):
+    for text in texts():
+        for top_k in (1, 3, 5, 10, 50):
+            exact = trained_model.predict_with_interpolation(text, top_k, 'exact')
+            assert exact
+            assert trained_model.predict_with_interpolation(text, top_k, 'fast') == exact, (text, top_k)
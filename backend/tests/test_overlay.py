@@ -0,0 +1,52 @@
+from core.overlay import OverlayCounts, OverlayStore
+
+
+def test_learns_from_two_workers_are_both_kept(tmp_path):
+    # two stores over one directory stand in for two server workers
+    first, second = OverlayStore(str(tmp_path)), OverlayStore(str(tmp_path))
+    first.learn("user:a", ["alpha beta gamma"])
+    assert second.get("user:a").unigrams[("alpha",)] == 1
+
+    first.learn("user:a", ["delta epsilon"])
+    counts = second.learn("user:a", ["zeta eta"])
+    assert counts.revision == 3
+    assert all(counts.unigrams[(word,)] == 1 for word in ("alpha", "delta", "zeta"))
+    assert first.get("user:a").unigrams[("zeta",)] == 1
+
+
+def test_models_follow_other_workers(tmp_path, trained_model):
+    first, second = OverlayStore(str(tmp_path)), OverlayStore(str(tmp_path))
+    assert second.peek("user:a", trained_model) == (True, None)
+
+    first.learn("user:a", ["w1 w2 novel"])
+    # a key without a file is not remembered as absent
+    assert second.peek("user:a", trained_model) == (False, None)
+    model = second.model("user:a", trained_model)
+    assert "novel" in model.predict_next("w1 w2", 3)
+    assert second.peek("user:a", trained_model) == (True, model)
+
+    first.learn("user:a", ["w1 w2 novel"])
+    assert second.peek("user:a", trained_model) == (False, None)
+    assert second.model("user:a", trained_model).counts.revision == 2
+
+    first.delete("user:a")
+    assert second.peek("user:a", trained_model) == (True, None)
+    assert second.get("user:a") is None
+
+
+def test_prune_bounds_unigrams_too():
+    counts = OverlayCounts().learned([f"word{i}" for i in range(500)], max_ngrams=100)
+    assert counts.ngrams <= 100
+    assert not counts.trigrams and len(counts.unigrams) <= 100
+
+
+def test_model_size_counts_merged_entries(tmp_path, trained_model):
+    store = OverlayStore(str(tmp_path))
+    store.learn("user:a", [f"w{i} w{i + 1} w{i + 2} novel" for i in range(30)])
+    model = store.model("user:a", trained_model)
+    before = model.memory_bytes()
+    for i in range(30):
+        model.predict_next(f"w{i} w{i + 1}", 5)
+    merged = len(model.index.trigrams.merged) + len(model.index.bigrams.merged)
+    assert merged and model.memory_bytes() - before > merged * trained_model.index.top_n
+    assert store.stats()["overlays"]["user:a"]["size_kb"] * 1024 >= model.memory_bytes() - 1024
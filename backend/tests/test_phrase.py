@@ -0,0 +1,21 @@
+import random
+
+from core.phrase import PHRASE_METHODS, PhraseSearch
+
+
+def texts(count: int = 40, seed: int = 5):
+    rng = random.Random(seed)
+    return [" ".join(f"w{rng.randrange(44)}" for _ in range(rng.randint(2, 4))) for _ in range(count)]
+
+
+def test_memoized_expansions_give_the_fresh_result(trained_model):
+    shared = PhraseSearch(trained_model)
+    for method in PHRASE_METHODS:
+        # wide beams first, so narrower ones are served from cut-down memo entries
+        for beam_width in (8, 4, 2, 4):
+            for text in texts():
+                fresh = PhraseSearch(trained_model, max_entries=0)
+                expected = fresh.search(text, beam_width=beam_width, method=method)
+                assert shared.search(text, beam_width=beam_width, method=method) == expected, \
+                    (method, beam_width, text)
+    assert shared.stats()["hits"] > 0
@@ -0,0 +1,18 @@
+import pickle
+
+from core.pruning import model_stats, pickled_size, prune_model
+
+
+def test_kept_trigrams_keep_their_bigram_prefix(trained_model):
+    model = trained_model
+    pruned = prune_model(model, min_counts={2: 1000})
+    assert pruned.trigrams
+    assert all(w2 in pruned.bigrams[(w1,)] for w1, w2 in pruned.trigrams)
+    assert all(pruned.bigrams[(w1,)][w2] == model.bigrams[(w1,)][w2] for w1, w2 in pruned.trigrams)
+
+
+def test_pickled_size_is_close_to_the_saved_pickle(trained_model):
+    model = trained_model
+    exact = len(pickle.dumps(model.to_dict()))
+    assert abs(pickled_size(model.to_dict(), chunk_rows=50) - exact) <= exact * 0.15
+    assert model_stats(model)["trigram_entries"] == sum(len(row) for row in model.trigrams.values())
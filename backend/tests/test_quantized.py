@@ -0,0 +1,10 @@
+from core.quantized import QuantizedModel, heldout_contexts, ranking_agreement
+
+
+def test_rankings_agree_at_16_bits(trained_model, corpus):
+    quantized = QuantizedModel.from_model(trained_model, bits=16)
+    contexts = heldout_contexts(trained_model, corpus, 500)
+    for top_k in (1, 5, 10):
+        agreement = ranking_agreement(trained_model, quantized, contexts, top_k)
+        assert agreement["tie_aware_match"] == 1.0, agreement
+        assert agreement["top1_agreement"] == 1.0, agreement
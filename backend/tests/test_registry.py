@@ -0,0 +1,55 @@
+import pytest
+
+from core.mixture import MixtureModel
+from core.registry import ModelRegistry
+
+
+def test_failed_load_keeps_the_pinned_model(trained_model):
+    def loader(path):
+        if path == "broken.pkl":
+            raise OSError("unreadable")
+        return None if path == "missing.pkl" else trained_model
+
+    registry = ModelRegistry({"good": "good.pkl", "broken": "broken.pkl", "missing": "missing.pkl"}, loader)
+    registry.get("good", pin=True)
+    with pytest.raises(OSError):
+        registry.get("broken", pin=True)
+    assert registry.get("missing", pin=True) is None
+    assert registry.pinned == {"good"}
+
+
+def test_memory_bytes_counts_derived_structures(train_model):
+    model = train_model()
+    before = model.memory_bytes()
+    model.complete("w1 w", 3)
+    assert model.memory_bytes() > before
+
+
+def test_resize_picks_up_scoring_tables(train_model):
+    model = train_model()
+    registry = ModelRegistry({"good": "good.pkl"}, lambda path: model)
+    registry.get("good")
+    loaded_size = registry.entries["good"].size_bytes
+    model.scorer("kneser_ney")
+    registry.resize(model)
+    assert registry.entries["good"].size_bytes > loaded_size
+
+
+def test_evicted_models_are_handed_to_on_evict(trained_model, train_model):
+    released = []
+    # room for one model only
+    budget = trained_model.memory_bytes() * 3 // 2
+    registry = ModelRegistry({"a": "a.pkl", "b": "b.pkl"}, lambda path: train_model(),
+                             memory_budget=budget, on_evict=released.append)
+    first = registry.get("a")
+    registry.get("b")
+    assert released == [first]
+    assert not registry.is_resident("a")
+
+
+def test_mixture_size_follows_its_caches(train_model):
+    mixture = MixtureModel({"a": train_model(), "b": train_model()}, {"a": 0.5, "b": 0.5}, 1000)
+    before = mixture.memory_bytes()
+    for i in range(1, 50):
+        mixture.predict_next(f"w{i} w{i + 1}", 5)
+    assert mixture.memory_bytes() > before
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from core.binary import convert_pickle, holds_model
+from core.catalog import read_metadata
+from core.ngrams import NgramModel
+
+
+@pytest.mark.parametrize("scoring", [False, True])
+def test_kneser_ney_tables_are_saved_only_on_request(tmp_path, monkeypatch, train_model, scoring):
+    monkeypatch.chdir(tmp_path)
+    model = train_model()
+    model.save_model('small.pkl', scoring=scoring)
+
+    loaded = NgramModel.load_model('small.pkl')
+    assert (loaded.kn_tables is not None) == scoring
+    # built on first use otherwise, with the same result
+    for context in ("w1 w2", "w3 w4", "w5 w40"):
+        assert loaded.predict_scored(context, 5) == model.predict_scored(context, 5)
+
+
+def test_higher_order_pickles_are_not_converted(tmp_path, monkeypatch, caplog, trained_model, train_model):
+    monkeypatch.chdir(tmp_path)
+    trained_model.save_model('tri.pkl')
+    train_model(order=4).save_model('four.pkl')
+
+    assert holds_model('trained_models/tri.pkl')
+    assert convert_pickle('trained_models/tri.pkl') == 'trained_models/tri.ngb'
+    assert not holds_model('trained_models/four.pkl')
+    assert convert_pickle('trained_models/four.pkl') is None
+    assert not os.path.exists('trained_models/four.ngb')
+    assert "order-4" in caplog.text
+
+
+def test_binary_sidecars_describe_what_the_file_holds(tmp_path, monkeypatch, trained_model, train_model):
+    monkeypatch.chdir(tmp_path)
+    train_model(order=4).save_model('four.ngb', binary=True)
+    metadata = read_metadata('trained_models/four.ngb')
+    assert metadata['order'] == 3 and set(metadata['ngram_counts']) == {'1', '2', '3'}
+
+    trained_model.save_model('tri.pkl')
+    convert_pickle('trained_models/tri.pkl')
+    converted = read_metadata('trained_models/tri.ngb')
+    assert converted['ngram_counts'] == read_metadata('trained_models/tri.pkl')['ngram_counts']
+    assert converted['build']['source'] == 'convert_pickle'
@@ -0,0 +1,30 @@
+import asyncio
+import threading
+
+import pytest
+
+from core.serving import ServingExecutor, WorkTimeout
+
+
+def test_timed_out_prediction_stays_pending_until_its_thread_finishes():
+    executor = ServingExecutor(predict_workers=1, max_pending=1)
+    release = threading.Event()
+
+    async def main():
+        with pytest.raises(WorkTimeout):
+            await executor.predict(release.wait, 5, timeout=0.05)
+        # the thread is still busy, so the slot is still taken
+        assert executor.stats()["pending"] == 1
+        release.set()
+        for _ in range(100):
+            if executor.stats()["pending"] == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert executor.stats()["pending"] == 0
+        assert await executor.predict(sum, [1, 2]) == 3
+
+    try:
+        asyncio.run(main())
+    finally:
+        release.set()
+        executor.shutdown()
@@ -0,0 +1,26 @@
+import pytest
+
+from core.session import MAX_SESSION_CHARS, Resync, SessionContext
+
+
+def state(session: SessionContext):
+    return session.text, session.boundary, list(session.tokens), session.context()
+
+
+def test_edits_match_a_fresh_session():
+    session = SessionContext("the quick brown")
+    session.edit(5, "red fox jum")
+    session.edit(3, "")
+    session.edit(0, " over")
+    assert session.context() == SessionContext("the quick red fox over").context()
+
+
+@pytest.mark.parametrize("kept", [10, -1])
+def test_rejected_edit_leaves_the_session_unchanged(kept):
+    # long enough to be trimmed, so deleting far back reaches text the session dropped
+    session = SessionContext(" ".join(f"word{i}" for i in range(400)))
+    assert session.trimmed and len(session.text) <= MAX_SESSION_CHARS
+    before = state(session)
+    with pytest.raises(Resync):
+        session.edit(len(session.text) - kept, "more")
+    assert state(session) == before
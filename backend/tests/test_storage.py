@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+from core.ngrams import NgramModel
+
+
+@pytest.fixture(scope="module")
+def models(trained_model, train_model):
+    compact_model = train_model()
+    compact_model.compact()
+    return trained_model, compact_model
+
+
+def contexts(count: int = 300, seed: int = 11):
+    rng = random.Random(seed)
+    return [f"w{rng.randrange(42)} w{rng.randrange(42)}" for _ in range(count)]
+
+
+def test_compact_backoff_matches_dict_model(models):
+    dict_model, compact_model = models
+    for context in contexts():
+        for top_k in range(1, 17):
+            assert compact_model.predict_next(context, top_k) == dict_model.predict_next(context, top_k), (context, top_k)
+
+
+def test_compact_backoff_matches_full_scan(models):
+    dict_model, compact_model = models
+    for context in contexts(100):
+        w1, w2 = context.split()
+        for top_k in (1, 5, 16):
+            expected = [c['word'] for c in dict_model.score_candidates(w1, w2, top_k)[:top_k]]
+            assert [c['word'] for c in compact_model.rank_next(w1, w2, top_k)] == expected, (context, top_k)
+
+
+def test_compact_interpolation_matches_dict_model(models):
+    dict_model, compact_model = models
+    for context in contexts(100):
+        assert compact_model.predict_with_interpolation(context, 8) == dict_model.predict_with_interpolation(context, 8)
+
+
+def test_compact_tables_round_trip_keeps_ranking(models):
+    dict_model, compact_model = models
+    # what save_model writes for a compact model
+    restored = NgramModel(compact_model.storage.to_dict())
+    for context in contexts(100):
+        assert restored.predict_next(context, 10) == dict_model.predict_next(context, 10)
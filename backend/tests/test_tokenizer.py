@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from core.tokenizer import DEFAULT_TOKENIZER, reference_normalize, reference_tokenize
+
+FIXED = [
+    "Hello, World!",
+    "don't stop",
+    "'quoted' words",
+    "it's   the dogs' bone",
+    "rock 'n' roll",
+    "L'Été à Paris",
+    "naïve café ÇA",
+    "İstanbul",
+    "İ",
+    "ǅemal",
+    "ΣΊΣΥΦΟΣ",
+    "Straße",
+    "tab\tseparated\vwords",
+    "under_score and 3.14",
+    "emoji 👍 and — dashes",
+    "x'",
+    "'",
+    " ' ",
+    "a ' b",
+    "O'NEIL's",
+    "",
+    "   ",
+    "\n",
+]
+
+# the characters the two normalisations treat differently are the ones worth mixing
+ALPHABET = "abcXYZ019_ '’-.,!?\t éÉİıßǅΣς😀̇ "
+
+
+def fuzz_texts(count: int = 2000, seed: int = 3):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 24))) for _ in range(count)]
+
+
+@pytest.mark.parametrize("special_tokens", [True, False])
+def test_tokenize_matches_reference(special_tokens):
+    for text in FIXED + fuzz_texts():
+        assert DEFAULT_TOKENIZER.tokenize(text, special_tokens) == reference_tokenize(text, special_tokens), text
+
+
+def test_normalize_matches_reference():
+    for text in FIXED + fuzz_texts():
+        assert DEFAULT_TOKENIZER.normalize(text) == reference_normalize(text), text
+
+
+@pytest.mark.parametrize("special_tokens", [True, False])
+def test_tokenize_many_matches_line_by_line(special_tokens):
+    for lines in (FIXED, fuzz_texts()):
+        # blank lines are skipped, like the per-line training loop did
+        lines = [line for text in lines for line in text.split("\n")]
+        expected = [reference_tokenize(line, special_tokens) for line in lines if line.strip()]
+        assert list(DEFAULT_TOKENIZER.tokenize_many("\n".join(lines), special_tokens)) == expected
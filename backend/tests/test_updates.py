@@ -0,0 +1,63 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from core.index import SuccessorIndex
+from core.layered import LayeredTable
+from core.ngrams import NgramModel
+
+
+def corpus(seed: int, sentences: int, words: int = 60):
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(words)]
+    return [" ".join(rng.choice(vocab) for _ in range(rng.randint(2, 12))) for _ in range(sentences)]
+
+
+def test_updates_match_retraining():
+    base, fresh = corpus(1, 600), corpus(2, 200, words=80)  # the update brings new words too
+    model = NgramModel()
+    model.train(base)
+    before = [model.predict_next(f"w{i} w{i + 1}", 10) for i in range(50)]
+
+    updated = model
+    for i in range(0, len(fresh), 5):
+        updated = updated.updated(fresh[i:i + 5])
+    retrained = NgramModel()
+    retrained.train(base + fresh)
+
+    assert dict(updated.trigrams) == dict(retrained.trigrams)
+    assert dict(updated.unigrams) == dict(retrained.unigrams)
+    assert updated.vocab_size == retrained.vocab_size
+    reference = SuccessorIndex().build(retrained.trigrams, retrained.bigrams, retrained.unigrams)
+    assert list(updated.index.unigram_ranked) == reference.unigram_ranked
+    for i in range(78):
+        context = f"w{i} w{i + 1}"
+        assert updated.predict_next(context, 10) == retrained.predict_next(context, 10)
+        assert updated.predict_with_interpolation(context, 10) == retrained.predict_with_interpolation(context, 10)
+
+    # the model the updates started from never sees them
+    assert [model.predict_next(f"w{i} w{i + 1}", 10) for i in range(50)] == before
+    assert model.vocab_size == len(model.unigrams) < updated.vocab_size
+
+
+def test_layered_table_shares_levels():
+    base = {i: str(i) for i in range(100)}
+    table = LayeredTable.wrap(base)
+    first = table.updated({5: 'five', 200: 'new'})
+    second = first.updated({200: 'newer', 300: 'x'})
+    assert table[5] == '5' and 200 not in table and len(table) == 100
+    assert first[5] == 'five' and first[200] == 'new' and len(first) == 101
+    assert second[200] == 'newer' and len(second) == 102
+    assert list(second) == list(range(100)) + [200, 300]
+    assert second.levels[-1] is base
+
+
+def test_completion_index_is_built_once_and_rebuilt_after_updates():
+    model = NgramModel()
+    model.train(corpus(1, 200))
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        built = set(map(id, pool.map(lambda _: model.completion_index(), range(8))))
+    assert len(built) == 1
+
+    updated = model.updated(["w1 zebra zebu"])
+    assert updated.completion_index() is not model.completion_index()
+    assert "zebra" in updated.complete("w1 zeb", 3)
@@ -1,11 +1,26 @@
+import argparse
 from core.ngrams import NgramModel
+from core.pruning import add_prune_arguments, prune_options, prune_model
+from core.highorder import MAX_ORDER
 
 def main():
-    model = NgramModel()
+    parser = argparse.ArgumentParser(description="Train an n-gram model from text files")
     # ["data/poet-en.txt", "data/std-en.txt", "data/poet-en.txt"]
-    file_paths = ["data/std-en.txt"]
-    model.train_from_files(file_paths)
-    model.save_model("std-en.pkl")
+    parser.add_argument("files", nargs="*", default=["data/std-en.txt"], help="training text files")
+    parser.add_argument("--output", default="std-en.pkl", help="model file name inside trained_models/")
+    parser.add_argument("--workers", type=int, default=1, help="processes used to count n-grams")
+    parser.add_argument("--order", type=int, default=3, help=f"longest n-gram counted (3 to {MAX_ORDER})")
+    parser.add_argument("--kneser-ney", action="store_true",
+                        help="also save the Kneser-Ney scoring tables instead of building them on first use")
+    add_prune_arguments(parser)
+    args = parser.parse_args()
+
+    model = NgramModel(order=args.order)
+    model.train_from_files(args.files, workers=args.workers)
+    options = prune_options(args)
+    if options:
+        model = prune_model(model, **options)
+    model.save_model(args.output, scoring=args.kneser_ney)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
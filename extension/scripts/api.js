@@ -47,6 +47,8 @@ class API {
                     errorMessage = `Resource not found: ${errorData || 'Unknown error'}`;
                 } else if (response.status === 500) {
                     errorMessage = `Server error: ${errorData || 'Internal server error'}`;
+                } else if (response.status === 409) {
+                    errorMessage = `Superseded: ${errorData || 'A newer request replaced this one'}`;
                 } else if (response.status === 503) {
                     errorMessage = `Service unavailable: ${errorData || 'Extension disabled'}`;
                 } else {
@@ -162,14 +164,16 @@ class API {
         }
     }
 
-    async predict(text, topK = 3, method = 'backoff') {
+    async predict(text, topK = 3, method = 'backoff', clientId = null) {
         try {
             const data = await this.call('/predict', {
                 method: 'POST',
                 body: JSON.stringify({
                     text,
                     top_k: topK,
-                    method
+                    method,
+                    // lets the server drop this tab's older, still-running predictions
+                    client_id: clientId
                 })
             });
             return data;
@@ -177,4 +181,30 @@ class API {
             throw new Error(`Prediction failed: ${error.message}`);
         }
     }
+
+    async predictPhrase(text, topK = 3, maxWords = 4, method = 'backoff', clientId = null) {
+        try {
+            // whole phrases in one round trip instead of one request per word
+            const data = await this.call('/predict/phrase', {
+                method: 'POST',
+                body: JSON.stringify({
+                    text,
+                    top_k: topK,
+                    max_words: maxWords,
+                    method,
+                    client_id: clientId
+                })
+            });
+            return data;
+        } catch (error) {
+            throw new Error(`Phrase prediction failed: ${error.message}`);
+        }
+    }
+
+    openSuggestionSession() {
+        // keystroke edits go up and suggestions come back on one connection (see /ws/suggest)
+        const url = `${this.baseUrl.replace(/^http/, 'ws')}/ws/suggest`;
+        console.log(`Opening suggestion session at ${url}`);
+        return new WebSocket(url);
+    }
 }
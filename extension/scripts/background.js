@@ -30,7 +30,8 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
             result = await api.switchModelOptimized(message.model);
             break;
         case "predict":
-          result = await api.predict(message.text, message.topK, message.method);
+          result = await api.predict(message.text, message.topK, message.method,
+            sender.tab ? `tab-${sender.tab.id}` : null);
           break;
         default:
           throw new Error("Unknown action: " + message.action);
@@ -44,3 +45,35 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
 
   return true; // keep message channel open for async
 });
+
+// content scripts cannot reach ws://localhost from https pages, so each tab's
+// suggestion session is a port to this worker, relayed to a server websocket
+chrome.runtime.onConnect.addListener((port) => {
+  if (port.name !== "suggest") return;
+
+  const socket = api.openSuggestionSession();
+  const queued = [];
+
+  socket.onopen = () => {
+    queued.splice(0).forEach((message) => socket.send(message));
+  };
+  socket.onmessage = (event) => {
+    try {
+      port.postMessage(JSON.parse(event.data));
+    } catch (err) {
+      console.error("Bad suggestion message:", err);
+    }
+  };
+  socket.onclose = () => port.disconnect();
+  socket.onerror = () => console.error("Suggestion session error");
+
+  port.onMessage.addListener((message) => {
+    const data = JSON.stringify(message);
+    if (socket.readyState === WebSocket.OPEN) {
+      socket.send(data);
+    } else if (socket.readyState === WebSocket.CONNECTING) {
+      queued.push(data);
+    }
+  });
+  port.onDisconnect.addListener(() => socket.close());
+});
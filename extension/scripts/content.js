@@ -1,8 +1,20 @@
+// with a suggestion session open each keystroke is one small message, so the
+// debounce only has to coalesce bursts; plain /predict requests wait longer
+const SESSION_DEBOUNCE_MS = 30;
+const HTTP_DEBOUNCE_MS = 900;
+// text sent when a session starts on a field; the server keeps about this much
+const SESSION_RESET_CHARS = 1000;
+
 class Content {
     constructor() {
         this.suggestionBox = null;
         this.currentInput = null;
         this.debounceTimer = null;
+        this.session = null;
+        this.sessionReady = false;
+        this.sessionElement = null;
+        this.sentText = '';
+        this.seq = 0;
         this.isEnabled = true;
         this.attachedElements = new Set();
         this.settings = null;
@@ -24,6 +36,7 @@ class Content {
             updateConnectionStatus(true);
             
             await this.loadSettings();
+            this.connectSession();
             await this.createSuggestionBox();
             await this.attachToExistingInputs();
             await this.observeTextInputs();
@@ -295,10 +308,111 @@ class Content {
             clearTimeout(this.debounceTimer);
         }
         
+        if (!this.session) {
+            this.connectSession();
+        }
+        
         // Debounce to avoid too many predictions
-        this.debounceTimer = setTimeout(() => {
-            this.showSuggestions(event.target);
-        }, 900);
+        if (this.sessionReady) {
+            this.debounceTimer = setTimeout(() => {
+                this.syncSession(event.target);
+            }, SESSION_DEBOUNCE_MS);
+        } else {
+            this.debounceTimer = setTimeout(() => {
+                this.showSuggestions(event.target);
+            }, HTTP_DEBOUNCE_MS);
+        }
+    }
+    
+    connectSession() {
+        try {
+            this.session = chrome.runtime.connect({ name: 'suggest' });
+        } catch (error) {
+            console.error('Could not open suggestion session:', error);
+            this.session = null;
+            return;
+        }
+        this.sessionReady = false;
+        this.sessionElement = null;
+        
+        this.session.onMessage.addListener((message) => this.handleSessionMessage(message));
+        this.session.onDisconnect.addListener(() => {
+            console.log('Suggestion session closed, using HTTP predictions');
+            this.session = null;
+            this.sessionReady = false;
+        });
+    }
+    
+    syncSession(element) {
+        if (!this.session) {
+            // the session dropped while this keystroke was debounced
+            this.showSuggestions(element);
+            return;
+        }
+        if (!this.shouldEnableForElement(element)) {
+            this.hideSuggestions();
+            return;
+        }
+        
+        const text = this.getElementText(element);
+        this.seq += 1;
+        
+        if (element !== this.sessionElement) {
+            this.sessionElement = element;
+            this.session.postMessage({ type: 'reset', text: text.slice(-SESSION_RESET_CHARS), seq: this.seq });
+        } else {
+            // typing at the end is one short edit: what differs after the common prefix
+            const sent = this.sentText;
+            const limit = Math.min(sent.length, text.length);
+            let common = 0;
+            while (common < limit && sent.charCodeAt(common) === text.charCodeAt(common)) {
+                common++;
+            }
+            // the server counts code points, so never split a surrogate pair
+            if (common > 0 && /[\uD800-\uDBFF]/.test(sent[common - 1])) {
+                common--;
+            }
+            this.session.postMessage({
+                type: 'edit',
+                delete: [...sent.slice(common)].length,
+                insert: text.slice(common),
+                seq: this.seq
+            });
+        }
+        this.sentText = text;
+    }
+    
+    handleSessionMessage(message) {
+        switch (message.type) {
+            case 'ready':
+                console.log('Suggestion session ready:', message.session_id);
+                this.sessionReady = true;
+                break;
+            case 'suggestions': {
+                // an older edit's result; the newer one is on its way
+                if (message.seq !== this.seq) return;
+                
+                const element = this.sessionElement;
+                const suggestions = message.predictions || [];
+                if (!element || suggestions.length === 0 || this.getElementText(element).length < 2) {
+                    this.hideSuggestions();
+                    return;
+                }
+                this.updateSuggestionBox(suggestions, element);
+                break;
+            }
+            case 'resync':
+                // the server lost track of the text; start the field over
+                this.sessionElement = null;
+                if (this.currentInput) {
+                    this.syncSession(this.currentInput);
+                }
+                break;
+            case 'error':
+                console.error('Suggestion session error:', message.detail);
+                this.hideSuggestions();
+                break;
+        }
     }
     
     handleKeydown(event) {
@@ -391,6 +505,10 @@ class Content {
             // Update suggestion box
             this.updateSuggestionBox(suggestions, element);
         } catch (error) {
+            // a newer keystroke's prediction is on its way; keep the current box
+            if (error.message && error.message.includes('Superseded')) {
+                return;
+            }
             console.error('Error getting suggestions:', error);
             this.hideSuggestions();
         }